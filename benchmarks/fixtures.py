@@ -0,0 +1,315 @@
+import os
+import json
+import random
+import threading
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+import numpy as np
+import pandas as pd
+
+
+
+
+# Families per group, used to build synthetic catalogs. Each scale step adds another generation of every family.
+GROUP_FAMILIES = {
+	'General Purpose - Current Generation': ['m5', 't3', 'a1'],
+	'Compute Optimized - Current Generation': ['c5', 'c5n'],
+	'Memory Optimized - Current Generation': ['r5', 'x1e', 'z1d'],
+	'Storage Optimized - Current Generation': ['i3', 'd2'],
+	'Accelerated Computing - Current Generation': ['p3', 'g4dn'],
+}
+SIZES = [('large', 2, 8), ('xlarge', 4, 16), ('2xlarge', 8, 32), ('4xlarge', 16, 64), ('8xlarge', 32, 128),
+         ('16xlarge', 64, 256)]
+# Synonym headers AWS uses on different instance type tables, cycled through so cleaning has real work to do
+NODE_TYPE_HEADERS = [
+	['Instance Size', 'vCPU', 'Mem (GiB)', 'Instance Storage (GB)', 'EBS Bandwidth (Mbps)', 'Network Bandwidth (Gbps)'],
+	['Instance', 'vCPUs', 'Memory (GiB)', 'Storage', 'Dedicated EBS Bandwidth (Mbps)', 'Networking Performance'],
+	['Model', 'vCPU*', 'Mem(GiB)', 'Instance Storage (GiB)', 'EBS Burst Bandwidth (Mbps)', 'Network Performance (Gbps)'],
+]
+STORAGE_OPTIONS = ['EBS-Only', '1 x 75 NVMe SSD', '2 x 900 NVMe SSD', '4 x 1900 NVMe SSD', '12 x 2000 HDD']
+
+
+
+
+class Instance:
+	"""
+	A synthetic instance type with its specs and prices.
+	"""
+	def __init__(self, name, groupType, vCPU, mem, storage, ebs, network, onDemand, rng):
+		self.name = name
+		self.groupType = groupType
+		self.vCPU = vCPU
+		self.mem = mem
+		self.storage = storage
+		self.ebs = ebs
+		self.network = network
+		self.onDemand = onDemand
+		self.reserved1Hour = round(onDemand * rng.uniform(0.45, 0.6), 4)
+		self.reserved6Hour = round(onDemand * rng.uniform(0.55, 0.7), 4)
+		self.spot = round(onDemand * rng.uniform(0.25, 0.45), 4)
+
+
+
+def makeCatalog(scale=1, seed=0):
+	"""
+	Build a synthetic instance catalog.
+
+	:param scale: The number of generations of every family, about 72 instance types per step.
+	:param seed: The random seed.
+	:return: A list of instances.
+	"""
+	rng = random.Random(seed)
+	catalog = []
+	for generation in range(scale):
+		for groupType, families in GROUP_FAMILIES.items():
+			for family in families:
+				name = family if generation == 0 else '%s%i' % (family, generation)
+				for size, vCPU, mem in SIZES:
+					onDemand = round(vCPU * rng.uniform(0.04, 0.09), 4)
+					ebs = 'Up to 4,750' if vCPU < 16 else '{:,}'.format(vCPU * 300)
+					network = 'Up to 10' if vCPU < 16 else str(vCPU // 2)
+					catalog.append(Instance('%s.%s' % (name, size), groupType, vCPU, mem, rng.choice(STORAGE_OPTIONS),
+					                        ebs, network, onDemand, rng))
+
+	return catalog
+
+
+def makeOnDemandHtml(catalog, regionId):
+	"""
+	Build a rendered on-demand pricing page snapshot.
+
+	:param catalog: A list of instances.
+	:param regionId: The region Id name.
+	:return: The page html.
+	"""
+	rows = ''.join('<tr><td>%s</td><td>%i</td><td>Variable</td><td>%g GiB</td><td>%s</td><td>$%.4f per Hour</td></tr>'
+	               % (i.name, i.vCPU, i.mem, i.storage, i.onDemand) for i in catalog)
+	return ('<html><body><ul><li class="lb-tabs-content-item lb-active"><div data-region="%s"><table>'
+	        '<thead><tr><th>Instance name</th><th>vCPU</th><th>ECU</th><th>Memory (GiB)</th>'
+	        '<th>Instance Storage (GB)</th><th>Linux/UNIX Usage</th></tr></thead>'
+	        '<tbody><tr><td colspan="6">Linux/UNIX</td></tr>%s</tbody></table></div></li></ul></body></html>'
+	        % (regionId, rows))
+
+
+def makeDefinedDurationHtml(catalog, regionId):
+	"""
+	Build a rendered defined duration pricing page snapshot, with one tbody per group.
+
+	:param catalog: A list of instances.
+	:param regionId: The region Id name.
+	:return: The page html.
+	"""
+	bodies = ''
+	for groupType in GROUP_FAMILIES:
+		rows = ''.join('<tr><td>%s</td><td>$%.4f per Hour</td><td>$%.4f per Hour</td></tr>'
+		               % (i.name, i.reserved1Hour, i.reserved6Hour) for i in catalog if i.groupType == groupType)
+		bodies += '<tbody><tr><th>%s</th></tr>%s</tbody>' % (groupType, rows)
+
+	return ('<html><body><div><h4>Defined Duration for Linux</h4><div class="content reg-%s"><table>%s</table></div>'
+	        '</div></body></html>' % (regionId, bodies))
+
+
+def makeNodeTypesHtml(catalog):
+	"""
+	Build a rendered instance types page snapshot, with one table per family and varying header synonyms.
+
+	:param catalog: A list of instances.
+	:return: The page html.
+	"""
+	families = {}
+	for instance in catalog:
+		families.setdefault(instance.name.split('.')[0], []).append(instance)
+
+	tables = ''
+	for tableIndex, instances in enumerate(families.values()):
+		headers = NODE_TYPE_HEADERS[tableIndex % len(NODE_TYPE_HEADERS)]
+		rows = ''.join('<tr><td>%s</td><td>%i</td><td>%g</td><td>%s</td><td>%s</td><td>%s</td></tr>'
+		               % (i.name, i.vCPU, i.mem, i.storage, i.ebs, i.network) for i in instances)
+		tables += '<table><tr>%s</tr>%s</table>' % (''.join('<th>%s</th>' % h for h in headers), rows)
+
+	return '<html><body>%s</body></html>' % tables
+
+
+def makeOfferFile(catalog, regionId):
+	"""
+	Build an EC2 offer file document. Each instance type also gets Windows and dedicated tenancy products that the
+	on-demand filters must skip.
+
+	:param catalog: A list of instances.
+	:param regionId: The region Id name.
+	:return: The offer file as a dict.
+	"""
+	products = {}
+	onDemand = {}
+	variants = [('Linux', 'Shared', 1.0), ('Windows', 'Shared', 1.8), ('Linux', 'Dedicated', 1.1)]
+	for index, instance in enumerate(catalog):
+		for variant, (operatingSystem, tenancy, priceFactor) in enumerate(variants):
+			sku = 'SKU%06i%i' % (index, variant)
+			products[sku] = {'sku': sku,
+			                 'productFamily': 'Compute Instance',
+			                 'attributes': {'instanceType': instance.name,
+			                                'vcpu': str(instance.vCPU),
+			                                'ecu': 'Variable',
+			                                'memory': '%g GiB' % instance.mem,
+			                                'storage': instance.storage,
+			                                'networkPerformance': '%s Gigabit' % instance.network,
+			                                'tenancy': tenancy,
+			                                'operatingSystem': operatingSystem,
+			                                'capacitystatus': 'Used',
+			                                'preInstalledSw': 'NA',
+			                                'licenseModel': 'No License required',
+			                                'operation': 'RunInstances',
+			                                'regionCode': regionId}}
+			termCode = sku + '.JRTCKXETXF'
+			onDemand[sku] = {termCode: {'offerTermCode': 'JRTCKXETXF',
+			                            'sku': sku,
+			                            'priceDimensions': {termCode + '.6YS6EN2CT7': {
+			                                'unit': 'Hrs', 'pricePerUnit': {'USD': '%.10f' % (instance.onDemand * priceFactor)}}}}}
+
+	return {'offerCode': 'AmazonEC2', 'products': products, 'terms': {'OnDemand': onDemand}}
+
+
+def makeSpotHistory(catalog, availabilityZone, changesPerType=24, seed=0):
+	"""
+	Build spot price history records as returned by describe_spot_price_history, newest first.
+
+	:param catalog: A list of instances.
+	:param availabilityZone: The availability zone.
+	:param changesPerType: The number of history records per instance type.
+	:param seed: The random seed.
+	:return: A list of price records.
+	"""
+	rng = random.Random(seed)
+	now = datetime.now(timezone.utc)
+	records = []
+	for instance in catalog:
+		for change in range(changesPerType):
+			records.append({'AvailabilityZone': availabilityZone,
+			                'InstanceType': instance.name,
+			                'ProductDescription': 'Linux/UNIX',
+			                'SpotPrice': '%.6f' % (instance.spot * rng.uniform(0.9, 1.1)),
+			                'Timestamp': now - timedelta(hours=change * 6 + rng.uniform(0, 6))})
+	records.sort(key=lambda record: record['Timestamp'], reverse=True)
+
+	return records
+
+
+def makeSpotHistoryFrame(catalog, availabilityZone, rows=1000000, days=30, seed=0):
+	"""
+	Build a large spot price history dataframe, as stored in the history store, spread evenly over the catalog.
+
+	:param catalog: A list of instances.
+	:param availabilityZone: The availability zone.
+	:param rows: The number of history records.
+	:param days: The number of days the records span, ending now.
+	:param seed: The random seed.
+	:return: A history dataframe indexed by InstanceType.
+	"""
+	rng = np.random.default_rng(seed)
+	instances = rng.integers(0, len(catalog), rows)
+	spot = np.array([instance.spot for instance in catalog])[instances]
+	now = pd.Timestamp.now(tz='UTC')
+	df = pd.DataFrame({'AvailabilityZone': availabilityZone,
+	                   'ProductDescription': 'Linux/UNIX',
+	                   'SpotPrice': np.round(spot * rng.uniform(0.8, 1.2, rows), 6),
+	                   'Timestamp': now - pd.to_timedelta(rng.uniform(0, days * 24 * 60 * 60, rows), unit='s')},
+	                  index=pd.Index(np.array([instance.name for instance in catalog])[instances], name='InstanceType'))
+
+	return df.sort_values('Timestamp', kind='stable')
+
+
+
+
+class StubEc2Client:
+	"""
+	A local stand-in for the boto3 ec2 client, serving recorded spot price history pages with NextToken paging.
+	"""
+	def __init__(self, records):
+		"""
+		:param records: The spot price history records, newest first.
+		"""
+		self.records = records
+		self.calls = 0
+
+
+	def describe_spot_price_history(self, MaxResults=1000, NextToken=None, StartTime=None, EndTime=None, **kwargs):
+		"""
+		Return one page of the recorded history.
+
+		:return: A response dict with SpotPriceHistory and, if there are more pages, NextToken.
+		"""
+		self.calls += 1
+		records = self.records
+		if StartTime is not None:
+			records = [record for record in records if record['Timestamp'] >= StartTime]
+		start = int(NextToken) if NextToken else 0
+		page = {'SpotPriceHistory': records[start:start + MaxResults]}
+		if start + MaxResults < len(records):
+			page['NextToken'] = str(start + MaxResults)
+
+		return page
+
+
+
+
+class FixtureServer:
+	"""
+	Serve a directory of saved pages over http on localhost, as a stand-in for the pricing pages.
+	"""
+	def __init__(self, directory):
+		"""
+		:param directory: The directory to serve.
+		"""
+		self.directory = directory
+		handler = partial(QuietRequestHandler, directory=directory)
+		self.server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+		self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+
+	def __enter__(self):
+		self.thread.start()
+		return self
+
+
+	def __exit__(self, *args):
+		self.server.shutdown()
+		self.server.server_close()
+
+
+	def getUrl(self, filename):
+		"""
+		Get the url of a served file.
+
+		:param filename: The file name in the served directory.
+		:return: The url.
+		"""
+		return 'http://127.0.0.1:%i/%s' % (self.server.server_address[1], filename)
+
+
+
+class QuietRequestHandler(SimpleHTTPRequestHandler):
+	def log_message(self, format, *args):
+		pass
+
+
+def writeFixtures(directory, catalog, regionId):
+	"""
+	Write the three page snapshots and an ec2-offer.json offer file for a catalog.
+
+	:param directory: The directory to write to.
+	:param catalog: A list of instances.
+	:param regionId: The region Id name.
+	:return: A dict of source name to file name.
+	"""
+	pages = {'onDemandPrices': ('on-demand.html', makeOnDemandHtml(catalog, regionId)),
+	         'definedDurationPrices': ('defined-duration.html', makeDefinedDurationHtml(catalog, regionId)),
+	         'nodeTypes': ('instance-types.html', makeNodeTypesHtml(catalog))}
+	for filename, html in pages.values():
+		with open(os.path.join(directory, filename), 'w', encoding='utf-8') as f:
+			f.write(html)
+	with open(os.path.join(directory, 'ec2-offer.json'), 'w') as f:
+		json.dump(makeOfferFile(catalog, regionId), f)
+
+	return {name: filename for name, (filename, html) in pages.items()}
@@ -0,0 +1,104 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import subprocess
+
+from benchmarks.runBenchmarks import compareToBaseline
+
+
+
+# Modules only needed for a live fetch, which the cached read path must not import
+HEAVY_MODULES = ['selenium', 'boto3', 'botocore', 'aiobotocore', 'lxml']
+# The imports timed, by benchmark name
+IMPORT_STATEMENTS = {
+	'import summary': 'from priceParsing.summary import loadCombinedSummary',
+	'import parseAndCombinePrices': 'import parseAndCombinePrices',
+	'import priceService': 'import priceService',
+}
+# Runs in a fresh interpreter, printing the import time and the heavy modules it pulled in
+MEASURE_SCRIPT = """
+import sys, time, json
+start = time.perf_counter()
+%s
+seconds = time.perf_counter() - start
+print(json.dumps({'seconds': seconds, 'heavy': [m for m in %r if m in sys.modules]}))
+"""
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+
+
+def measureImport(statement, repeats=10):
+	"""
+	Time an import statement in fresh interpreters.
+
+	:param statement: The import statement.
+	:param repeats: The number of interpreters to time it in.
+	:return: A list of import times in seconds, and the heavy modules it imported.
+	"""
+	timings = []
+	heavy = set()
+	for repeat in range(repeats):
+		output = subprocess.run([sys.executable, '-c', MEASURE_SCRIPT % (statement, HEAVY_MODULES)], cwd=REPO_DIR,
+		                        check=True, capture_output=True, text=True).stdout
+		result = json.loads(output.strip().splitlines()[-1])
+		timings.append(result['seconds'])
+		heavy.update(result['heavy'])
+
+	return timings, sorted(heavy)
+
+
+def parseArguments(argv=None):
+	parser = argparse.ArgumentParser(description='Time importing the package in fresh interpreters.')
+	parser.add_argument('--repeats', type=int, default=10, help='Fresh interpreters to time each import in.')
+	parser.add_argument('--output', default=None, help='Write the results as json to this file.')
+	parser.add_argument('--baseline', default=None, help='A results json file to compare against.')
+	parser.add_argument('--tolerance', type=float, default=0.2, help='The allowed slowdown against the baseline.')
+
+	return parser.parse_args(argv)
+
+
+
+
+if __name__ == '__main__':
+	args = parseArguments()
+
+	results = []
+	failed = False
+	for name, statement in IMPORT_STATEMENTS.items():
+		timings, heavy = measureImport(statement, repeats=args.repeats)
+		results.append({'benchmark': name,
+		                'scale': 1,
+		                'repeats': args.repeats,
+		                'min': min(timings),
+		                'median': statistics.median(timings),
+		                'mean': statistics.mean(timings),
+		                'heavyModules': heavy})
+		print('%-32s median %8.4fs  min %8.4fs  heavy modules: %s' %
+		      (name, results[-1]['median'], results[-1]['min'], ', '.join(heavy) or 'none'))
+		if len(heavy) > 0:
+			print('Regression: %s imported %s' % (name, ', '.join(heavy)))
+			failed = True
+
+	report = {'createdAt': time.time(),
+	          'python': platform.python_version(),
+	          'platform': platform.platform(),
+	          'results': results}
+	if args.output is not None:
+		with open(args.output, 'w') as f:
+			json.dump(report, f, indent=2)
+		print('Wrote', args.output)
+
+	if args.baseline is not None:
+		with open(args.baseline) as f:
+			regressions = compareToBaseline(results, json.load(f)['results'], args.tolerance)
+		for name, scale, baselineMedian, median in regressions:
+			print('Regression: %s took %.4fs, baseline %.4fs' % (name, median, baselineMedian))
+		failed = failed or len(regressions) > 0
+
+	if failed:
+		sys.exit(1)
@@ -0,0 +1,282 @@
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import statistics
+import tempfile
+from contextlib import redirect_stdout
+
+import pandas as pd
+
+from benchmarks.fixtures import (makeCatalog, makeSpotHistory, makeSpotHistoryFrame, writeFixtures, StubEc2Client,
+                                 FixtureServer)
+from parseAndCombinePrices import AllPrices
+from priceParsing.spotPrices import SpotPrices
+from priceParsing.definedDuration import DefinedDuration
+from priceParsing.onDemand import OnDemand
+from priceParsing.nodeTypes import NodeTypes
+from priceParsing.spotAnalytics import computeSpotStatistics
+from priceParsing.tableExtraction import extractTablesFromHtml, readHtmlSource
+
+
+
+REGION_ID = 'ap-southeast-2'
+SUB_REGION = 'a'
+# Spot history rows per scale step for the spotStatistics benchmark, and the most built at any scale
+SPOT_HISTORY_ROWS = 1000000
+MAX_SPOT_HISTORY_ROWS = 4000000
+
+
+
+
+class BenchmarkRun:
+	"""
+	Time each collection and combine stage against local fixtures, at one catalog scale.
+
+	Spot prices are served by a stand-in ec2 client and the three pricing pages by a local http server, so no run
+	touches AWS or a browser.
+	"""
+	def __init__(self, scale, server, workDir, storageFormat='csv'):
+		"""
+		:param scale: The catalog scale, see fixtures.makeCatalog.
+		:param server: The fixture server serving the saved pages.
+		:param workDir: A scratch directory for the fixtures and the csvDir of each run.
+		:param storageFormat: The on-disk format the parsers write.
+		"""
+		self.scale = scale
+		self.server = server
+		self.workDir = workDir
+		self.storageFormat = storageFormat
+
+		self.catalog = makeCatalog(scale)
+		self.spotRecords = makeSpotHistory(self.catalog, REGION_ID + SUB_REGION)
+		pagesDir = os.path.join(server.directory, 'scale-%i' % scale)
+		os.makedirs(pagesDir, exist_ok=True)
+		self.pages = {name: server.getUrl('scale-%i/%s' % (scale, filename))
+		              for name, filename in writeFixtures(pagesDir, self.catalog, REGION_ID).items()}
+		self.offerFile = os.path.join(pagesDir, 'ec2-offer.json')
+		self.spotHistoryFrame = None
+
+
+	def getCsvDir(self):
+		"""
+		Get an empty csvDir, so every repeat writes from scratch.
+
+		:return: The directory path.
+		"""
+		csvDir = os.path.join(self.workDir, 'csvFiles')
+		shutil.rmtree(csvDir, ignore_errors=True)
+		os.makedirs(csvDir)
+
+		return csvDir
+
+
+	def getSpotHistoryFrame(self):
+		"""
+		Get the spot history frame of the spotStatistics benchmark, building it on first use so the repeats share it.
+
+		:return: The history dataframe.
+		"""
+		if self.spotHistoryFrame is None:
+			rows = min(SPOT_HISTORY_ROWS * self.scale, MAX_SPOT_HISTORY_ROWS)
+			self.spotHistoryFrame = makeSpotHistoryFrame(self.catalog, REGION_ID + SUB_REGION, rows=rows)
+
+		return self.spotHistoryFrame
+
+
+	def parseSpotPrices(self, csvDir):
+		return SpotPrices(csvDir=csvDir, regionId=REGION_ID, subRegion=SUB_REGION, storageFormat=self.storageFormat,
+		                  client=StubEc2Client(self.spotRecords))
+
+
+	def parseOnDemand(self, csvDir):
+		return OnDemand(csvDir=csvDir, regionId=REGION_ID, htmlSource=self.pages['onDemandPrices'],
+		                storageFormat=self.storageFormat)
+
+
+	def parseOfferFile(self, csvDir):
+		return OnDemand(csvDir=csvDir, regionId=REGION_ID, offerFile=self.offerFile, storageFormat=self.storageFormat)
+
+
+	def parseDefinedDuration(self, csvDir):
+		return DefinedDuration(csvDir=csvDir, regionId=REGION_ID, htmlSource=self.pages['definedDurationPrices'],
+		                       storageFormat=self.storageFormat)
+
+
+	def parseNodeTypes(self, csvDir):
+		return NodeTypes(csvDir=csvDir, htmlSource=self.pages['nodeTypes'], storageFormat=self.storageFormat)
+
+
+	def parseAll(self, csvDir):
+		"""
+		Collect every source and combine them, as AllPrices.parseAllPrices does.
+
+		:param csvDir: The directory to write to.
+		:return: The AllPrices holding the sources and combined dataframe.
+		"""
+		allPrices = AllPrices(csvDir=csvDir, regionId=REGION_ID, subRegion=SUB_REGION, storageFormat=self.storageFormat)
+		allPrices.spotPrices = self.parseSpotPrices(csvDir)
+		allPrices.definedDurationPrices = self.parseDefinedDuration(csvDir)
+		allPrices.onDemandPrices = self.parseOnDemand(csvDir)
+		allPrices.nodeTypes = self.parseNodeTypes(csvDir)
+		allPrices.generateDataFrame()
+
+		return allPrices
+
+
+	def getBenchmarks(self):
+		"""
+		Get the benchmarks of this run. Each is a (setup, stage) pair, where setup returns the arguments of stage and
+		is not timed, and stage returns the dataframe it produced.
+
+		:return: A dict of benchmark name to (setup, stage).
+		"""
+		def nodeTypesFrame():
+			# The raw scraped frame, as cleanNodeTypesDataframe receives it
+			with redirect_stdout(io.StringIO()):
+				parser = self.parseNodeTypes(self.getCsvDir())
+				tables = extractTablesFromHtml(readHtmlSource(self.pages['nodeTypes']), parser.tableXPath)
+				df = pd.DataFrame(parser.readNodeTypesTables(tables))
+			return parser, df
+
+		def combineSources():
+			csvDir = self.getCsvDir()
+			with redirect_stdout(io.StringIO()):
+				allPrices = self.parseAll(csvDir)
+			return (allPrices,)
+
+		def parsedNodeTypes():
+			# A csvDir already holding the node types parsed from the same page, so the rerun finds it unchanged
+			csvDir = self.getCsvDir()
+			with redirect_stdout(io.StringIO()):
+				self.parseNodeTypes(csvDir)
+			return (csvDir,)
+
+		def spotHistory():
+			# A million history rows per scale step, up to MAX_SPOT_HISTORY_ROWS, built once for every repeat
+			onDemand = pd.Series({instance.name: instance.onDemand for instance in self.catalog})
+			return self.getSpotHistoryFrame(), onDemand
+
+		return {
+			'SpotPrices': (lambda: (self.getCsvDir(),), lambda csvDir: self.parseSpotPrices(csvDir).df),
+			'OnDemand': (lambda: (self.getCsvDir(),), lambda csvDir: self.parseOnDemand(csvDir).df),
+			'OnDemandOfferFile': (lambda: (self.getCsvDir(),), lambda csvDir: self.parseOfferFile(csvDir).df),
+			'DefinedDuration': (lambda: (self.getCsvDir(),), lambda csvDir: self.parseDefinedDuration(csvDir).df),
+			'NodeTypes': (lambda: (self.getCsvDir(),), lambda csvDir: self.parseNodeTypes(csvDir).df),
+			'NodeTypesUnchanged': (parsedNodeTypes, lambda csvDir: self.parseNodeTypes(csvDir).df),
+			'cleanNodeTypesDataframe': (nodeTypesFrame, lambda parser, df: parser.cleanNodeTypesDataframe(df)),
+			'generateDataFrame': (combineSources, lambda allPrices: allPrices.generateDataFrame()),
+			'spotStatistics': (spotHistory, lambda history, onDemand: computeSpotStatistics(
+				history, onDemand=onDemand, thresholds=(50, 70), window='30D')),
+			'endToEnd': (lambda: (self.getCsvDir(),), lambda csvDir: self.parseAll(csvDir).df),
+		}
+
+
+	def run(self, repeats=5, names=None):
+		"""
+		Time each benchmark.
+
+		:param repeats: The number of timed repeats of each benchmark.
+		:param names: The benchmark names to run, or None for all.
+		:return: A list of result dicts.
+		"""
+		results = []
+		for name, (setup, stage) in self.getBenchmarks().items():
+			if names is not None and name not in names:
+				continue
+			timings = []
+			for repeat in range(repeats):
+				arguments = setup()
+				with redirect_stdout(io.StringIO()):
+					start = time.perf_counter()
+					df = stage(*arguments)
+					timings.append(time.perf_counter() - start)
+
+			results.append({'benchmark': name,
+			                'scale': self.scale,
+			                'instanceTypes': len(self.catalog),
+			                'rows': int(df.shape[0]),
+			                'repeats': repeats,
+			                'min': min(timings),
+			                'median': statistics.median(timings),
+			                'mean': statistics.mean(timings)})
+			print('%-24s scale %-3i rows %-6i median %8.4fs  min %8.4fs' %
+			      (name, self.scale, df.shape[0], results[-1]['median'], results[-1]['min']))
+
+		return results
+
+
+
+
+def compareToBaseline(results, baseline, tolerance):
+	"""
+	Find the benchmarks whose median time regressed past the baseline.
+
+	:param results: A list of result dicts.
+	:param baseline: A list of result dicts from an earlier run.
+	:param tolerance: The allowed slowdown as a fraction, e.g. 0.2 for 20%.
+	:return: A list of (benchmark, scale, baseline median, median) for each regression.
+	"""
+	baselineMedians = {(result['benchmark'], result['scale']): result['median'] for result in baseline}
+	regressions = []
+	for result in results:
+		baselineMedian = baselineMedians.get((result['benchmark'], result['scale']))
+		if baselineMedian is not None and result['median'] > baselineMedian * (1.0 + tolerance):
+			regressions.append((result['benchmark'], result['scale'], baselineMedian, result['median']))
+
+	return regressions
+
+
+def parseArguments(argv=None):
+	parser = argparse.ArgumentParser(description='Time each collection and combine stage against local fixtures.')
+	parser.add_argument('--scales', type=int, nargs='+', default=[1, 4, 16],
+	                    help='Catalog scales to run, about 72 instance types per step.')
+	parser.add_argument('--repeats', type=int, default=5, help='Timed repeats of each benchmark.')
+	parser.add_argument('--benchmarks', nargs='+', default=None, help='Only run these benchmarks.')
+	parser.add_argument('--storageFormat', default='csv', help="The parsers' on-disk format.")
+	parser.add_argument('--output', default=None, help='Write the results as json to this file.')
+	parser.add_argument('--baseline', default=None, help='A results json file to compare against.')
+	parser.add_argument('--tolerance', type=float, default=0.2, help='The allowed slowdown against the baseline.')
+
+	return parser.parse_args(argv)
+
+
+
+
+if __name__ == '__main__':
+	args = parseArguments()
+
+	workDir = tempfile.mkdtemp(prefix='price-benchmarks-')
+	try:
+		pagesDir = os.path.join(workDir, 'pages')
+		os.makedirs(pagesDir)
+		results = []
+		with FixtureServer(pagesDir) as server:
+			for scale in args.scales:
+				run = BenchmarkRun(scale, server, os.path.join(workDir, 'run'), storageFormat=args.storageFormat)
+				results += run.run(repeats=args.repeats, names=args.benchmarks)
+	finally:
+		shutil.rmtree(workDir, ignore_errors=True)
+
+	report = {'createdAt': time.time(),
+	          'python': platform.python_version(),
+	          'pandas': pd.__version__,
+	          'platform': platform.platform(),
+	          'storageFormat': args.storageFormat,
+	          'results': results}
+	if args.output is not None:
+		with open(args.output, 'w') as f:
+			json.dump(report, f, indent=2)
+		print('Wrote', args.output)
+
+	if args.baseline is not None:
+		with open(args.baseline) as f:
+			regressions = compareToBaseline(results, json.load(f)['results'], args.tolerance)
+		for name, scale, baselineMedian, median in regressions:
+			print('Regression: %s at scale %i took %.4fs, baseline %.4fs' % (name, scale, median, baselineMedian))
+		if len(regressions) > 0:
+			sys.exit(1)
@@ -1,10 +1,80 @@
 import os,sys, math
+import numpy as np
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 
 from priceParsing.spotPrices import SpotPrices
 from priceParsing.definedDuration import DefinedDuration
 from priceParsing.onDemand import OnDemand
 from priceParsing.nodeTypes import NodeTypes
+from priceParsing.storage import getStorage
+from priceParsing.summary import getSummaryFilename, getChangelogFilename, loadCombinedSummary
+from priceParsing.priceQuery import PriceQueryEngine
+from priceParsing.compaction import compactFrame, getMemoryReport
+from priceParsing.instanceCatalog import InstanceCatalog, normaliseInstanceTypes
+from priceParsing.spotHistory import SpotPriceHistory
+from priceParsing.spotAnalytics import computeSpotStatistics
+from priceParsing.snapshotDiff import SnapshotDiff
+from priceParsing.instrumentation import getTracer, submitTraced
+
+
+
+def runCollector(name, collector):
+	"""
+	Run a source collector inside a timing span.
+
+	:param name: The source name, e.g. 'spotPrices'.
+	:param collector: The collector function.
+	:return: The collected parser.
+	"""
+	with getTracer().span('collect', source=name):
+		return collector()
+
+
+def raiseCollectionErrors(errors):
+	"""
+	Report any collector errors and raise if there were any.
+
+	:param errors: A dict of source name to the exception raised while collecting it.
+	"""
+	if len(errors) == 0:
+		return
+	for name, error in errors.items():
+		print('Failed to collect %s: %r' % (name, error))
+	raise RuntimeError('Failed to collect %s.' % ', '.join(str(name) for name in errors.keys())) from next(iter(errors.values()))
+
+
+def writeSnapshot(df, previous, storage, filename, changelogFilename, priceColumns, changeThreshold):
+	"""
+	Write a combined dataframe, first appending its diff against the previous snapshot to the changelog.
+
+	:param df: The combined dataframe.
+	:param previous: The previous snapshot, or None to read it from the file being replaced, if there is one.
+	:param storage: The storage backend.
+	:param filename: The snapshot file.
+	:param changelogFilename: The changelog file.
+	:param priceColumns: The columns to report changes of.
+	:param changeThreshold: The smallest price change to report as a percentage, or None to skip the diff.
+	:return: The SnapshotDiff, or None if there was no previous snapshot or no diff was made.
+	"""
+	diff = None
+	if changeThreshold is not None:
+		if previous is None and os.path.exists(filename):
+			previous = storage.read(filename, indexLevels=df.index.nlevels)
+		if previous is not None:
+			with getTracer().span('diff', file=changelogFilename) as span:
+				diff = SnapshotDiff(previous, df, priceColumns, threshold=changeThreshold)
+				diff.appendTo(changelogFilename)
+				span.count(rows=df.shape[0])
+			print('%i added, %i removed and %i price changes since the previous snapshot.' %
+			      (len(diff.added), len(diff.removed), diff.changes.shape[0]))
+
+	with getTracer().span('write', file=filename) as span:
+		storage.write(df, filename)
+		span.count(rows=df.shape[0], bytes=os.path.getsize(filename))
+	print('Wrote', filename)
+
+	return diff
 
 
 
@@ -12,18 +82,76 @@ class AllPrices:
 	"""
 	Parse all prices into one convienient object.
 	"""
-	def __init__(self, apiKeyFilePath=None, csvDir='csvFiles', regionId='ap-southeast-2', subRegion='a'):
+	# A suggested max staleness policy in seconds, spot prices move often while the webpages rarely change
+	defaultMaxStaleness = {'spotPrices': 15 * 60,
+	                       'definedDurationPrices': 24 * 60 * 60,
+	                       'onDemandPrices': 24 * 60 * 60,
+	                       'nodeTypes': 7 * 24 * 60 * 60}
+
+	# The node type columns kept in the combined dataframe
+	nodeTypeColumns = ['vCPU', 'Mem (GiB)', 'Storage', 'Storage (GB)', 'Storage Medium', 'GPUs', 'GPU Mem (GiB)',
+	                   'EBS Bandwidth', 'EBS Baseline (Mbps)', 'EBS Burst (Mbps)', 'Network Baseline (Gbps)',
+	                   'Network Burst (Gbps)']
+	# The columns of each source used in the combined dataframe
+	sourceColumns = {'spotPrices': ['SpotPrice'],
+	                 'definedDurationPrices': ['GroupType', '1-Hour Reserved', '6-Hour Reserved'],
+	                 'onDemandPrices': ['Linux/UNIX Usage'],
+	                 'nodeTypes': nodeTypeColumns}
+	# Source columns renamed in the combined dataframe
+	renamedColumns = {'Linux/UNIX Usage': 'On-Demand'}
+	# The price proportion columns, as (numerator, denominator) percentages
+	ratioColumns = {'SpotProp%': ('SpotPrice', 'On-Demand'),
+	                '1Hr%': ('1-Hour Reserved', 'On-Demand'),
+	                '6Hr%': ('6-Hour Reserved', 'On-Demand')}
+	# The proportion columns computed from each source's columns
+	dependentColumns = {'spotPrices': ['SpotProp%'],
+	                    'definedDurationPrices': ['1Hr%', '6Hr%'],
+	                    'onDemandPrices': ['SpotProp%', '1Hr%', '6Hr%'],
+	                    'nodeTypes': []}
+	# The string columns stored as categoricals in compact mode
+	categoricalColumns = ['GroupType', 'Storage Medium', 'Region', 'AZ']
+	# Renamed instance types mapped to their current names, so every source joins on the same row
+	instanceAliases = {}
+	# The price columns reported in the snapshot changelog
+	priceColumns = ['SpotPrice', '1-Hour Reserved', '6-Hour Reserved', 'On-Demand']
+	# The computeSpotStatistics arguments used for the optional spot statistics columns
+	spotStatisticsOptions = {'thresholds': (50, 70), 'window': '30D', 'rollingWindow': '7D'}
+
+	def __init__(self, apiKeyFilePath=None, csvDir='csvFiles', regionId='ap-southeast-2', subRegion='a', driverPool=None,
+	             storageFormat='csv', memoryMap=False, maxStaleness=None, compact=False, spotStatistics=False,
+	             changeThreshold=1.0):
 		"""
 		:param apiKeyFilePath: A path to the api key file.
 		:param csvDir: The directory to read/write csv to/from.
 		:param regionId: The region Id name, e.g. 'ap-southeast-2'.
 		:param subRegion: The sub region string, e.g. 'a', 'b', 'c'.
+		:param driverPool: The browser driver pool for the webpage parsers, or None for the shared default pool.
+		:param storageFormat: The on-disk format for every data file, one of 'csv', 'parquet', 'feather' or 'arrow'.
+		:param memoryMap: True to memory map data files when reading.
+		:param maxStaleness: A dict of source name to the max age in seconds of its cached data, e.g.
+		                     AllPrices.defaultMaxStaleness. Sources left as None in parseAllPrices are loaded from disk
+		                     while fresh and re-fetched once stale.
+		:param compact: True to keep only the used source columns, with categoricals and float32, to save memory.
+		:param spotStatistics: True to add columns describing how stable each spot price has been, computed from the
+		                       spot price history store with spotStatisticsOptions. Spot prices are then synced
+		                       incrementally into the store instead of requesting only the current prices.
+		:param changeThreshold: The smallest price change, as a percentage, recorded in the changelog written
+		                        alongside the combined dataframe, or None to not keep a changelog.
 		"""
 		self.apiKeyFilePath = apiKeyFilePath
 		self.csvDir = csvDir
-		self.mainCsvFile = "combined-prices-summary-%s.csv" % regionId
+		self.storageOptions = {'storageFormat': storageFormat, 'memoryMap': memoryMap}
+		self.storage = getStorage(storageFormat, memoryMap=memoryMap)
+		self.mainCsvFile = getSummaryFilename(regionId, self.storage.extension)
+		self.changelogFile = getChangelogFilename(regionId)
 		self.regionId = regionId
 		self.subRegion = subRegion
+		self.driverPool = driverPool
+		self.maxStaleness = {} if maxStaleness is None else maxStaleness
+		self.compact = compact
+		self.spotStatistics = spotStatistics
+		self.spotHistory = SpotPriceHistory(historyDir=os.path.join(csvDir, 'spot-history'), storageFormat=storageFormat)
+		self.changeThreshold = changeThreshold
 
 		self.spotPrices = None
 		self.definedDurationPrices = None
@@ -31,39 +159,161 @@ class AllPrices:
 		self.nodeTypes = None
 
 		self.df = None
+		self.previousDf = None
+		self.lastDiff = None
+		self.errors = {}
+		self.queryEngine = None
+
+		self.catalog = InstanceCatalog(aliases=self.instanceAliases)
+		self.sourceMappings = {}
+		self.joinReport = None
 
 
-	def parseAllPrices(self, spotPrices=True, definedDurationPrices=True, onDemandPrices=True, nodeTypes=True):
+	def parseAllPrices(self, spotPrices=None, definedDurationPrices=None, onDemandPrices=None, nodeTypes=None,
+	                   parallel=False, maxWorkers=4):
 		"""
 		Parse all prices and node types.
 
 		:param spotPrices: True if we are to parse spot prices using the API, otherwise read from csv file.
+		                   None to follow the max staleness policy, parsing if there is no policy for the source.
 		:param definedDurationPrices: True if we are to parse defined duration prices from the webpage, otherwise read from csv file.
 		:param onDemandPrices: True if we are to parse on demand prices from the webpage, otherwise read from csv file.
 		:param nodeTypes: True if we are to parse node types from the webpage, otherwise read from csv file.
+		:param parallel: True to run the collectors at the same time in a thread pool.
+		:param maxWorkers: The number of worker threads to use when running in parallel.
 		:return: A dataframe of combined price and type data.
 		"""
-		# Parse spot prices
-		self.printHeader('Spot Prices Using Api', leadingNewLine=False)
-		self.spotPrices = SpotPrices(apiKeyFilePath=self.apiKeyFilePath, csvDir=self.csvDir, regionId=self.regionId,
-		                             subRegion=self.subRegion, loadCsv=not spotPrices)
+		collectors = self.getCollectors(spotPrices, definedDurationPrices, onDemandPrices, nodeTypes)
+
+		self.errors = {}
+		with getTracer().span('parseAllPrices', regionId=self.regionId, subRegion=self.subRegion):
+			if parallel:
+				# Run the independent collectors together, gathering each result or error per source
+				self.printHeader('Collecting %i Sources In Parallel' % len(collectors), leadingNewLine=False)
+				with ThreadPoolExecutor(max_workers=maxWorkers) as executor:
+					futures = {name: submitTraced(executor, runCollector, name, collector)
+					           for name, (header, collector) in collectors.items()}
+					for name, future in futures.items():
+						try:
+							setattr(self, name, future.result())
+						except Exception as e:
+							self.errors[name] = e
+			else:
+				leadingNewLine = False
+				for name, (header, collector) in collectors.items():
+					self.printHeader(header, leadingNewLine=leadingNewLine)
+					leadingNewLine = True
+					setattr(self, name, runCollector(name, collector))
+
+			raiseCollectionErrors(self.errors)
+			if self.compact:
+				self.compactSources()
+
+			self.printHeader('Completed')
+
+			# Generate the dataframes
+			return self.generateDataFrame()
+
+
+	def refreshSources(self, names):
+		"""
+		Re-fetch some of the sources and update only their columns of the combined dataframe, e.g. to reparse spot
+		prices every few minutes while the webpages are kept.
+
+		:param names: The source names to re-fetch, e.g. ['spotPrices'].
+		:return: The updated combined dataframe.
+		"""
+		collectors = self.getCollectors(**{name: True for name in names})
+		for name in names:
+			header, collector = collectors[name]
+			setattr(self, name, runCollector(name, collector))
+		if self.compact:
+			self.compactSources(names)
 
-		# Parse Defined Duration Spot Prices
-		self.printHeader('Defined Duration Spot Prices Using Webpage')
-		self.definedDurationPrices = DefinedDuration(csvDir=self.csvDir, regionId=self.regionId, loadCsv=not definedDurationPrices)
+		return self.updateDataFrame(names)
 
-		# Parse On-Demand Prices
-		self.printHeader('On-demand Prices Using Webpage')
-		self.onDemandPrices = OnDemand(csvDir=self.csvDir, regionId=self.regionId, loadCsv=not onDemandPrices)
 
-		# Parse Node Types Prices
-		self.printHeader('Node Types Using Webpage')
-		self.nodeTypes = NodeTypes(csvDir=self.csvDir, loadCsv=not nodeTypes)
+	def compactSources(self, names=None):
+		"""
+		Drop the source columns not used in the combined dataframe and compact the rest.
+
+		:param names: The source names to compact, or None for all.
+		"""
+		for name, columns in self.sourceColumns.items():
+			if names is not None and name not in names:
+				continue
+			source = getattr(self, name)
+			source.df = compactFrame(source.df[columns], categoricalColumns=self.categoricalColumns,
+			                         categoricalIndex=False)
 
-		self.printHeader('Completed')
 
-		# Generate the dataframes
-		self.generateDataFrame()
+	def loadMissingSources(self):
+		"""
+		Load any source that has not been collected from disk, e.g. after loadDataFrame.
+		"""
+		missing = [name for name in self.sourceColumns if getattr(self, name) is None]
+		collectors = self.getCollectors(**{name: False for name in missing})
+		for name in missing:
+			header, collector = collectors[name]
+			setattr(self, name, runCollector(name, collector))
+		if self.compact and len(missing) > 0:
+			self.compactSources(missing)
+
+
+	def getMemoryReport(self):
+		"""
+		Report the rows, columns and memory used by each source dataframe and the combined dataframe.
+
+		:return: A dataframe of rows, columns and bytes per source.
+		"""
+		frames = {name: None if getattr(self, name) is None else getattr(self, name).df for name in self.sourceColumns}
+		frames['combined'] = self.df
+
+		return getMemoryReport(frames)
+
+
+	def getCollectors(self, spotPrices=None, definedDurationPrices=None, onDemandPrices=None, nodeTypes=None):
+		"""
+		Get a collector for each source, which parses or loads that source when called.
+
+		:param spotPrices: True if we are to parse spot prices using the API, otherwise read from csv file.
+		                   None to follow the max staleness policy, parsing if there is no policy for the source.
+		:param definedDurationPrices: True if we are to parse defined duration prices from the webpage, otherwise read from csv file.
+		:param onDemandPrices: True if we are to parse on demand prices from the webpage, otherwise read from csv file.
+		:param nodeTypes: True if we are to parse node types from the webpage, otherwise read from csv file.
+		:return: A dict of attribute name to (header, collector function).
+		"""
+		# Only the current spot prices are combined, so only they are requested rather than paging through the history,
+		# unless the spot statistics need the history store synced
+		return {
+			'spotPrices': ('Spot Prices Using Api', lambda: SpotPrices(
+				apiKeyFilePath=self.apiKeyFilePath, csvDir=self.csvDir, regionId=self.regionId,
+				subRegion=self.subRegion, snapshotOnly=not self.spotStatistics, incremental=self.spotStatistics,
+				**self.getCacheOptions('spotPrices', spotPrices), **self.storageOptions)),
+			'definedDurationPrices': ('Defined Duration Spot Prices Using Webpage', lambda: DefinedDuration(
+				csvDir=self.csvDir, regionId=self.regionId, driverPool=self.driverPool,
+				**self.getCacheOptions('definedDurationPrices', definedDurationPrices), **self.storageOptions)),
+			'onDemandPrices': ('On-demand Prices Using Webpage', lambda: OnDemand(
+				csvDir=self.csvDir, regionId=self.regionId, driverPool=self.driverPool,
+				**self.getCacheOptions('onDemandPrices', onDemandPrices), **self.storageOptions)),
+			'nodeTypes': ('Node Types Using Webpage', lambda: NodeTypes(
+				csvDir=self.csvDir, driverPool=self.driverPool, **self.getCacheOptions('nodeTypes', nodeTypes),
+				**self.storageOptions)),
+		}
+
+
+	def getCacheOptions(self, name, parse):
+		"""
+		Get the cache arguments for a source's parser.
+
+		:param name: The source name, e.g. 'spotPrices'.
+		:param parse: True to parse, False to read from disk, or None to follow the source's max staleness policy.
+		:return: A dict with the loadCsv and maxStaleness arguments.
+		"""
+		if parse is None:
+			return {'loadCsv': False, 'maxStaleness': self.maxStaleness.get(name)}
+
+		return {'loadCsv': not parse, 'maxStaleness': None}
 
 
 	def generateDataFrame(self):
@@ -72,40 +322,253 @@ class AllPrices:
 
 		:return: A generated dataframe of the combined data.
 		"""
-		# Spot Prices
-		dfSpot = self.spotPrices.df
-		# Defined Duration
-		dfDefDur = self.definedDurationPrices.df
-		# On-Demand Prices
-		dfOnDem = self.onDemandPrices.df
-		dfOnDem = dfOnDem[['Linux/UNIX Usage']]
-		dfOnDem = dfOnDem.rename(columns={'Linux/UNIX Usage': 'On-Demand'})
-		# Node Types
-		dfNodeTypes = self.nodeTypes.df
-		dfNodeTypes = dfNodeTypes[['vCPU', 'Mem (GiB)', 'Storage', 'GPUs', 'GPU Mem (GiB)', 'EBS Bandwidth']]
-
-		# Merge dataframes
-		df = pd.concat([dfSpot, dfDefDur, dfOnDem, dfNodeTypes], axis=1)
+		with getTracer().span('merge') as span:
+			self.df = self.combineDataFrames()
+			span.count(rows=self.df.shape[0])
+		self.queryEngine = None
+
+		# Write data to disc
+		self.writeDataFrame()
+
+		return self.df
+
+
+	def updateDataFrame(self, changedSources):
+		"""
+		Update the combined dataframe after some sources changed, replacing only the columns those sources own and
+		recomputing the proportions that depend on them.
+
+		Falls back to a full generateDataFrame when there is no combined dataframe yet, when a changed source has
+		instance types the combined dataframe does not, or when the defined duration group types changed, as the
+		group type is part of the index. Instance types a changed source no longer lists are left with empty values.
+		The snapshot is only rewritten, and only the updated price columns diffed, when an updated column changed.
+
+		:param changedSources: The names of the changed sources, e.g. ['spotPrices'].
+		:return: The updated combined dataframe.
+		"""
+		if self.df is None:
+			self.loadMissingSources()
+			return self.generateDataFrame()
+
+		# The catalog id of each combined row, in row order
+		instanceTypes = self.df.index.get_level_values(-1)
+		rowIds = self.catalog.getIds(normaliseInstanceTypes(instanceTypes), instanceTypes)
+		frames = {}
+		for name in changedSources:
+			mapping = self.mapSource(name)
+			frame = pd.DataFrame(self.catalog.gather(self.getSourceFrame(name), mapping, rowIds), index=self.df.index)
+			if not np.isin(mapping.ids, rowIds).all() or (name == 'definedDurationPrices' and
+			                                              self.groupTypesChanged(frame)):
+				print('%s changed the instance types or groups, rebuilding the combined dataframe.' % name)
+				self.loadMissingSources()
+				return self.generateDataFrame()
+			frames[name] = frame
+
+		with getTracer().span('update', sources=','.join(changedSources)) as span:
+			# Replace columns of a shallow copy, leaving the current dataframe untouched for its readers such as the
+			# price service without copying the columns that are kept
+			df = self.df.copy(deep=False)
+			for frame in frames.values():
+				for column in frame.columns.drop('GroupType', errors='ignore'):
+					df[column] = self.castLike(frame[column], df[column])
+
+			# Recompute only the proportions of the changed columns
+			for column in dict.fromkeys(c for name in changedSources for c in self.dependentColumns[name]):
+				numerator, denominator = self.ratioColumns[column]
+				df[column] = self.castLike(100.0 * df[numerator].astype(float) / df[denominator].astype(float),
+				                           df[column])
+			if self.spotStatistics and not {'spotPrices', 'onDemandPrices'}.isdisjoint(changedSources):
+				for column, values in self.getSpotStatistics(df['On-Demand'].to_numpy(), rowIds).items():
+					values = pd.Series(values, index=df.index)
+					df[column] = values if column not in df.columns else self.castLike(values, df[column])
+
+			changedColumns = [column for column in df.columns
+			                  if column not in self.df.columns or not df[column].equals(self.df[column])]
+			span.count(rows=df.shape[0])
+
+		if len(changedColumns) == 0:
+			print('%s left the combined dataframe unchanged, keeping the written snapshot.' % ', '.join(changedSources))
+			return self.df
+		self.df = df
+		self.queryEngine = None
+
+		# Write data to disc, diffing only the price columns that changed
+		self.writeDataFrame(priceColumns=[column for column in self.priceColumns if column in changedColumns])
+
+		return self.df
+
+
+	def getSourceFrame(self, name):
+		"""
+		Get the columns a source contributes to the combined dataframe, under their combined names.
+
+		:param name: The source name, e.g. 'spotPrices'.
+		:return: The source's dataframe of combined columns, indexed by InstanceType.
+		"""
+		return getattr(self, name).df[self.sourceColumns[name]].rename(columns=self.renamedColumns)
+
+
+	def groupTypesChanged(self, frame):
+		"""
+		Check if a defined duration frame moves any instance type to a different group.
+
+		:param frame: The defined duration source frame, gathered into the combined dataframe's row order.
+		:return: True if the group types differ from the combined dataframe's index.
+		"""
+		old = pd.Series(self.df.index.get_level_values(0), dtype=object)
+		new = pd.Series(frame['GroupType'].to_numpy(), dtype=object)
+
+		return not old.equals(new)
+
+
+	def getSpotStatistics(self, onDemand, rowIds):
+		"""
+		Compute the spot statistics columns from this availability zone's spot price history.
+
+		:param onDemand: The on-demand price of each combined row.
+		:param rowIds: The catalog ids of the combined rows.
+		:return: A dict of column name to values in row order, empty when no history is stored.
+		"""
+		availabilityZone = self.regionId + self.subRegion
+		options = dict(self.spotStatisticsOptions)
+		startDay = None
+		if options.get('window') is not None:
+			# A day early, so the price held at the start of the window is read too
+			startTime = pd.Timestamp.now(tz='UTC') - pd.Timedelta(options['window']) - pd.Timedelta(days=1)
+			startDay = startTime.strftime('%Y-%m-%d')
+
+		with getTracer().span('spotStatistics', source='spotPrices') as span:
+			try:
+				history = self.spotHistory.getHistory(availabilityZone, startDay=startDay)
+			except (FileNotFoundError, ValueError):
+				print('No spot price history stored for %s, leaving out the spot statistics.' % availabilityZone)
+				return {}
+			stats = computeSpotStatistics(history, onDemand=pd.Series(onDemand, index=self.catalog.getKeys(rowIds)),
+			                              **options)
+			if 'AvailabilityZone' in stats.index.names:
+				stats = stats.reset_index(level='AvailabilityZone', drop=True)
+			span.count(rows=history.shape[0])
+
+		return self.catalog.gather(stats, self.catalog.mapFrame(stats), rowIds)
+
+
+	def mapSource(self, name):
+		"""
+		Map a source's rows onto the instance catalog, reusing the mapping until the source's dataframe is replaced.
+
+		:param name: The source name, e.g. 'spotPrices'.
+		:return: The SourceMapping of the source.
+		"""
+		df = getattr(self, name).df
+		mappedDf, mapping = self.sourceMappings.get(name, (None, None))
+		if mappedDf is not df:
+			mapping = self.catalog.mapFrame(df)
+			self.sourceMappings[name] = (df, mapping)
+
+		return mapping
+
+
+	def reportJoin(self, mappings, rowIds):
+		"""
+		Report how each source's instance types matched the others, printing any duplicate or unmatched keys.
+
+		:param mappings: A dict of source name to its SourceMapping.
+		:param rowIds: The catalog ids of the combined rows.
+		:return: A dataframe of rows, duplicate, unmatched and missing instance types per source.
+		"""
+		report = {}
+		for name, mapping in mappings.items():
+			otherIds = np.concatenate([other.ids for otherName, other in mappings.items() if otherName != name])
+			unmatched = list(self.catalog.getKeys(np.setdiff1d(mapping.ids, otherIds)))
+			if len(mapping.duplicates) > 0:
+				print('%s lists %i instance types more than once, keeping the first: %s' %
+				      (name, len(mapping.duplicates), ', '.join(mapping.duplicates[:10])))
+			if len(unmatched) > 0:
+				print('%s lists %i instance types no other source does: %s' %
+				      (name, len(unmatched), ', '.join(unmatched[:10])))
+			report[name] = {'Rows': len(mapping.ids),
+			                'Duplicates': len(mapping.duplicates),
+			                'Unmatched': len(unmatched),
+			                'Missing': len(rowIds) - len(mapping.ids)}
+
+		return pd.DataFrame.from_dict(report, orient='index')
+
+
+	def castLike(self, values, column):
+		"""
+		Cast updated values to the dtype of the combined column they replace, so compact mode keeps its dtypes.
+
+		:param values: The new values.
+		:param column: The current combined column.
+		:return: The cast values.
+		"""
+		if pd.api.types.is_float_dtype(column.dtype):
+			return values.astype(column.dtype)
+		if isinstance(column.dtype, pd.CategoricalDtype):
+			return values.astype('category')
+
+		return values
+
+
+	def writeDataFrame(self, priceColumns=None):
+		"""
+		Write the combined dataframe to disk, recording what changed since the previous snapshot in the changelog.
+
+		:param priceColumns: The price columns to diff, or None for every column in priceColumns. Only valid to narrow
+		                     when the other price columns are known to be unchanged since previousDf.
+		"""
+		priceColumns = self.priceColumns if priceColumns is None else priceColumns
+		self.lastDiff = writeSnapshot(self.df, self.previousDf, self.storage, os.path.join(self.csvDir, self.mainCsvFile),
+		                              os.path.join(self.csvDir, self.changelogFile), priceColumns,
+		                              self.changeThreshold)
+		self.previousDf = self.df
+
+
+	def loadDataFrame(self):
+		"""
+		Load the previously generated combined dataframe from disk, without loading the individual sources.
+
+		:return: The combined dataframe.
+		"""
+		self.df = loadCombinedSummary(csvDir=self.csvDir, regionId=self.regionId, **self.storageOptions)
+		self.previousDf = self.df
+		self.queryEngine = None
+
+		return self.df
+
+
+	def combineDataFrames(self):
+		"""
+		Combine the parsed source dataframes into one dataframe, without writing it to disk.
+
+		:return: The combined dataframe, indexed by (GroupType, InstanceType).
+		"""
+		# Map each source onto the instance catalog, then gather every source's columns into the combined row order
+		mappings = {name: self.mapSource(name) for name in self.sourceColumns}
+		rowIds = np.unique(np.concatenate([mapping.ids for mapping in mappings.values()]))
+		rowIds = rowIds[np.argsort(self.catalog.getKeys(rowIds), kind='stable')]
+		columns = {}
+		for name, mapping in mappings.items():
+			columns.update(self.catalog.gather(self.getSourceFrame(name), mapping, rowIds))
+		df = pd.DataFrame(columns, index=pd.Index(self.catalog.getLabels(rowIds)))
+		self.joinReport = self.reportJoin(mappings, rowIds)
 
 		# Calculate price proportions
-		df['SpotProp%'] = 100.0 * df['SpotPrice'] / df['On-Demand']
-		df['1Hr%'] = 100.0 * df['1-Hour Reserved'] / df['On-Demand']
-		df['6Hr%'] = 100.0 * df['6-Hour Reserved'] / df['On-Demand']
-		df = df[['GroupType', 'SpotPrice', '1-Hour Reserved', '6-Hour Reserved', 'On-Demand', 'SpotProp%', '1Hr%', '6Hr%',
-		         'vCPU', 'Mem (GiB)', 'Storage', 'GPUs', 'GPU Mem (GiB)', 'EBS Bandwidth']]
+		for column, (numerator, denominator) in self.ratioColumns.items():
+			df[column] = 100.0 * df[numerator] / df[denominator]
+		df = df[['GroupType', 'SpotPrice', '1-Hour Reserved', '6-Hour Reserved', 'On-Demand', 'SpotProp%', '1Hr%', '6Hr%']
+		        + self.nodeTypeColumns]
+		if self.spotStatistics:
+			df = df.assign(**self.getSpotStatistics(df['On-Demand'].to_numpy(), rowIds))
 		# Set dp display
 		pd.options.display.float_format = '{:,.2f}'.format
 		# Adjust index
 		df2 = df.reset_index()
 		df2 = df2.set_index(['GroupType', 'index'])
-		self.df = df2
+		if self.compact:
+			df2 = compactFrame(df2, categoricalColumns=self.categoricalColumns)
 
-		# Write data to disc
-		filename = os.path.join(self.csvDir, self.mainCsvFile)
-		self.df.to_csv(filename)
-		print('Wrote', filename)
-
-		return self.df
+		return df2
 
 
 	def getDataframe(self):
@@ -117,6 +580,26 @@ class AllPrices:
 		return self.df
 
 
+	def query(self, minimums=None, maximums=None, gpu=None, objective='SpotPrice', k=10, ascending=True):
+		"""
+		Find the best k instances meeting every constraint, e.g. the cheapest spot instance with at least 16 vCPU
+		and 64 GiB. The query index is built on first use after the dataframe changes.
+
+		:param minimums: A dict of column to inclusive minimum, e.g. {'vCPU': 16, 'Mem (GiB)': 64}.
+		:param maximums: A dict of column to inclusive maximum, e.g. {'SpotPrice': 1.0}.
+		:param gpu: True to only return instances with GPUs, False for instances without, None for either.
+		:param objective: The column to rank by, e.g. 'SpotPrice', 'Spot $/vCPU-hr' or 'SpotSavings%'.
+		:param k: The number of instances to return.
+		:param ascending: True to return the lowest objective values first.
+		:return: A dataframe of at most k instances, ordered by the objective.
+		"""
+		if self.queryEngine is None:
+			self.queryEngine = PriceQueryEngine(self.df)
+
+		return self.queryEngine.query(minimums=minimums, maximums=maximums, gpu=gpu, objective=objective, k=k,
+		                              ascending=ascending)
+
+
 	def printHeader(self, str='Test', allLen=100, leadingNewLine=True):
 		"""
 		Print a header with the name str.
@@ -135,6 +618,186 @@ class AllPrices:
 
 
 
+class MultiRegionPrices:
+	"""
+	Parse prices for several regions and availability zones into one dataframe, sharing region independent sources.
+	"""
+	def __init__(self, regions, apiKeyFilePath=None, csvDir='csvFiles', driverPool=None, storageFormat='csv',
+	             memoryMap=False, maxStaleness=None, compact=False, spotStatistics=False, changeThreshold=1.0):
+		"""
+		:param regions: A dict of region Id to a list of sub region strings, e.g. {'ap-southeast-2': ['a', 'b', 'c']}.
+		:param apiKeyFilePath: A path to the api key file.
+		:param csvDir: The directory to read/write csv to/from.
+		:param driverPool: The browser driver pool for the webpage parsers, or None for the shared default pool.
+		:param storageFormat: The on-disk format for every data file, one of 'csv', 'parquet', 'feather' or 'arrow'.
+		:param memoryMap: True to memory map data files when reading.
+		:param maxStaleness: A dict of source name to the max age in seconds of its cached data, see AllPrices.
+		:param compact: True to keep only the used source columns, with categoricals and float32, to save memory.
+		:param spotStatistics: True to add the spot statistics columns of each availability zone, see AllPrices.
+		:param changeThreshold: The smallest price change recorded in the changelog, see AllPrices.
+		"""
+		self.regions = regions
+		self.apiKeyFilePath = apiKeyFilePath
+		self.csvDir = csvDir
+		self.driverPool = driverPool
+		self.storageOptions = {'storageFormat': storageFormat, 'memoryMap': memoryMap}
+		self.storage = getStorage(storageFormat, memoryMap=memoryMap)
+		self.mainCsvFile = getSummaryFilename(None, self.storage.extension)
+		self.changelogFile = getChangelogFilename(None)
+		self.maxStaleness = maxStaleness
+		self.compact = compact
+		self.spotStatistics = spotStatistics
+		self.changeThreshold = changeThreshold
+
+		self.regionPrices = {}
+		self.sources = {}
+		self.errors = {}
+		self.df = None
+		self.previousDf = None
+		self.lastDiff = None
+		self.queryEngine = None
+
+
+	def parseAllPrices(self, spotPrices=None, definedDurationPrices=None, onDemandPrices=None, nodeTypes=None,
+	                   maxWorkers=8):
+		"""
+		Parse all prices for every region and availability zone using a bounded pool of workers.
+
+		Node types are fetched once, defined duration and on-demand prices once per region, and spot prices once
+		per availability zone.
+
+		:param spotPrices: True if we are to parse spot prices using the API, otherwise read from csv file.
+		                   None to follow the max staleness policy, parsing if there is no policy for the source.
+		:param definedDurationPrices: True if we are to parse defined duration prices from the webpage, otherwise read from csv file.
+		:param onDemandPrices: True if we are to parse on demand prices from the webpage, otherwise read from csv file.
+		:param nodeTypes: True if we are to parse node types from the webpage, otherwise read from csv file.
+		:param maxWorkers: The maximum number of sources to collect at the same time.
+		:return: A dataframe of combined price and type data, indexed by (Region, AZ, InstanceType).
+		"""
+		# One AllPrices per availability zone, only used for its collectors and the combine step
+		self.regionPrices = {}
+		for regionId, subRegions in self.regions.items():
+			for subRegion in subRegions:
+				self.regionPrices[(regionId, subRegion)] = AllPrices(apiKeyFilePath=self.apiKeyFilePath, csvDir=self.csvDir,
+				                                                     regionId=regionId, subRegion=subRegion,
+				                                                     driverPool=self.driverPool, maxStaleness=self.maxStaleness,
+				                                                     compact=self.compact, spotStatistics=self.spotStatistics,
+				                                                     **self.storageOptions)
+
+		# Build the set of unique tasks, keyed by the sources they fill in
+		tasks = {}
+		for (regionId, subRegion), allPrices in self.regionPrices.items():
+			collectors = allPrices.getCollectors(spotPrices, definedDurationPrices, onDemandPrices, nodeTypes)
+			for name, (header, collector) in collectors.items():
+				if name == 'nodeTypes':
+					key = (name,)
+				elif name == 'spotPrices':
+					key = (name, regionId, subRegion)
+				else:
+					key = (name, regionId)
+				tasks.setdefault(key, collector)
+
+		with getTracer().span('parseAllPrices', zones=len(self.regionPrices)):
+			# Fan the tasks out over the pool
+			self.printHeader('Collecting %i Sources For %i Zones' % (len(tasks), len(self.regionPrices)))
+			results = {}
+			self.errors = {}
+			with ThreadPoolExecutor(max_workers=maxWorkers) as executor:
+				futures = {key: submitTraced(executor, runCollector, '/'.join(key), collector)
+				           for key, collector in tasks.items()}
+				for key, future in futures.items():
+					try:
+						results[key] = future.result()
+					except Exception as e:
+						self.errors[key] = e
+			raiseCollectionErrors(self.errors)
+			self.sources = results
+
+			# Combine each zone then stack them
+			with getTracer().span('merge') as span:
+				frames = {}
+				for (regionId, subRegion), allPrices in self.regionPrices.items():
+					allPrices.nodeTypes = results[('nodeTypes',)]
+					allPrices.definedDurationPrices = results[('definedDurationPrices', regionId)]
+					allPrices.onDemandPrices = results[('onDemandPrices', regionId)]
+					allPrices.spotPrices = results[('spotPrices', regionId, subRegion)]
+					if self.compact:
+						allPrices.compactSources()
+					allPrices.df = allPrices.combineDataFrames()
+					dfZone = allPrices.df.reset_index(level='GroupType')
+					frames[(regionId, regionId + subRegion)] = dfZone.rename_axis('InstanceType')
+				self.printHeader('Completed')
+
+				df = pd.concat(frames, names=['Region', 'AZ'])
+				if self.compact:
+					df = compactFrame(df, categoricalColumns=AllPrices.categoricalColumns)
+				span.count(rows=df.shape[0])
+			self.df = df
+			self.queryEngine = None
+
+			# Write data to disc
+			self.lastDiff = writeSnapshot(self.df, self.previousDf, self.storage,
+			                              os.path.join(self.csvDir, self.mainCsvFile),
+			                              os.path.join(self.csvDir, self.changelogFile), AllPrices.priceColumns,
+			                              self.changeThreshold)
+			self.previousDf = self.df
+
+		return self.df
+
+
+	def getMemoryReport(self):
+		"""
+		Report the rows, columns and memory used by each collected source dataframe and the combined dataframe.
+
+		:return: A dataframe of rows, columns and bytes per source.
+		"""
+		frames = {'/'.join(key): source.df for key, source in self.sources.items()}
+		frames['combined'] = self.df
+
+		return getMemoryReport(frames)
+
+
+	def getDataframe(self):
+		"""
+		Get the combined dataframe.
+
+		:return: The combined dataframe.
+		"""
+		return self.df
+
+
+	def query(self, minimums=None, maximums=None, gpu=None, objective='SpotPrice', k=10, ascending=True):
+		"""
+		Find the best k instances meeting every constraint, e.g. the cheapest spot instance with at least 16 vCPU
+		and 64 GiB. The query index is built on first use after the dataframe changes.
+
+		:param minimums: A dict of column to inclusive minimum, e.g. {'vCPU': 16, 'Mem (GiB)': 64}.
+		:param maximums: A dict of column to inclusive maximum, e.g. {'SpotPrice': 1.0}.
+		:param gpu: True to only return instances with GPUs, False for instances without, None for either.
+		:param objective: The column to rank by, e.g. 'SpotPrice', 'Spot $/vCPU-hr' or 'SpotSavings%'.
+		:param k: The number of instances to return.
+		:param ascending: True to return the lowest objective values first.
+		:return: A dataframe of at most k instances, ordered by the objective.
+		"""
+		if self.queryEngine is None:
+			self.queryEngine = PriceQueryEngine(self.df)
+
+		return self.queryEngine.query(minimums=minimums, maximums=maximums, gpu=gpu, objective=objective, k=k,
+		                              ascending=ascending)
+
+
+	def printHeader(self, str='Test', allLen=100, leadingNewLine=False):
+		"""
+		Print a header with the name str.
+
+		:param str: The string to print.
+		:param allLen: The length of the header.
+		:param leadingNewLine: True if a blank line is to be printed first.
+		"""
+		AllPrices.printHeader(self, str=str, allLen=allLen, leadingNewLine=leadingNewLine)
+
+
+
 
 if __name__ == '__main__':
 	# Region settings
@@ -0,0 +1,286 @@
+import asyncio
+import random
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AsyncExitStack
+from datetime import datetime, timezone
+
+from priceParsing.baseParser import BaseParser
+from priceParsing.instrumentation import getTracer, submitTraced
+from priceParsing.spotPrices import readApiKeys
+
+
+
+# Error codes the ec2 api returns when requests are throttled or it is briefly unavailable
+RETRYABLE_ERROR_CODES = {'Throttling', 'ThrottlingException', 'RequestLimitExceeded', 'RequestThrottled',
+                         'TooManyRequestsException', 'ServiceUnavailable', 'Unavailable', 'InternalError'}
+
+
+
+
+class AsyncSpotPrices(BaseParser):
+	"""
+	Collects the current spot prices of many availability zones at once using asyncio, or reads them from disk.
+
+	Each region gets one client with a connection pool, shared by all of its availability zones. Every zone walks
+	its own pages while the zones run concurrently, with at most maxConcurrency requests in flight, and throttled
+	requests are retried with jittered exponential backoff. Uses aiobotocore when installed, otherwise boto3 clients
+	called from worker threads.
+	"""
+	sourceName = 'spotPrices'
+	indexLevels = 3
+
+	def __init__(self, regions, apiKeyFilePath=None, csvDir='csvFiles', loadCsv=False, paginate=True,
+	             snapshotOnly=True, maxConcurrency=16, maxRetries=6, baseDelay=0.5, maxDelay=20.0, endpointUrl=None,
+	             clientFactory=None, storageFormat='csv', memoryMap=False, maxStaleness=None):
+		"""
+		:param regions: A dict of region Id to its sub region strings, e.g. {'ap-southeast-2': ['a', 'b', 'c']}.
+		:param apiKeyFilePath: A path to the api key file.
+		:param csvDir: The directory to read/write csv to/from.
+		:param loadCsv: True if to load existing data from csv file.
+		:param paginate: True to follow NextToken through every page of the history, False for a single 600 row call.
+		:param snapshotOnly: True to only request the prices current right now (StartTime = EndTime = now), False to
+		                     walk the whole retained history of every zone.
+		:param maxConcurrency: The maximum number of requests in flight across every zone.
+		:param maxRetries: The number of times to retry a throttled request.
+		:param baseDelay: The backoff of the first retry in seconds, doubled on each later retry.
+		:param maxDelay: The longest backoff in seconds.
+		:param endpointUrl: An ec2 endpoint url to use instead of AWS, e.g. a local stand-in server.
+		:param clientFactory: A function of region Id returning a boto3 style ec2 client to use instead of creating
+		                      one, called from worker threads.
+		:param storageFormat: The on-disk format, one of 'csv', 'parquet', 'feather' or 'arrow'.
+		:param memoryMap: True to memory map the data file when reading.
+		:param maxStaleness: If given, load from disk when the cached data is at most this many seconds old and came
+		                     from the same source, otherwise fetch it. Overrides loadCsv.
+		"""
+		csvFile = 'aws-spot-prices-multi-az.csv'
+		super().__init__(csvDir=csvDir, csvFile=csvFile, storageFormat=storageFormat, memoryMap=memoryMap)
+		self.regions = regions
+		self.apiKeyFilePath = apiKeyFilePath
+		self.paginate = paginate
+		self.snapshotOnly = snapshotOnly
+		self.maxConcurrency = maxConcurrency
+		self.maxRetries = maxRetries
+		self.baseDelay = baseDelay
+		self.maxDelay = maxDelay
+		self.endpointUrl = endpointUrl
+		self.clientFactory = clientFactory
+
+		self.sourceInfo = {'api': 'describe_spot_price_history',
+		                   'regions': {regionId: sorted(subRegions) for regionId, subRegions in regions.items()}}
+
+		self.df = None
+		self.retryCount = 0
+
+		self.loadCsv = self.useCache(loadCsv, maxStaleness)
+		if not self.loadCsv:
+			self.parseSpotPrices()
+		else:
+			self.loadFromCsv()
+
+
+	def parseSpotPrices(self):
+		"""
+		Collect the current spot prices of every zone and write them to disk.
+
+		:return: A dataframe of the newest price per instance type, indexed by (Region, AZ, InstanceType).
+		"""
+		with getTracer().span('parse', source=self.sourceName, zones=sum(len(s) for s in self.regions.values())):
+			self.df = runCoroutine(self.collect())
+			print('Read %i spot prices for %i zones using api.' % (self.df.shape[0], self.df.index.get_level_values('AZ').nunique()))
+
+			# Write data to disc
+			self.writeToDisk()
+
+		return self.df
+
+
+	async def collect(self):
+		"""
+		Collect the newest price per instance type of every zone concurrently.
+
+		:return: A dataframe of the newest price per instance type, indexed by (Region, AZ, InstanceType).
+		"""
+		semaphore = asyncio.Semaphore(self.maxConcurrency)
+		async with AsyncExitStack() as stack:
+			clients = {}
+			for regionId in self.regions:
+				clients[regionId] = await self.createClient(regionId, stack)
+
+			zones = [(regionId, regionId + subRegion) for regionId, subRegions in self.regions.items()
+			         for subRegion in subRegions]
+			results = await asyncio.gather(*[self.collectZone(clients[regionId], availabilityZone, semaphore)
+			                                 for regionId, availabilityZone in zones])
+
+		frames = {zone: latest for zone, latest in zip(zones, results)}
+		df = pd.concat(frames, names=['Region', 'AZ']).rename_axis(['Region', 'AZ', 'InstanceType'])
+
+		return df
+
+
+	async def createClient(self, regionId, stack):
+		"""
+		Create the pooled client of a region.
+
+		:param regionId: The region Id name.
+		:param stack: The exit stack closing the client once collection ends.
+		:return: An AioClient, or a ThreadedClient without aiobotocore.
+		"""
+		if self.clientFactory is not None:
+			return ThreadedClient(self.clientFactory(regionId), self.maxConcurrency, stack)
+
+		keys = {}
+		if self.apiKeyFilePath is not None:
+			accessKeyId, secretAccessKey = readApiKeys(self.apiKeyFilePath)
+			keys = {'aws_access_key_id': accessKeyId, 'aws_secret_access_key': secretAccessKey}
+
+		try:
+			from aiobotocore.session import get_session
+			from aiobotocore.config import AioConfig
+		except ImportError:
+			import boto3
+			from botocore.config import Config
+			# Retries are handled here, with backoff shared by every zone of the region
+			config = Config(max_pool_connections=self.maxConcurrency, retries={'mode': 'standard', 'max_attempts': 1})
+			client = boto3.client('ec2', region_name=regionId, endpoint_url=self.endpointUrl, config=config, **keys)
+			return ThreadedClient(client, self.maxConcurrency, stack)
+
+		config = AioConfig(max_pool_connections=self.maxConcurrency, retries={'mode': 'standard', 'max_attempts': 1})
+		client = await stack.enter_async_context(get_session().create_client(
+			'ec2', region_name=regionId, endpoint_url=self.endpointUrl, config=config, **keys))
+		return AioClient(client)
+
+
+	async def collectZone(self, client, availabilityZone, semaphore):
+		"""
+		Walk the spot price history of one zone page by page, keeping the newest price per instance type.
+
+		:param client: The client of the zone's region.
+		:param availabilityZone: The availability zone, e.g. 'ap-southeast-2a'.
+		:param semaphore: The semaphore bounding the requests in flight.
+		:return: A dataframe of the newest price per instance type, indexed by InstanceType.
+		"""
+		request = {'ProductDescriptions': ['Linux/UNIX'],
+		           'AvailabilityZone': availabilityZone,
+		           'MaxResults': 1000 if self.paginate else 600}
+		if self.snapshotOnly:
+			request['StartTime'] = request['EndTime'] = datetime.now(timezone.utc)
+
+		latest = {}
+		pageCount = 0
+		while True:
+			with getTracer().span('apiPage', source=self.sourceName, az=availabilityZone, page=pageCount) as span:
+				page = await self.request(client, request, semaphore)
+				span.count(rows=len(page['SpotPriceHistory']))
+			pageCount += 1
+			for price in page['SpotPriceHistory']:
+				current = latest.get(price['InstanceType'])
+				if current is None or price['Timestamp'] > current['Timestamp']:
+					latest[price['InstanceType']] = price
+
+			nextToken = page.get('NextToken')
+			if not self.paginate or not nextToken:
+				break
+			request['NextToken'] = nextToken
+
+		df = pd.DataFrame(list(latest.values()), columns=['InstanceType', 'ProductDescription', 'SpotPrice', 'Timestamp'])
+		df = df.set_index('InstanceType')
+		df['SpotPrice'] = df['SpotPrice'].astype(float)
+
+		return df
+
+
+	async def request(self, client, request, semaphore):
+		"""
+		Request one page, retrying with full jitter exponential backoff while throttled.
+
+		:param client: The client to call.
+		:param request: The describe_spot_price_history arguments.
+		:param semaphore: The semaphore bounding the requests in flight.
+		:return: The response page.
+		"""
+		attempt = 0
+		while True:
+			try:
+				async with semaphore:
+					return await client.describeSpotPriceHistory(request)
+			except Exception as e:
+				code = getattr(e, 'response', {}).get('Error', {}).get('Code')
+				if code not in RETRYABLE_ERROR_CODES or attempt >= self.maxRetries:
+					raise
+			# Back off outside the semaphore, so other zones keep their slots
+			delay = random.uniform(0, min(self.maxDelay, self.baseDelay * 2 ** attempt))
+			attempt += 1
+			self.retryCount += 1
+			await asyncio.sleep(delay)
+
+
+
+
+class AioClient:
+	"""
+	An aiobotocore ec2 client.
+	"""
+	def __init__(self, client):
+		"""
+		:param client: The aiobotocore ec2 client, entered into the collection's exit stack.
+		"""
+		self.client = client
+
+
+	async def describeSpotPriceHistory(self, request):
+		"""
+		Request one page of spot price history.
+
+		:param request: The describe_spot_price_history arguments.
+		:return: The response page.
+		"""
+		return await self.client.describe_spot_price_history(**request)
+
+
+
+class ThreadedClient:
+	"""
+	A blocking boto3 style ec2 client, called from a pool of worker threads.
+	"""
+	def __init__(self, client, maxWorkers, stack):
+		"""
+		:param client: The boto3 ec2 client, which is thread safe.
+		:param maxWorkers: The number of worker threads, matching the client's connection pool.
+		:param stack: The exit stack shutting down the worker threads once collection ends.
+		"""
+		self.client = client
+		self.executor = ThreadPoolExecutor(max_workers=maxWorkers)
+		stack.callback(self.executor.shutdown)
+
+
+	async def describeSpotPriceHistory(self, request):
+		"""
+		Request one page of spot price history from a worker thread.
+
+		:param request: The describe_spot_price_history arguments.
+		:return: The response page.
+		"""
+		# The caller changes the request for the next page, so the worker gets its own copy
+		request = dict(request)
+		return await asyncio.get_running_loop().run_in_executor(
+			self.executor, lambda: self.client.describe_spot_price_history(**request))
+
+
+
+
+def runCoroutine(coroutine):
+	"""
+	Run a coroutine to completion from synchronous code, including from inside a running event loop such as a
+	notebook, where it is run on a separate thread.
+
+	:param coroutine: The coroutine.
+	:return: The coroutine's result.
+	"""
+	try:
+		asyncio.get_running_loop()
+	except RuntimeError:
+		return asyncio.run(coroutine)
+
+	with ThreadPoolExecutor(max_workers=1) as executor:
+		return submitTraced(executor, asyncio.run, coroutine).result()
@@ -1,6 +1,13 @@
 import os
+import json
+import time
+import hashlib
 import pandas as pd
 
+from priceParsing.storage import getStorage
+from priceParsing.instrumentation import getTracer
+from priceParsing.tableExtraction import extractTablesFromHtml, getHtmlTablesHash, readHtmlSourceIfChanged
+
 
 
 
@@ -8,22 +15,253 @@ class BaseParser:
 	"""
 	A base class to handle loading from disk.
 	"""
-	def __init__(self, csvDir='csvFiles', csvFile=None):
+	# The source name used in instrumentation spans, matching the AllPrices attribute holding the parser
+	sourceName = None
+	# The number of leading columns of the data file that make up the index
+	indexLevels = 1
+
+	def __init__(self, csvDir='csvFiles', csvFile=None, storageFormat='csv', memoryMap=False):
+		"""
+		:param csvDir: The directory to read/write data files to/from.
+		:param csvFile: The data file name. The extension is replaced to match the storage format.
+		:param storageFormat: The on-disk format, one of 'csv', 'parquet', 'feather' or 'arrow'.
+		:param memoryMap: True to memory map the data file when reading.
+		"""
+		self.storage = getStorage(storageFormat, memoryMap=memoryMap)
 		self.csvDir = csvDir
-		self.csvFile = csvFile
+		self.csvFile = os.path.splitext(csvFile)[0] + self.storage.extension
+		self.htmlSource = None
+		self.snapshotPath = None
+		self.sourceInfo = {}
+		self.skipUnchanged = True
+		self.fingerprint = None
 		self.df = None
 
 
+	def getFilename(self):
+		"""
+		Get the path of the data file.
+
+		:return: The path of the data file.
+		"""
+		return os.path.join(self.csvDir, self.csvFile)
+
+
 	def loadFromCsv(self):
 		"""
-		Load existing prices from the csv file.
+		Load existing prices from the data file, using the configured storage format.
 		:return: A dataframe of the current spot prices.
 		"""
-		filename = os.path.join(self.csvDir, self.csvFile)
-		df = pd.read_csv(filename, index_col=0)
+		filename = self.getFilename()
+		with getTracer().span('read', source=self.sourceName, file=filename) as span:
+			df = self.storage.read(filename, indexLevels=self.indexLevels)
+			span.count(rows=df.shape[0], bytes=os.path.getsize(filename))
 
 		self.df = df
 
 		print('Read %s from disk.' % filename)
 
 		return df
+
+
+	def writeToDisk(self):
+		"""
+		Write the current dataframe to the data file, using the configured storage format.
+		"""
+		filename = self.getFilename()
+		with getTracer().span('write', source=self.sourceName, file=filename) as span:
+			self.storage.write(self.df, filename)
+			self.writeCacheMetadata(fetchedAt=self.getHtmlSourceTime())
+			span.count(rows=self.df.shape[0], bytes=os.path.getsize(filename))
+		print('Wrote', filename)
+
+
+	def getMetadataFilename(self):
+		"""
+		Get the path of the cache metadata file stored next to the data file.
+
+		:return: The path of the metadata file.
+		"""
+		return self.getFilename() + '.meta.json'
+
+
+	def getContentHash(self, df=None):
+		"""
+		Hash the contents of a dataframe, including its index.
+
+		:param df: The dataframe to hash, or None for the current dataframe.
+		:return: A hex digest of the contents.
+		"""
+		df = self.df if df is None else df
+		return hashlib.sha1(pd.util.hash_pandas_object(df, index=True).values.tobytes()).hexdigest()
+
+
+	def writeCacheMetadata(self, fetchedAt=None):
+		"""
+		Record when and from where the data file was fetched, along with a hash of its contents.
+
+		:param fetchedAt: The unix time the data was fetched, or None for now.
+		"""
+		metadata = {'fetchedAt': time.time() if fetchedAt is None else fetchedAt,
+		            'source': self.sourceInfo,
+		            'contentHash': self.getContentHash(),
+		            'rows': int(self.df.shape[0]),
+		            'fingerprint': self.fingerprint}
+		with open(self.getMetadataFilename(), 'w') as f:
+			json.dump(metadata, f, indent=1)
+
+
+	def readCacheMetadata(self):
+		"""
+		Read the cache metadata of the data file.
+
+		:return: The metadata dict, or None if there is no usable metadata.
+		"""
+		try:
+			with open(self.getMetadataFilename(), 'r') as f:
+				return json.load(f)
+		except (OSError, ValueError):
+			return None
+
+
+	def getCachedFingerprint(self):
+		"""
+		Get the page fingerprint stored with the cached data.
+
+		:return: The fingerprint dict, or None if there is no usable cached data from the same source.
+		"""
+		metadata = self.readCacheMetadata()
+		if metadata is None or not os.path.exists(self.getFilename()) or metadata.get('source') != self.sourceInfo:
+			return None
+
+		return metadata.get('fingerprint')
+
+
+	def useCachedIfUnchanged(self, fingerprint):
+		"""
+		Load the cached data instead of parsing the page when the page's fingerprint matches the one stored with it,
+		marking the cached data as fetched now.
+
+		:param fingerprint: A dict fingerprinting the page, with a 'tableHash' of the target tables and any http
+		                    validators. It is stored with the data when the page is parsed.
+		:return: True if the cached data was loaded.
+		"""
+		self.fingerprint = fingerprint
+		cached = self.getCachedFingerprint()
+		if not self.skipUnchanged or cached is None or fingerprint.get('tableHash') is None:
+			return False
+		if cached.get('tableHash') != fingerprint['tableHash']:
+			return False
+
+		self.loadFromCsv()
+		metadata = self.readCacheMetadata()
+		archivedAt = self.getHtmlSourceTime()
+		metadata['fetchedAt'] = time.time() if archivedAt is None else archivedAt
+		metadata['fingerprint'] = fingerprint
+		with open(self.getMetadataFilename(), 'w') as f:
+			json.dump(metadata, f, indent=1)
+		print('The %s tables are unchanged, kept the cached data.' % self.sourceName)
+
+		return True
+
+
+	def getHtmlSourceInfo(self):
+		"""
+		Describe the saved page in htmlSource for the cache metadata source, so data parsed from an archived page is not
+		mistaken for data from the live page, or from another archive.
+
+		:return: A dict of the htmlSource and, for a local file, its modification time, or an empty dict if the page is
+		         scraped live.
+		"""
+		if self.htmlSource is None:
+			return {}
+		if self.getHtmlSourceTime() is None:
+			return {'htmlSource': self.htmlSource}
+
+		return {'htmlSource': os.path.abspath(self.htmlSource), 'htmlSourceMtime': self.getHtmlSourceTime()}
+
+
+	def getHtmlSourceTime(self):
+		"""
+		Get when the saved page in htmlSource was archived, used as the fetch time of data parsed from it.
+
+		:return: The modification unix time of a local htmlSource file, or None for a url or a live scrape.
+		"""
+		if self.htmlSource is None or self.htmlSource.startswith('http://') or self.htmlSource.startswith('https://'):
+			return None
+
+		return os.path.getmtime(self.htmlSource)
+
+
+	def readHtmlSourceTables(self):
+		"""
+		Extract the target tables of the saved page in htmlSource, unless the page is unchanged since the cached data
+		was parsed from it.
+
+		:return: The extracted tables, see tableExtraction.extractTablesFromHtml, or None if the cached data was
+		         loaded instead.
+		"""
+		tracer = getTracer()
+		with tracer.span('fingerprint', source=self.sourceName, htmlSource=self.htmlSource):
+			cached = self.getCachedFingerprint() if self.skipUnchanged else None
+			html, validators = readHtmlSourceIfChanged(self.htmlSource, cached)
+			if html is None:
+				# The server reported the page unchanged
+				fingerprint = dict(cached, **validators)
+			else:
+				fingerprint = dict(validators, tableHash=getHtmlTablesHash(html, self.tableXPath))
+		if self.useCachedIfUnchanged(fingerprint):
+			return None
+		if html is None:
+			html, validators = readHtmlSourceIfChanged(self.htmlSource)
+			self.fingerprint = dict(validators, tableHash=getHtmlTablesHash(html, self.tableXPath))
+
+		with tracer.span('extractTables', source=self.sourceName, htmlSource=self.htmlSource):
+			tables = extractTablesFromHtml(html, self.tableXPath)
+		print('Read page snapshot', self.htmlSource)
+
+		return tables
+
+
+	def isCacheFresh(self, maxStaleness):
+		"""
+		Check if the data file exists, came from the same source and was fetched within maxStaleness seconds.
+
+		:param maxStaleness: The maximum age of the cached data in seconds.
+		:return: True if the cached data can be used.
+		"""
+		metadata = self.readCacheMetadata()
+		if metadata is None or not os.path.exists(self.getFilename()):
+			return False
+		if metadata.get('source') != self.sourceInfo:
+			return False
+
+		return time.time() - metadata['fetchedAt'] <= maxStaleness
+
+
+	def useCache(self, loadCsv, maxStaleness=None):
+		"""
+		Decide whether to load from the data file or fetch from the source.
+
+		:param loadCsv: True to load from the data file, used when no maxStaleness is given.
+		:param maxStaleness: The maximum age of the cached data in seconds, or None to follow loadCsv.
+		:return: True if the data should be loaded from the data file.
+		"""
+		if maxStaleness is None:
+			return loadCsv
+
+		fresh = self.isCacheFresh(maxStaleness)
+		print('Cached %s is %s (max staleness %is).' % (self.csvFile, 'fresh' if fresh else 'stale', maxStaleness))
+
+		return fresh
+
+
+	def saveSnapshot(self, driver):
+		"""
+		Save the rendered page, so it can be parsed again later using htmlSource.
+
+		:param driver: The selenium web driver showing the page.
+		"""
+		with open(self.snapshotPath, 'w', encoding='utf-8') as f:
+			f.write(driver.page_source)
+		print('Wrote page snapshot', self.snapshotPath)
@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+
+
+
+
+def compactFrame(df, categoricalColumns=(), categoricalIndex=True):
+	"""
+	Reduce the memory used by a dataframe. Repeated strings become categoricals and float64 columns become float32,
+	which keeps prices and specs to about 7 significant digits.
+
+	:param df: The dataframe to compact.
+	:param categoricalColumns: The string columns to store as categoricals, missing columns are skipped.
+	:param categoricalIndex: True to store the index, or each level of a MultiIndex, as categoricals.
+	:return: A compacted copy of the dataframe.
+	"""
+	df = df.copy()
+	for column in categoricalColumns:
+		if column in df.columns:
+			df[column] = df[column].astype('category')
+
+	floatColumns = df.select_dtypes(include=[np.float64]).columns
+	df[floatColumns] = df[floatColumns].astype(np.float32)
+
+	if categoricalIndex:
+		if isinstance(df.index, pd.MultiIndex):
+			df.index = pd.MultiIndex.from_arrays([pd.Categorical(df.index.get_level_values(i))
+			                                      for i in range(df.index.nlevels)], names=df.index.names)
+		else:
+			df.index = pd.CategoricalIndex(df.index, name=df.index.name)
+
+	return df
+
+
+def getMemoryUsage(df):
+	"""
+	Get the memory used by a dataframe, including its index and the contents of object columns.
+
+	:param df: The dataframe.
+	:return: The memory used in bytes.
+	"""
+	return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def getMemoryReport(frames):
+	"""
+	Report the size and memory used by each of a set of dataframes.
+
+	:param frames: A dict of name to dataframe. None values are skipped.
+	:return: A dataframe of rows, columns and bytes per name.
+	"""
+	report = [{'Source': name, 'Rows': df.shape[0], 'Columns': df.shape[1], 'Bytes': getMemoryUsage(df)}
+	          for name, df in frames.items() if df is not None]
+
+	return pd.DataFrame(report, columns=['Source', 'Rows', 'Columns', 'Bytes']).set_index('Source')
@@ -1,13 +1,9 @@
-import os
-import time
 import pandas as pd
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
 
 from priceParsing.baseParser import BaseParser
+from priceParsing.driverPool import getDefaultPool
+from priceParsing.instrumentation import getTracer
+from priceParsing.tableExtraction import extractTables, getTablesHash, parsePriceColumn
 
 
 
@@ -15,23 +11,41 @@ class DefinedDuration(BaseParser):
 	"""
 	Parsers current reserved duration prices, or reads existing reserved duration prices from csv file.
 	"""
-	def __init__(self, csvDir='csvFiles', regionId='ap-southeast-2', loadCsv=False):
+	sourceName = 'definedDurationPrices'
+
+	def __init__(self, csvDir='csvFiles', regionId='ap-southeast-2', loadCsv=False, driverPool=None, htmlSource=None,
+	             snapshotPath=None, storageFormat='csv', memoryMap=False, maxStaleness=None, skipUnchanged=True):
 		"""
 		:param csvDir: The directory to read/write csv to/from.
 		:param regionId: The region Id name, e.g. 'ap-southeast-2'.
 		:param loadCsv: True if to load existing data from csv file.
+		:param driverPool: The browser driver pool to scrape with, or None for the shared default pool.
+		:param htmlSource: A saved snapshot of the rendered page, as a file path or url, to parse without a browser.
+		:param snapshotPath: A file path to save a snapshot of the rendered page to when scraping with a browser.
+		:param storageFormat: The on-disk format, one of 'csv', 'parquet', 'feather' or 'arrow'.
+		:param memoryMap: True to memory map the data file when reading.
+		:param maxStaleness: If given, load from disk when the cached data is at most this many seconds old and came
+		                     from the same source, otherwise fetch it. Overrides loadCsv.
+		:param skipUnchanged: True to fingerprint the page tables first, keeping the cached data without extracting,
+		                      cleaning or writing when they are unchanged since it was parsed.
 		"""
 		csvFile = 'aws-defined-duration-spot-prices-' + regionId + '.csv'
-		super().__init__(csvDir=csvDir, csvFile=csvFile)
+		super().__init__(csvDir=csvDir, csvFile=csvFile, storageFormat=storageFormat, memoryMap=memoryMap)
 		self.csvDir = csvDir
-		self.csvFile = csvFile
 		self.regionId = regionId
-		self.loadCsv = loadCsv
+		self.driverPool = driverPool if driverPool is not None else getDefaultPool()
+		self.htmlSource = htmlSource
+		self.snapshotPath = snapshotPath
+		self.skipUnchanged = skipUnchanged
+		self.tableXPath = "((//h4[contains(text(), 'Defined Duration for Linux')])[1]/..//div[@class='content reg-%s']//table)[1]" % regionId
 		self.pageLink = 'https://aws.amazon.com/ec2/spot/pricing/'
-		self.stepCount = 15
+		self.stepCount = 16
+
+		self.sourceInfo = dict({'pageLink': self.pageLink, 'regionId': regionId}, **self.getHtmlSourceInfo())
 
 		self.df = None
 
+		self.loadCsv = self.useCache(loadCsv, maxStaleness)
 		if not self.loadCsv:
 			self.parseDefinedDurationPrices()
 		else:
@@ -53,73 +67,105 @@ class DefinedDuration(BaseParser):
 
 		:return: A dataframe of the current defined duration prices.
 		"""
-		startTime = time.time()
-		# Create web page driver
-		options = Options()
-		options.headless = True
-		options.add_argument("--window-size=1920,1200")
+		with getTracer().span('parse', source=self.sourceName):
+			if self.htmlSource is not None:
+				# Parse a saved snapshot of the page
+				tables = self.readHtmlSourceTables()
+			else:
+				# Scrape the tables using a pooled web page driver
+				with self.driverPool.session() as driver:
+					tables = self.scrapeDefinedDurationTables(driver)
+			if tables is None:
+				# The page is unchanged, the cached data was loaded instead
+				return self.df
+
+			# Convert to dataframe
+			self.df = self.readDefinedDurationTables(tables)
+
+			# Write data to disc
+			self.writeToDisk()
+
+		return self.df
+
+
+	def scrapeDefinedDurationTables(self, driver):
+		"""
+		Load the webpage and scrape the defined duration tables.
 
-		driver = webdriver.Chrome(options=options)
-		driver.get(self.pageLink)
+		:param driver: The selenium web driver to use.
+		:return: The extracted tables, see tableExtraction.extractTables, or None if the table is unchanged and the
+		         cached data was loaded instead.
+		"""
+		from selenium.webdriver.common.by import By
+		from selenium.webdriver.support.ui import WebDriverWait
+		from selenium.webdriver.support import expected_conditions as EC
+
+		with getTracer().span('pageLoad', source=self.sourceName):
+			driver.get(self.pageLink)
 
 		# Click Linux Defined Duration Button
-		onDemandButton = driver.find_elements_by_xpath(".//a[contains(text(), 'Defined Duration for Linux')]")[0]
+		onDemandButton = driver.find_elements(By.XPATH, ".//a[contains(text(), 'Defined Duration for Linux')]")[0]
 		onDemandButton.click()
 		self.printStep(1, "Found OS Selection Button")
 
 		# Select Region
 		# Get section only containing one of these buttons
-		singleSection = driver.find_elements_by_xpath(".//h4[contains(text(), 'Defined Duration for Linux')]")[0].find_element_by_xpath("./..")
+		singleSection = driver.find_elements(By.XPATH, ".//h4[contains(text(), 'Defined Duration for Linux')]")[0].find_element(By.XPATH, "./..")
 		self.printStep(2, "Found Selection Selector")
 		# Wait for dropdown to appear
 		WebDriverWait(singleSection, 5).until(EC.presence_of_element_located((By.XPATH, ".//div[@class='dropdown-wrapper inline']"))).click()
 		# Click region
-		singleSection.find_element_by_xpath(".//li[@data-value='%s']" % self.regionId).click()
+		singleSection.find_element(By.XPATH, ".//li[@data-value='%s']" % self.regionId).click()
 		self.printStep(3, "Selected Region Dropdown")
 
 		# Get Tables
-		tableGroup = singleSection.find_element_by_xpath(".//div[@class='content reg-%s']" % self.regionId)
-		tables = tableGroup.find_element_by_xpath(".//table")
+		tableGroup = singleSection.find_element(By.XPATH, ".//div[@class='content reg-%s']" % self.regionId)
+		tables = tableGroup.find_element(By.XPATH, ".//table")
 		self.printStep(4, "Found section Tables")
+		if self.snapshotPath is not None:
+			self.saveSnapshot(driver)
 
-		# Parse Data From Tables
-		data = []
-		subTables = tables.find_elements_by_xpath(".//tbody")
-		stepCount = 4
-		for subTable in subTables:
-			rows = subTable.find_elements_by_xpath(".//tr")
-			headRow = subTable.find_elements_by_xpath(".//th")
-			if len(headRow) > 0:
-				groupType = headRow[0].text
-				for row in rows[1:]:
-					# Parse columns
-					cols = row.find_elements_by_xpath(".//td")
-					nodeType = cols[0].text
-					reserved1Hour = float(cols[1].text.replace("$", "").replace(" per Hour", ""))
-					reserved6Hour = float(cols[2].text.replace("$", "").replace(" per Hour", ""))
-
-					# Store data
-					rowData = [nodeType, groupType, reserved1Hour, reserved6Hour]
-					data.append(rowData)
-
-			stepCount += 1
-			self.printStep(stepCount, "Parsed Table %i" % (stepCount - 4))
-
-		# Convert to dataframe
-		self.df = pd.DataFrame(data, columns=['InstanceType', 'GroupType', '1-Hour Reserved', '6-Hour Reserved'])
-		self.df['1-Hour Reserved'] = self.df['1-Hour Reserved'].astype(float)
-		self.df['6-Hour Reserved'] = self.df['6-Hour Reserved'].astype(float)
-		self.df = self.df.set_index(['InstanceType'])
-
-		# Write data to disc
-		filename = os.path.join(self.csvDir, self.csvFile)
-		self.df.to_csv(filename)
-		print('Wrote', filename)
-
-		endTime = time.time()
-		print('Elapsed %.2fs' % (endTime - startTime))
+		# Skip extracting the table if it is unchanged since the cached data was parsed
+		with getTracer().span('fingerprint', source=self.sourceName):
+			tableHash = getTablesHash(driver, tables)
+		if self.useCachedIfUnchanged({'tableHash': tableHash}):
+			return None
 
-		return self.df
+		# Pull the whole table in one call
+		with getTracer().span('extractTables', source=self.sourceName):
+			tables = extractTables(driver, tables)
+		self.printStep(5, "Extracted section Tables")
 
+		return tables
 
 
+	def readDefinedDurationTables(self, tables):
+		"""
+		Read the defined duration prices from the extracted tables.
+
+		:param tables: The extracted tables, see tableExtraction.extractTables.
+		:return: A dataframe of the defined duration prices.
+		"""
+		data = []
+		stepCount = 5
+		for table in tables:
+			for subTable in table['tbodies']:
+				with getTracer().span('table', source=self.sourceName, table=stepCount - 4) as span:
+					headRow = [cell.strip() for row in subTable for cell in row['th']]
+					if len(headRow) > 0:
+						groupType = headRow[0]
+						for row in subTable[1:]:
+							# Store data
+							cols = [cell.strip() for cell in row['td']]
+							data.append([cols[0], groupType, cols[1], cols[2]])
+						span.count(rows=len(subTable) - 1)
+
+				stepCount += 1
+				self.printStep(stepCount, "Parsed Table %i" % (stepCount - 5))
+
+		df = pd.DataFrame(data, columns=['InstanceType', 'GroupType', '1-Hour Reserved', '6-Hour Reserved'])
+		df['1-Hour Reserved'] = parsePriceColumn(df['1-Hour Reserved'])
+		df['6-Hour Reserved'] = parsePriceColumn(df['6-Hour Reserved'])
+		df = df.set_index(['InstanceType'])
+
+		return df
@@ -0,0 +1,170 @@
+import atexit
+import threading
+from contextlib import contextmanager
+from priceParsing.instrumentation import getTracer
+
+
+
+
+class PooledDriver:
+	"""
+	A headless Chrome session owned by a driver pool, along with how many times it has been used.
+	"""
+	def __init__(self, driver):
+		"""
+		:param driver: The selenium web driver.
+		"""
+		self.driver = driver
+		self.uses = 0
+
+
+
+class DriverPool:
+	"""
+	A pool of reusable headless Chrome sessions shared between the webpage parsers.
+
+	Sessions are created lazily, handed out with session(), returned afterwards, recycled after maxUses uses or
+	when a parser fails while using them, and all quit on shutdown.
+	"""
+	def __init__(self, maxSessions=4, maxUses=20, windowSize='1920,1200'):
+		"""
+		:param maxSessions: The maximum number of browser sessions alive at once.
+		:param maxUses: The number of checkouts after which a session is quit and replaced.
+		:param windowSize: The browser window size, e.g. '1920,1200'.
+		"""
+		self.maxSessions = maxSessions
+		self.maxUses = maxUses
+		self.windowSize = windowSize
+
+		self.idle = []
+		self.sessionCount = 0
+		self.closed = False
+		self.condition = threading.Condition()
+
+
+	def createDriver(self):
+		"""
+		Start a new headless Chrome session.
+
+		:return: The selenium web driver.
+		"""
+		from selenium import webdriver
+		from selenium.webdriver.chrome.options import Options
+
+		options = Options()
+		options.headless = True
+		options.add_argument("--window-size=%s" % self.windowSize)
+
+		with getTracer().span('browserStartup'):
+			return webdriver.Chrome(options=options)
+
+
+	def checkout(self):
+		"""
+		Take an idle session from the pool, starting a new one if none are idle and the pool is not full.
+		Blocks until a session is available.
+
+		:return: The pooled driver.
+		"""
+		with self.condition:
+			while True:
+				if self.closed:
+					raise RuntimeError('The driver pool has been shut down.')
+				if len(self.idle) > 0:
+					return self.idle.pop()
+				if self.sessionCount < self.maxSessions:
+					self.sessionCount += 1
+					break
+				self.condition.wait()
+
+		try:
+			return PooledDriver(self.createDriver())
+		except Exception:
+			with self.condition:
+				self.sessionCount -= 1
+				self.condition.notify()
+			raise
+
+
+	def checkin(self, pooledDriver, failed=False):
+		"""
+		Return a session to the pool, quitting it if it failed, is worn out or the pool is closed.
+
+		:param pooledDriver: The pooled driver from checkout().
+		:param failed: True if the session raised an error while checked out.
+		"""
+		pooledDriver.uses += 1
+		with self.condition:
+			recycle = failed or self.closed or pooledDriver.uses >= self.maxUses
+			if recycle:
+				self.sessionCount -= 1
+			else:
+				self.idle.append(pooledDriver)
+			self.condition.notify()
+
+		if recycle:
+			self.quitDriver(pooledDriver)
+
+
+	@contextmanager
+	def session(self):
+		"""
+		Check out a browser session for the duration of a with block.
+
+		:return: A context manager yielding the selenium web driver.
+		"""
+		pooledDriver = self.checkout()
+		try:
+			yield pooledDriver.driver
+		except BaseException:
+			self.checkin(pooledDriver, failed=True)
+			raise
+		self.checkin(pooledDriver)
+
+
+	def quitDriver(self, pooledDriver):
+		"""
+		Quit a browser session, ignoring errors from sessions that have already died.
+
+		:param pooledDriver: The pooled driver to quit.
+		"""
+		try:
+			pooledDriver.driver.quit()
+		except Exception as e:
+			print('Failed to quit browser session: %r' % e)
+
+
+	def shutdown(self):
+		"""
+		Quit every idle session. Sessions still checked out are quit when they are returned.
+		"""
+		with self.condition:
+			self.closed = True
+			idle = self.idle
+			self.idle = []
+			self.sessionCount -= len(idle)
+			self.condition.notify_all()
+
+		for pooledDriver in idle:
+			self.quitDriver(pooledDriver)
+
+
+
+
+defaultPool = None
+defaultPoolLock = threading.Lock()
+
+
+def getDefaultPool():
+	"""
+	Get the process wide driver pool, creating it on first use. It is shut down when the interpreter exits.
+
+	:return: The default driver pool.
+	"""
+	global defaultPool
+	with defaultPoolLock:
+		if defaultPool is None:
+			defaultPool = DriverPool()
+			atexit.register(defaultPool.shutdown)
+
+	return defaultPool
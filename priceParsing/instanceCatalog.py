@@ -0,0 +1,156 @@
+import numpy as np
+import pandas as pd
+
+
+
+# Characters scraped labels differ by, e.g. 'm5.large ', 'm5.large*' or non-breaking spaces
+IGNORED_CHARACTERS_PATTERN = r'[\s *]+'
+
+
+
+
+class SourceMapping:
+	"""
+	The catalog ids of a source frame's rows, with duplicate rows dropped.
+	"""
+	def __init__(self, ids, rows, duplicates):
+		"""
+		:param ids: The catalog id of each kept row.
+		:param rows: The position in the source frame of each kept row.
+		:param duplicates: The keys that appeared more than once in the source, only the first row of each is kept.
+		"""
+		self.ids = ids
+		self.rows = rows
+		self.duplicates = duplicates
+
+
+
+class InstanceCatalog:
+	"""
+	Canonical instance type keys mapped to dense integer ids.
+
+	Each source frame is mapped onto the catalog once by normalising its labels and looking them up in a hash index,
+	after which sources are joined with positional gathers instead of label alignment. Ids are stable for the life
+	of the catalog, new keys are appended. The keys are only used for joining, each id also keeps the first label
+	seen for it, so combined frames stay indexed by the scraped instance types.
+	"""
+	def __init__(self, aliases=None):
+		"""
+		:param aliases: A dict of renamed instance types to their canonical names, e.g. {'old.size': 'new.size'}.
+		"""
+		aliases = {} if aliases is None else aliases
+		self.aliases = {self.normaliseKey(k): self.normaliseKey(v) for k, v in aliases.items()}
+		# Renamed instance types are labelled with their current names
+		self.aliasLabels = {self.normaliseKey(v): v for v in aliases.values()}
+		self.keys = []
+		self.labels = []
+		self.ids = {}
+
+
+	def __len__(self):
+		return len(self.keys)
+
+
+	def normaliseKey(self, label):
+		"""
+		Normalise one instance type label.
+
+		:param label: The scraped label.
+		:return: The key.
+		"""
+		return normaliseInstanceTypes([label])[0]
+
+
+	def getIds(self, keys, labels=None):
+		"""
+		Look up the ids of normalised keys, adding any new keys to the catalog.
+
+		:param keys: An iterable of keys.
+		:param labels: The scraped label of each key, kept for new keys, or None to label new keys with the keys.
+		:return: An int64 array of ids.
+		"""
+		labels = keys if labels is None else labels
+		ids = np.empty(len(keys), dtype=np.int64)
+		for i, (key, label) in enumerate(zip(keys, labels)):
+			key = self.aliases.get(key, key)
+			id = self.ids.get(key)
+			if id is None:
+				id = self.ids[key] = len(self.keys)
+				self.keys.append(key)
+				self.labels.append(self.aliasLabels.get(key, label))
+			ids[i] = id
+
+		return ids
+
+
+	def getKeys(self, ids):
+		"""
+		Get the keys of ids.
+
+		:param ids: An array of ids.
+		:return: An object array of keys.
+		"""
+		return np.asarray(self.keys, dtype=object)[ids]
+
+
+	def getLabels(self, ids):
+		"""
+		Get the labels of ids, the first scraped label seen for each.
+
+		:param ids: An array of ids.
+		:return: An object array of labels.
+		"""
+		return np.asarray(self.labels, dtype=object)[ids]
+
+
+	def mapFrame(self, df):
+		"""
+		Map the rows of a frame indexed by instance type onto the catalog.
+
+		:param df: The source frame.
+		:return: The SourceMapping of the frame.
+		"""
+		ids = self.getIds(normaliseInstanceTypes(df.index), df.index)
+		uniqueIds, first, counts = np.unique(ids, return_index=True, return_counts=True)
+		rows = np.sort(first)
+
+		return SourceMapping(ids[rows], rows, list(self.getKeys(uniqueIds[counts > 1])))
+
+
+	def gather(self, df, mapping, rowIds):
+		"""
+		Gather a mapped frame's columns into the order of a set of catalog ids, with missing rows left empty.
+
+		:param df: The source frame.
+		:param mapping: The SourceMapping of the frame.
+		:param rowIds: The catalog ids of the output rows.
+		:return: A dict of column name to gathered array.
+		"""
+		lookup = np.full(len(self), -1, dtype=np.int64)
+		lookup[mapping.ids] = mapping.rows
+		positions = lookup[rowIds]
+		missing = positions < 0
+
+		# Gather from any row, then blank the missing rows with the column's own missing value
+		columns = {}
+		for column in df.columns:
+			values = df[column].reset_index(drop=True)
+			if values.shape[0] == 0:
+				values = values.reindex(range(1))
+			gathered = values.take(np.where(missing, 0, positions)).reset_index(drop=True)
+			columns[column] = (gathered.where(~missing) if missing.any() else gathered).array
+
+		return columns
+
+
+
+
+def normaliseInstanceTypes(labels):
+	"""
+	Normalise scraped instance type labels to catalog keys, ignoring whitespace, non-breaking spaces, footnote stars
+	and case.
+
+	:param labels: An iterable of labels, e.g. a frame's index.
+	:return: An object array of keys.
+	"""
+	return pd.Index(labels).astype(str).str.replace(IGNORED_CHARACTERS_PATTERN, '', regex=True).str.lower().to_numpy()
@@ -0,0 +1,441 @@
+import os
+import io
+import json
+import time
+import logging
+import threading
+import tracemalloc
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+
+
+
+
+# The innermost open span of the running thread or task
+currentSpan = contextvars.ContextVar('currentSpan', default=None)
+
+
+
+
+class Span:
+	"""
+	A timed stage, with its attributes, row and byte counters and nested child stages.
+	"""
+	def __init__(self, name, attributes, parent):
+		"""
+		:param name: The stage name, e.g. 'collect', 'table' or 'write'.
+		:param attributes: A dict of attributes describing the stage, e.g. {'source': 'spotPrices'}.
+		:param parent: The enclosing span, or None for a root span.
+		"""
+		self.name = name
+		self.attributes = attributes
+		self.parent = parent
+		self.depth = 0 if parent is None else parent.depth + 1
+		self.threadId = threading.get_ident()
+		self.startTime = time.time()
+		self.startCounter = time.perf_counter()
+		self.duration = None
+		self.rows = 0
+		self.bytes = 0
+		self.error = None
+		self.profile = None
+		self.memory = None
+		self.children = []
+
+
+	def count(self, rows=0, bytes=0):
+		"""
+		Add to the row and byte counters of the span.
+
+		:param rows: The number of rows processed.
+		:param bytes: The number of bytes read or written.
+		"""
+		self.rows += rows
+		self.bytes += bytes
+
+
+	def toDict(self):
+		"""
+		Convert the span and its children to plain data.
+
+		:return: A dict of the span.
+		"""
+		return {'name': self.name,
+		        'attributes': self.attributes,
+		        'startTime': self.startTime,
+		        'duration': self.duration,
+		        'rows': self.rows,
+		        'bytes': self.bytes,
+		        'error': self.error,
+		        'memory': self.memory,
+		        'profile': self.profile,
+		        'children': [child.toDict() for child in self.children]}
+
+
+
+class Tracer:
+	"""
+	Records nested timing spans and passes each finished span to a set of sinks.
+
+	The open span is tracked with a context variable, so spans nest per thread. Work submitted to a thread pool
+	nests under the submitting span when run with contextvars.copy_context().run.
+	"""
+	def __init__(self, sinks=None, profileStages=(), memoryStages=(), maxRootSpans=100):
+		"""
+		:param sinks: A list of sinks, e.g. ConsoleSink, LoggingSink, JsonTraceSink or PrometheusSink.
+		:param profileStages: Stage names to run under cProfile, keeping the top functions on the span.
+		:param memoryStages: Stage names to trace allocations of with tracemalloc, keeping the allocated and peak
+		                     bytes on the span.
+		:param maxRootSpans: The number of finished root spans to keep in rootSpans.
+		"""
+		self.sinks = [] if sinks is None else list(sinks)
+		self.profileStages = set(profileStages)
+		self.memoryStages = set(memoryStages)
+		self.rootSpans = deque(maxlen=maxRootSpans)
+		self.lock = threading.Lock()
+
+
+	@contextmanager
+	def span(self, name, **attributes):
+		"""
+		Time a stage for the duration of a with block.
+
+		:param name: The stage name.
+		:param attributes: Attributes describing the stage, e.g. source='spotPrices'.
+		:return: A context manager yielding the span.
+		"""
+		parent = currentSpan.get()
+		span = Span(name, attributes, parent)
+		if parent is not None:
+			with self.lock:
+				parent.children.append(span)
+		token = currentSpan.set(span)
+
+		profiler = self.startProfile(span)
+		memoryStart = self.startMemoryTrace(span)
+		try:
+			yield span
+		except BaseException as e:
+			span.error = repr(e)
+			raise
+		finally:
+			span.duration = time.perf_counter() - span.startCounter
+			self.stopMemoryTrace(span, memoryStart)
+			self.stopProfile(span, profiler)
+			currentSpan.reset(token)
+			self.finish(span)
+
+
+	def count(self, rows=0, bytes=0):
+		"""
+		Add to the row and byte counters of the open span, if there is one.
+
+		:param rows: The number of rows processed.
+		:param bytes: The number of bytes read or written.
+		"""
+		span = currentSpan.get()
+		if span is not None:
+			span.count(rows=rows, bytes=bytes)
+
+
+	def startProfile(self, span):
+		"""
+		Start profiling the span's thread if its stage is profiled.
+
+		:param span: The starting span.
+		:return: The profiler, or None.
+		"""
+		if span.name not in self.profileStages:
+			return None
+		import cProfile
+
+		profiler = cProfile.Profile()
+		try:
+			profiler.enable()
+		except ValueError:
+			# Another stage is already being profiled
+			return None
+
+		return profiler
+
+
+	def stopProfile(self, span, profiler, top=20):
+		"""
+		Stop profiling and keep a summary of the slowest functions on the span.
+
+		:param span: The finishing span.
+		:param profiler: The profiler from startProfile, or None.
+		:param top: The number of functions to keep, by cumulative time.
+		"""
+		if profiler is None:
+			return
+		import pstats
+
+		profiler.disable()
+		output = io.StringIO()
+		pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(top)
+		span.profile = output.getvalue()
+
+
+	def startMemoryTrace(self, span):
+		"""
+		Start tracing allocations if the span's stage is traced.
+
+		:param span: The starting span.
+		:return: The traced memory in bytes at the start, or None.
+		"""
+		if span.name not in self.memoryStages:
+			return None
+		if not tracemalloc.is_tracing():
+			tracemalloc.start()
+		tracemalloc.reset_peak()
+
+		return tracemalloc.get_traced_memory()[0]
+
+
+	def stopMemoryTrace(self, span, memoryStart):
+		"""
+		Keep the bytes allocated during the span and its peak on the span. Peaks are since the most recently started
+		traced stage.
+
+		:param span: The finishing span.
+		:param memoryStart: The traced memory from startMemoryTrace, or None.
+		"""
+		if memoryStart is None:
+			return
+		current, peak = tracemalloc.get_traced_memory()
+		span.memory = {'allocated': current - memoryStart, 'peak': peak - memoryStart}
+
+
+	def finish(self, span):
+		"""
+		Pass a finished span to the sinks, flushing them when a root span finishes.
+
+		:param span: The finished span.
+		"""
+		for sink in self.sinks:
+			sink.emit(span)
+		if span.parent is None:
+			self.rootSpans.append(span)
+			for sink in self.sinks:
+				sink.flush()
+
+
+
+
+class ConsoleSink:
+	"""
+	Prints the elapsed time of each finished stage of the given names, as the parsers printed before tracing.
+	"""
+	def __init__(self, stages=('parse',)):
+		"""
+		:param stages: The stage names to print the elapsed time of.
+		"""
+		self.stages = set(stages)
+
+
+	def emit(self, span):
+		"""
+		Print the elapsed time of a span, if it is one of the stages and finished without an error.
+
+		:param span: The finished span.
+		"""
+		if span.name in self.stages and span.error is None:
+			print('Elapsed %.2fs' % span.duration)
+
+
+	def flush(self):
+		"""
+		Nothing to flush, spans are printed as they finish.
+		"""
+		pass
+
+
+
+class LoggingSink:
+	"""
+	Logs one line per finished span, indented by depth.
+	"""
+	def __init__(self, logger=None, level=logging.INFO):
+		"""
+		:param logger: The logger to use, or None for the 'priceParsing' logger.
+		:param level: The log level of the span lines.
+		"""
+		self.logger = logging.getLogger('priceParsing') if logger is None else logger
+		self.level = level
+
+
+	def emit(self, span):
+		"""
+		Log a line for the span, followed by its profile if it was profiled.
+
+		:param span: The finished span.
+		"""
+		attributes = ' '.join('%s=%s' % item for item in span.attributes.items())
+		self.logger.log(self.level, '%s%s %s %.3fs rows=%i bytes=%i%s', '  ' * span.depth, span.name, attributes,
+		                span.duration, span.rows, span.bytes, '' if span.error is None else ' error=%s' % span.error)
+		if span.profile is not None:
+			self.logger.log(self.level, 'Profile of %s:\n%s', span.name, span.profile)
+
+
+	def flush(self):
+		"""
+		Nothing to flush, the logging handlers write the lines.
+		"""
+		pass
+
+
+
+class JsonTraceSink:
+	"""
+	Writes spans to a Chrome trace event json file, which can be opened with chrome://tracing or Perfetto.
+	The file is rewritten whenever a root span finishes.
+	"""
+	def __init__(self, filename, maxEvents=100000):
+		"""
+		:param filename: The trace file to write.
+		:param maxEvents: The number of most recent spans to keep in the file.
+		"""
+		self.filename = filename
+		self.events = deque(maxlen=maxEvents)
+		self.lock = threading.Lock()
+
+
+	def emit(self, span):
+		"""
+		Add the span as a complete trace event, dropping the oldest event once maxEvents are kept.
+
+		:param span: The finished span.
+		"""
+		event = {'name': span.name,
+		         'ph': 'X',
+		         'ts': span.startTime * 1e6,
+		         'dur': span.duration * 1e6,
+		         'pid': os.getpid(),
+		         'tid': span.threadId,
+		         'args': dict(span.attributes, rows=span.rows, bytes=span.bytes, error=span.error, memory=span.memory)}
+		with self.lock:
+			self.events.append(event)
+
+
+	def flush(self):
+		"""
+		Rewrite the trace file with the kept events.
+		"""
+		with self.lock:
+			events = list(self.events)
+		with open(self.filename, 'w') as f:
+			json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
+
+class PrometheusSink:
+	"""
+	Aggregates span durations, rows and bytes per stage and source, in the Prometheus text exposition format.
+	"""
+	def __init__(self, filename=None, prefix='aws_price_collator'):
+		"""
+		:param filename: A file to write the metrics to when a root span finishes, e.g. for the node exporter
+		                 textfile collector, or None to only render them on request.
+		:param prefix: The metric name prefix.
+		"""
+		self.filename = filename
+		self.prefix = prefix
+		self.stages = {}
+		self.lock = threading.Lock()
+
+
+	def emit(self, span):
+		"""
+		Add the span to the totals of its stage and source.
+
+		Spans are keyed only on their name and 'source' attribute, any other attributes such as the file or region are
+		not labels, so spans of the same stage and source with different attribute values are summed together.
+
+		:param span: The finished span.
+		"""
+		key = (span.name, str(span.attributes.get('source', '')))
+		with self.lock:
+			stage = self.stages.setdefault(key, {'count': 0, 'seconds': 0.0, 'rows': 0, 'bytes': 0, 'errors': 0})
+			stage['count'] += 1
+			stage['seconds'] += span.duration
+			stage['rows'] += span.rows
+			stage['bytes'] += span.bytes
+			stage['errors'] += span.error is not None
+
+
+	def render(self):
+		"""
+		Render the metrics.
+
+		:return: The metrics in the Prometheus text format.
+		"""
+		metrics = [('stage_duration_seconds', 'summary', 'Time spent in each stage.', 'seconds'),
+		           ('stage_rows_total', 'counter', 'Rows processed by each stage.', 'rows'),
+		           ('stage_bytes_total', 'counter', 'Bytes read or written by each stage.', 'bytes'),
+		           ('stage_errors_total', 'counter', 'Stages that raised an error.', 'errors')]
+		with self.lock:
+			stages = {key: dict(stage) for key, stage in self.stages.items()}
+
+		lines = []
+		for name, metricType, description, key in metrics:
+			name = '%s_%s' % (self.prefix, name)
+			lines += ['# HELP %s %s' % (name, description), '# TYPE %s %s' % (name, metricType)]
+			for (stageName, source), stage in sorted(stages.items()):
+				labels = '{stage="%s",source="%s"}' % (stageName, source)
+				if metricType == 'summary':
+					lines += ['%s_sum%s %r' % (name, labels, stage[key]),
+					          '%s_count%s %i' % (name, labels, stage['count'])]
+				else:
+					lines.append('%s%s %i' % (name, labels, stage[key]))
+
+		return '\n'.join(lines) + '\n'
+
+
+	def flush(self):
+		"""
+		Write the rendered metrics to the file, if one was given.
+		"""
+		if self.filename is None:
+			return
+		# Write then rename, so scrapers never read a partial file
+		with open(self.filename + '.tmp', 'w') as f:
+			f.write(self.render())
+		os.replace(self.filename + '.tmp', self.filename)
+
+
+
+
+defaultTracer = Tracer(sinks=[ConsoleSink()])
+
+
+def getTracer():
+	"""
+	Get the process wide tracer. It only prints the elapsed time of each parse until another is set with setTracer.
+
+	:return: The default tracer.
+	"""
+	return defaultTracer
+
+
+def setTracer(tracer):
+	"""
+	Replace the process wide tracer, e.g. with Tracer(sinks=[LoggingSink()]).
+
+	:param tracer: The new tracer.
+	"""
+	global defaultTracer
+	defaultTracer = tracer
+
+
+def submitTraced(executor, function, *args):
+	"""
+	Submit work to an executor so its spans nest under the open span of the caller.
+
+	:param executor: The executor, e.g. a ThreadPoolExecutor.
+	:param function: The function to run.
+	:param args: The arguments of the function.
+	:return: The future.
+	"""
+	return executor.submit(contextvars.copy_context().run, function, *args)
@@ -1,13 +1,15 @@
 import os
-import time
+import re
+import json
+import shutil
+import numpy as np
 import pandas as pd
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
 
 from priceParsing.baseParser import BaseParser
+from priceParsing.driverPool import getDefaultPool
+from priceParsing.instrumentation import getTracer
+from priceParsing.specNormalization import normalizeNodeTypeSpecs, getHeaderUnit
+from priceParsing.tableExtraction import extractTables, extractTableHeaders, getTablesHash
 
 
 
@@ -15,24 +17,84 @@ class NodeTypes(BaseParser):
 	"""
 	Parsers current node types, or reads existing node types from csv file.
 	"""
-	def __init__(self, csvDir='csvFiles', loadCsv=False):
+	sourceName = 'nodeTypes'
+
+	# Kept columns, in order, mapped to the scraped headers holding their data. Later headers take priority.
+	columnSynonyms = {
+		'InstanceType': ['Instance Size', 'Instance', 'Instance size', 'Name', 'Model'],
+		'vCPU': ['vCPU', 'vCPUs', 'vCPU*', 'Logical Processors*'],
+		'Mem (GiB)': ['Mem (GiB)', 'RAM (GiB)', 'Mem(GiB)', 'Memory (GiB)'],
+		'Storage': ['Storage', 'Instance Storage', 'Instance Storage (GIB)', 'Instance Storage (GiB)', 'Storage (GB)',
+		            'Instance Storage (GB)', 'Local Storage (GB)', 'Instance Storage (TB)'],
+		'GPUs': ['GPUs'],
+		'GPU Mem (GiB)': ['GPU Mem (GiB)', 'GPU Memory (GiB)'],
+		'EBS Bandwidth': ['EBS Bandwidth', 'EBS Bandwidth (Mbps)', 'EBS Burst Bandwidth (Mbps)',
+		                  'Dedicated EBS Bandwidth (Mbps)', 'EBS Bandwidth (Gbps)', 'Dedicated EBS Bandwidth (Gbps)',
+		                  'Dedicated EBS Bandwidth', 'EBS bandwidth'],
+		'Network Performance': ['Network Performance'],
+		'Network': ['Network Bandwidth', 'Network Bandwidth (Gbps)', 'Network Burst Bandwidth (Gbps)',
+		            'Network Performance (Gbps)', 'Networking Performance (Gbps)', 'Networking Performance',
+		            'Network Perf (Gbps)', 'Network bandwidth'],
+		'Baseline Performance / vCPU': ['Baseline Performance / vCPU'],
+		'CPU Credits/hour': ['CPU Credits/hour', 'CPU Credits Earned / Hr', 'CPU Credits / hour'],
+		'GPUDirect RDMA': ['GPUDirect RDMA'],
+		'GPU P2P': ['GPU P2P', 'GPU Peer to Peer'],
+		'Inferentia chips': ['Inferentia chips'],
+		'Inferentia chip-to-chip interconnect': ['Inferentia chip-to-chip interconnect'],
+		'FPGAs': ['FPGAs'],
+		'Aggregate Disk Throughput (MiB/s)': ['Aggregate Disk Throughput (MiB/s)'],
+	}
+	# Kept columns whose headers may give the unit of their values, mapped to the column holding each value's unit
+	unitColumns = {'Storage': 'Storage Unit', 'EBS Bandwidth': 'EBS Bandwidth Unit'}
+	# Patterns for headers AWS renders inconsistently, matched against the normalised header after the synonyms
+	columnPatterns = {
+		'EBS Bandwidth': r'ebs.*bandwidth',
+	}
+
+	def __init__(self, csvDir='csvFiles', loadCsv=False, driverPool=None, htmlSource=None,
+	             snapshotPath=None, storageFormat='csv', memoryMap=False, maxStaleness=None, resume=True,
+	             maxTableRetries=2, skipUnchanged=True):
 		"""
 		:param loadCsv: True if to load existing data from csv file.
+		:param driverPool: The browser driver pool to scrape with, or None for the shared default pool.
+		:param htmlSource: A saved snapshot of the rendered page, as a file path or url, to parse without a browser.
+		:param snapshotPath: A file path to save a snapshot of the rendered page to when scraping with a browser.
+		:param storageFormat: The on-disk format, one of 'csv', 'parquet', 'feather' or 'arrow'.
+		:param memoryMap: True to memory map the data file when reading.
+		:param maxStaleness: If given, load from disk when the cached data is at most this many seconds old and came
+		                     from the same source, otherwise fetch it. Overrides loadCsv.
+		:param resume: True to reuse the tables checkpointed by an earlier failed scrape of the same page version.
+		:param maxTableRetries: The number of times to retry a table that failed to scrape, before moving on to the
+		                        next table and failing the scrape once every table has been tried.
+		:param skipUnchanged: True to fingerprint the page tables first, keeping the cached data without extracting,
+		                      cleaning or writing when they are unchanged since it was parsed.
 		"""
 		csvFile = 'aws-nodeTypes.csv'
-		super().__init__(csvDir=csvDir, csvFile=csvFile)
+		super().__init__(csvDir=csvDir, csvFile=csvFile, storageFormat=storageFormat, memoryMap=memoryMap)
 		self.csvDir = csvDir
-		self.csvFile = csvFile
-		self.loadCsv = loadCsv
+		self.driverPool = driverPool if driverPool is not None else getDefaultPool()
+		self.htmlSource = htmlSource
+		self.snapshotPath = snapshotPath
+		self.tableXPath = "//table"
 		self.pageLink = 'https://aws.amazon.com/ec2/instance-types/'
 		self.stepCount = 46
+		self.resume = resume
+		self.maxTableRetries = maxTableRetries
+		self.skipUnchanged = skipUnchanged
+		self.checkpointRoot = os.path.join(csvDir, '.checkpoints', self.sourceName)
+
+		self.sourceInfo = dict({'pageLink': self.pageLink}, **self.getHtmlSourceInfo())
 
 		self.df = None
 
+		self.loadCsv = self.useCache(loadCsv, maxStaleness)
 		if not self.loadCsv:
 			self.parseNodeTypesPrices()
 		else:
 			self.loadFromCsv()
+			# Files written before the typed spec columns existed
+			if 'Storage (GB)' not in self.df.columns:
+				self.df = normalizeNodeTypeSpecs(self.df)
 
 
 	def printStep(self, stepNum, stepStr):
@@ -50,159 +112,274 @@ class NodeTypes(BaseParser):
 
 		:return: A dataframe of the current defined node types.
 		"""
-		startTime = time.time()
-		# Create web page driver
-		options = Options()
-		options.headless = True
-		options.add_argument("--window-size=1920,1200")
+		tracer = getTracer()
+		with tracer.span('parse', source=self.sourceName):
+			if self.htmlSource is not None:
+				# Parse a saved snapshot of the page
+				tables = self.readHtmlSourceTables()
+				data = None if tables is None else self.readNodeTypesTables(tables)
+			else:
+				# Scrape the tables one at a time using a pooled web page driver
+				with self.driverPool.session() as driver:
+					data = self.scrapeNodeTypesTables(driver)
+			if data is None:
+				# The page is unchanged, the cached data was loaded instead
+				return self.df
+
+			# Convert to dataframe
+			self.df = pd.DataFrame(data)
+			# Clean dataframe
+			with tracer.span('clean', source=self.sourceName) as span:
+				self.df = self.cleanNodeTypesDataframe(self.df)
+				span.count(rows=self.df.shape[0])
+			with tracer.span('normalize', source=self.sourceName) as span:
+				self.df = normalizeNodeTypeSpecs(self.df)
+				span.count(rows=self.df.shape[0])
+			self.df = self.df.set_index(['InstanceType'])
+
+			# Write data to disc
+			self.writeToDisk()
+			self.clearCheckpoints()
+
+		return self.df
+
+
+	def scrapeNodeTypesTables(self, driver):
+		"""
+		Load the webpage and scrape the node types tables one at a time.
 
-		driver = webdriver.Chrome(options=options)
-		driver.get(self.pageLink)
+		Each parsed table is checkpointed under the cache directory, keyed by a hash of every table's content, so
+		a scrape that fails part way resumes from the tables it already parsed while the page is unchanged.
+		A failed table is retried on its own, and the scrape only fails after every other table has been tried.
 
-		# Get Tables
-		tables = driver.find_elements_by_xpath("//table")
-		self.printStep(1, "Found section Tables")
+		:param driver: The selenium web driver to use.
+		:return: A list of dicts of column header to value, one per node type, or None if the tables are unchanged and
+		         the cached data was loaded instead.
+		"""
+		from selenium.webdriver.common.by import By
+
+		with getTracer().span('pageLoad', source=self.sourceName):
+			driver.get(self.pageLink)
+		if self.snapshotPath is not None:
+			self.saveSnapshot(driver)
+
+		# Skip scraping the tables if they are unchanged since the cached data was parsed
+		with getTracer().span('fingerprint', source=self.sourceName):
+			tableHash = getTablesHash(driver)
+		if self.useCachedIfUnchanged({'tableHash': tableHash}):
+			return None
+
+		headers = extractTableHeaders(driver)
+		checkpointDir = self.getCheckpointDir(tableHash)
+		self.printStep(1, "Found %i section Tables" % len(headers))
+
+		data = []
+		failedTables = []
+		elements = None
+		for index in range(len(headers)):
+			rows = self.readCheckpoint(checkpointDir, index) if self.resume else None
+			if rows is not None:
+				data.extend(rows)
+				self.printStep(index + 2, "Resumed Table %i from checkpoint" % (index + 1))
+				continue
+
+			for attempt in range(self.maxTableRetries + 1):
+				try:
+					if elements is None:
+						elements = driver.find_elements(By.XPATH, self.tableXPath)
+					with getTracer().span('extractTables', source=self.sourceName, table=index + 1):
+						table = extractTables(driver, elements[index])[0]
+					rows = self.readNodeTypesTable(table, index + 1)
+					break
+				except Exception as e:
+					print('Failed to scrape table %i on attempt %i: %r' % (index + 1, attempt + 1, e))
+					# Find the tables again, in case the page re-rendered them
+					elements = None
+
+			if rows is None:
+				failedTables.append(index + 1)
+				continue
+			self.writeCheckpoint(checkpointDir, index, rows)
+			data.extend(rows)
+			self.printStep(index + 2, "Parsed Table %i" % (index + 1))
+
+		if len(failedTables) > 0:
+			raise RuntimeError('Failed to scrape node type tables %s, the other tables are checkpointed in %s.' %
+			                   (', '.join(str(t) for t in failedTables), checkpointDir))
+
+		return data
+
+
+	def readNodeTypesTables(self, tables):
+		"""
+		Read the node type rows from the extracted tables.
 
-		# Parse Data From Tables
+		:param tables: The extracted tables, see tableExtraction.extractTables.
+		:return: A list of dicts of column header to value, one per node type.
+		"""
 		data = []
-		stepCount = 1
-		for table in tables:
-			tableSections = table.find_elements_by_xpath(".//tr")
-			headerElements = tableSections[0].find_elements_by_xpath(".//th") + tableSections[0].find_elements_by_xpath(
-				".//td")
-			headers = [i.get_property('innerText').strip() for i in headerElements]
+		for index, table in enumerate(tables):
+			data.extend(self.readNodeTypesTable(table, index + 1))
+			self.printStep(index + 2, "Parsed Table %i" % (index + 1))
 
-			for tableRow in tableSections[1:]:
-				rowItems = [i.get_property('innerText') for i in tableRow.find_elements_by_xpath(".//td")]
-				dataRow = {k: v for k, v in zip(headers, rowItems)}
-				data.append(dataRow)
+		return data
 
-			stepCount += 1
-			self.printStep(stepCount, "Parsed Table %i" % (stepCount - 1))
 
+	def readNodeTypesTable(self, table, tableNumber):
+		"""
+		Read the node type rows of one extracted table.
 
-		# Convert to dataframe
-		self.df = pd.DataFrame(data)
-		# Clean dataframe
-		self.df = self.cleanNodeTypesDataframe(self.df)
-		self.df = self.df.set_index(['InstanceType'])
+		:param table: The extracted table, see tableExtraction.extractTables.
+		:param tableNumber: The number of the table on the page, counting from 1.
+		:return: A list of dicts of column header to value, one per node type.
+		"""
+		with getTracer().span('table', source=self.sourceName, table=tableNumber) as span:
+			tableSections = table['rows']
+			headers = [i.strip() for i in tableSections[0]['th'] + tableSections[0]['td']]
+			data = [{k: v for k, v in zip(headers, tableRow['td'])} for tableRow in tableSections[1:]]
+			span.count(rows=len(data))
 
-		# Write data to disc
-		filename = os.path.join(self.csvDir, self.csvFile)
-		self.df.to_csv(filename)
-		print('Wrote ', filename)
+		return data
 
-		endTime = time.time()
-		print('Elapsed %.2fs' % (endTime - startTime))
 
-		return self.df
+	def getCheckpointDir(self, tableHash):
+		"""
+		Get the checkpoint directory of a page version, removing the checkpoints of any other version.
+
+		:param tableHash: The hash of every table on the page, see tableExtraction.getTablesHash. Any change to a
+		                  table, not only its headers, starts a new version so stale rows are never resumed.
+		:return: The checkpoint directory.
+		"""
+		pageVersion = tableHash[:16]
+		if os.path.isdir(self.checkpointRoot):
+			for name in os.listdir(self.checkpointRoot):
+				if name != pageVersion:
+					shutil.rmtree(os.path.join(self.checkpointRoot, name), ignore_errors=True)
+
+		checkpointDir = os.path.join(self.checkpointRoot, pageVersion)
+		os.makedirs(checkpointDir, exist_ok=True)
+
+		return checkpointDir
+
+
+	def readCheckpoint(self, checkpointDir, index):
+		"""
+		Read the checkpointed rows of a table.
+
+		:param checkpointDir: The checkpoint directory of the page version.
+		:param index: The index of the table on the page.
+		:return: The rows of the table, or None if it has not been checkpointed.
+		"""
+		try:
+			with open(os.path.join(checkpointDir, 'table-%03i.json' % index), 'r') as f:
+				return json.load(f)
+		except (OSError, ValueError):
+			return None
+
+
+	def writeCheckpoint(self, checkpointDir, index, rows):
+		"""
+		Checkpoint the parsed rows of a table.
+
+		:param checkpointDir: The checkpoint directory of the page version.
+		:param index: The index of the table on the page.
+		:param rows: The rows of the table.
+		"""
+		filename = os.path.join(checkpointDir, 'table-%03i.json' % index)
+		# Write then rename, so an interrupted scrape never leaves a partial checkpoint
+		with open(filename + '.tmp', 'w') as f:
+			json.dump(rows, f)
+		os.replace(filename + '.tmp', filename)
+
+
+	def clearCheckpoints(self):
+		"""
+		Remove every table checkpoint, once the node types have been written.
+		"""
+		shutil.rmtree(self.checkpointRoot, ignore_errors=True)
 
 	def cleanNodeTypesDataframe(self, df):
 		"""
-		Clean the dataframe by renaming duplicate columns with different names.
+		Clean the dataframe by merging the columns that hold the same data under different names.
+
+		Each kept column is filled from its synonyms in one vectorized first-non-null pass, and any column not in
+		the synonym map is reported and dropped.
 
 		:param df: The dataframe to clean.
 		:return: The cleaned dataframe.
 		"""
-		# Combine Instance Names
-		df['Instance Size'].update(df['Instance'])
-		df['Instance Size'].update(df['Instance size'])
-		df['Instance Size'].update(df['Name'])
-		df['Instance Size'].update(df['Model'])
-		df = df.drop(columns=['Instance', 'Instance size', 'Name', 'Model'])
-
-		# Combine Storage Information
-		storageItems = ['Instance Storage',
-		                'Instance Storage (GIB)',
-		                'Instance Storage (GiB)',
-		                'Storage (GB)',
-		                'Instance Storage (GB)',
-		                'Local Storage (GB)',
-		                'Instance Storage (TB)']
-		for item in storageItems:
-			df['Storage'].update(df[item])
-		df = df.drop(columns=storageItems)
-
-		# Combine network numbers
-		network = ['Network Bandwidth (Gbps)',
-		           'Network Burst Bandwidth (Gbps)',
-		           'Network Performance (Gbps)',
-		           'Networking Performance (Gbps)',
-		           'Networking Performance',
-		           'Network Perf (Gbps)',
-		           'Network bandwidth']
-		for item in network:
-			df['Network Bandwidth'].update(df[item])
-		df = df.rename(columns={'Network Bandwidth': 'Network'})
-		df = df.drop(columns=network)
-
-		# Combine EBS numbers
-		ebs = ['EBS Bandwidth (Mbps)',
-		       'EBS Burst Bandwidth (Mbps)',
-		       'Dedicated EBS Bandwidth (Mbps)',
-		       'EBS Bandwidth (Gbps)',
-		       'EBS Bandwidth (Gbps)',
-		       'Dedicated EBS Bandwidth (Gbps)',
-		       'Dedicated EBS Bandwidth',
-		       'EBS bandwidth']
-		for item in ebs:
-			df['EBS Bandwidth'].update(df[item])
-		df = df.drop(columns=ebs)
-
-		# Combine vCPUs numbers
-		vcpus = ['vCPUs',
-		         'vCPU*',
-		         'Logical Processors*']
-		for item in vcpus:
-			df['vCPU'].update(df[item])
-		df = df.drop(columns=vcpus)
-
-		# Combine credits per hour numbers
-		credits = ['CPU Credits Earned / Hr',
-		           'CPU Credits / hour']
-		for item in credits:
-			df['CPU Credits/hour'].update(df[item])
-		df = df.drop(columns=credits)
-
-		# Combine Memory numbers
-		mem = ['RAM (GiB)',
-		       'Mem(GiB)',
-		       'Memory (GiB)']
-		for item in mem:
-			df['Mem (GiB)'].update(df[item])
-		df = df.drop(columns=mem)
-
-		# Combine GPU P2P numbers
-		gpup2p = ['GPU Peer to Peer']
-		for item in gpup2p:
-			df['GPU P2P'].update(df[item])
-		df = df.drop(columns=gpup2p)
-
-		# Combine GPU Memory numbers
-		gpumem = ['GPU Memory (GiB)']
-		for item in gpumem:
-			df['GPU Mem (GiB)'].update(df[item])
-		df = df.drop(columns=gpumem)
-
-		# Fix broken EBS column
-		df['EBS Bandwidth'].update(df[df.columns[7]])
-		df = df.drop(columns=[df.columns[7]])
-
-		# Reorder Columns
-		newColumnOrder = ['Instance Size', 'vCPU', 'Mem (GiB)', 'Storage', 'GPUs', 'GPU Mem (GiB)', 'EBS Bandwidth',
-		                  'Network Performance', 'Network', 'Baseline Performance / vCPU', 'CPU Credits/hour',
-		                  'GPUDirect RDMA', 'GPU P2P', 'Inferentia chips', 'Inferentia chip-to-chip interconnect',
-		                  'FPGAs', 'Aggregate Disk Throughput (MiB/s)']
-		df = df[newColumnOrder]
+		# Find the canonical column and priority of each scraped column, by exact then normalised header
+		aliasPriority = {}
+		normalisedPriority = {}
+		for canonical, aliases in self.columnSynonyms.items():
+			for priority, alias in enumerate(aliases):
+				aliasPriority[alias] = (canonical, priority)
+				normalisedPriority.setdefault(self.normaliseColumnName(alias), (canonical, priority))
+
+		sources = {canonical: [] for canonical in self.columnSynonyms}
+		unknownColumns = []
+		for column in df.columns:
+			name = self.normaliseColumnName(column)
+			if column in aliasPriority:
+				canonical, priority = aliasPriority[column]
+			elif name in normalisedPriority:
+				canonical, priority = normalisedPriority[name]
+			else:
+				canonical = next((c for c, pattern in self.columnPatterns.items() if re.search(pattern, name)), None)
+				priority = len(self.columnSynonyms.get(canonical, []))
+			if canonical is None:
+				unknownColumns.append(column)
+			else:
+				sources[canonical].append((priority, column))
+
+		if len(unknownColumns) > 0:
+			print('Dropped unknown node type columns: %s' % ', '.join(repr(c) for c in unknownColumns))
+		self.unknownColumns = unknownColumns
+
+		# Coalesce each block of synonyms, the highest priority filled value wins
+		merged = {}
+		for canonical, columns in sources.items():
+			columns = [column for priority, column in sorted(columns, reverse=True)]
+			if len(columns) == 0:
+				merged[canonical] = pd.Series(np.nan, index=df.index, dtype=object)
+			elif len(columns) == 1:
+				merged[canonical] = df[columns[0]]
+			else:
+				merged[canonical] = df[columns].bfill(axis=1).iloc[:, 0]
+			if canonical in self.unitColumns:
+				merged[self.unitColumns[canonical]] = self.getWinningHeaderUnits(df, columns)
+		df = pd.DataFrame(merged, index=df.index)
 
 		# Convert some columns to numeric
-		def removeStar(x):
-			return str(x).replace('*', '').replace(',', '')
+		df['vCPU'] = df['vCPU'].astype(str).str.replace('*', '', regex=False).str.replace(',', '', regex=False)
 
-		df['vCPU'] = df['vCPU'].apply(removeStar)
+		return df
 
-		# Rename column for consistentcy
-		df = df.rename(columns={"Instance Size": "InstanceType"})
 
-		return df
+	def getWinningHeaderUnits(self, df, columns):
+		"""
+		Get the unit of the header each coalesced value came from, e.g. 'tb' for values under 'Instance Storage (TB)',
+		as the merged column loses its headers.
+
+		:param df: The scraped dataframe.
+		:param columns: The synonym columns being coalesced, highest priority first.
+		:return: A series of the header unit of each row in lower case, None where the header has no unit or every
+		         synonym is empty.
+		"""
+		if len(columns) == 0:
+			return pd.Series(None, index=df.index, dtype=object)
+		filled = df[columns].notna().to_numpy()
+		units = np.asarray([getHeaderUnit(column) for column in columns], dtype=object)[filled.argmax(axis=1)]
+
+		return pd.Series(np.where(filled.any(axis=1), units, None), index=df.index, dtype=object)
+
+
+	def normaliseColumnName(self, name):
+		"""
+		Normalise a column header for matching, ignoring case and whitespace differences.
+
+		:param name: The column header.
+		:return: The normalised header.
+		"""
+		return ' '.join(str(name).split()).lower()
 
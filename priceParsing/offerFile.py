@@ -0,0 +1,89 @@
+from priceParsing.instrumentation import getTracer
+
+
+
+# The product attributes kept from the offer file, mapped to their on-demand column names
+OFFER_COLUMNS = {'instanceType': 'InstanceType',
+                 'vcpu': 'vCPU',
+                 'ecu': 'ECU',
+                 'memory': 'Memory',
+                 'storage': 'Instance Storage',
+                 'networkPerformance': 'Network Performance'}
+# The product families of instance types, metal sizes are listed under their own family
+COMPUTE_INSTANCE_FAMILIES = ('Compute Instance', 'Compute Instance (bare metal)')
+
+
+
+
+def iterOfferProducts(f, regionId, attributeFilters, productFamilies=COMPUTE_INSTANCE_FAMILIES):
+	"""
+	Stream the products of an offer file, yielding those matching the region and every attribute filter.
+
+	:param f: The offer file, opened in binary mode.
+	:param regionId: The region Id name, matched against the regionCode attribute.
+	:param attributeFilters: A dict of product attribute to its required value, e.g. {'tenancy': 'Shared'}.
+	:param productFamilies: The product families to keep.
+	:return: A generator of (sku, product attributes).
+	"""
+	import ijson
+
+	for sku, product in ijson.kvitems(f, 'products'):
+		attributes = product.get('attributes', {})
+		if product.get('productFamily') not in productFamilies or attributes.get('regionCode') != regionId:
+			continue
+		if all(attributes.get(key) == value for key, value in attributeFilters.items()):
+			yield sku, attributes
+
+
+def iterOnDemandPrices(f, skus):
+	"""
+	Stream the on-demand terms of an offer file, yielding the hourly USD price of each wanted sku.
+
+	:param f: The offer file, opened in binary mode.
+	:param skus: The set of skus to keep.
+	:return: A generator of (sku, price).
+	"""
+	import ijson
+
+	for sku, offers in ijson.kvitems(f, 'terms.OnDemand'):
+		if sku not in skus:
+			continue
+		for offer in offers.values():
+			for dimension in offer.get('priceDimensions', {}).values():
+				if dimension.get('unit') == 'Hrs' and 'USD' in dimension.get('pricePerUnit', {}):
+					yield sku, float(dimension['pricePerUnit']['USD'])
+
+
+def readOfferPrices(offerFile, regionId, attributeFilters):
+	"""
+	Read the on-demand hourly prices of a region from a local copy of an AWS offer file, such as the multi
+	gigabyte EC2 offer file, in bounded memory.
+
+	The file is streamed twice with ijson, once for the matching products and once for their on-demand terms, so
+	only the matching products are held in memory.
+
+	:param offerFile: The offer file path.
+	:param regionId: The region Id name, e.g. 'ap-southeast-2'.
+	:param attributeFilters: A dict of product attribute to its required value, e.g. {'operatingSystem': 'Linux'}.
+	:return: A list of dicts of on-demand column to value, with the hourly price as 'Price' and the sku as 'Sku', one
+	         per matching product.
+	"""
+	with open(offerFile, 'rb') as f:
+		with getTracer().span('offerProducts', file=offerFile) as span:
+			products = {sku: attributes for sku, attributes in iterOfferProducts(f, regionId, attributeFilters)}
+			span.count(rows=len(products), bytes=f.tell())
+
+		f.seek(0)
+		with getTracer().span('offerTerms', file=offerFile) as span:
+			prices = dict(iterOnDemandPrices(f, set(products)))
+			span.count(rows=len(prices), bytes=f.tell())
+
+	rows = []
+	for sku, attributes in products.items():
+		if sku in prices:
+			row = {column: attributes.get(key) for key, column in OFFER_COLUMNS.items()}
+			row['Price'] = prices[sku]
+			row['Sku'] = sku
+			rows.append(row)
+
+	return rows
@@ -1,13 +1,10 @@
-import os
-import time
 import pandas as pd
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
 
 from priceParsing.baseParser import BaseParser
+from priceParsing.driverPool import getDefaultPool
+from priceParsing.instrumentation import getTracer
+from priceParsing.offerFile import readOfferPrices
+from priceParsing.tableExtraction import extractTables, getTablesHash, parsePriceColumn
 
 
 
@@ -15,23 +12,51 @@ class OnDemand(BaseParser):
 	"""
 	Parsers current on-demand prices, or reads existing on-demand prices from csv file.
 	"""
-	def __init__(self, csvDir='csvFiles', regionId='ap-southeast-2', loadCsv=False):
+	sourceName = 'onDemandPrices'
+	# The offer file product attributes of the prices shown on the webpage, narrowing each instance type to one sku
+	offerFilters = {'operatingSystem': 'Linux', 'tenancy': 'Shared', 'capacitystatus': 'Used', 'preInstalledSw': 'NA',
+	                'licenseModel': 'No License required', 'operation': 'RunInstances'}
+
+	def __init__(self, csvDir='csvFiles', regionId='ap-southeast-2', loadCsv=False, driverPool=None, htmlSource=None,
+	             snapshotPath=None, storageFormat='csv', memoryMap=False, maxStaleness=None, offerFile=None,
+	             skipUnchanged=True):
 		"""
 		:param csvDir: The directory to read/write csv to/from.
 		:param regionId: The region Id name, e.g. 'ap-southeast-2'.
 		:param loadCsv: True if to load existing data from csv file.
+		:param driverPool: The browser driver pool to scrape with, or None for the shared default pool.
+		:param htmlSource: A saved snapshot of the rendered page, as a file path or url, to parse without a browser.
+		:param snapshotPath: A file path to save a snapshot of the rendered page to when scraping with a browser.
+		:param storageFormat: The on-disk format, one of 'csv', 'parquet', 'feather' or 'arrow'.
+		:param memoryMap: True to memory map the data file when reading.
+		:param maxStaleness: If given, load from disk when the cached data is at most this many seconds old and came
+		                     from the same source, otherwise fetch it. Overrides loadCsv.
+		:param offerFile: A local copy of the AWS EC2 offer file, to stream exact prices from without a browser.
+		                  Requires ijson.
+		:param skipUnchanged: True to fingerprint the page tables first, keeping the cached data without extracting,
+		                      cleaning or writing when they are unchanged since it was parsed.
 		"""
 		csvFile = 'aws-on-demand-prices-' + regionId + '.csv'
-		super().__init__(csvDir=csvDir, csvFile=csvFile)
+		super().__init__(csvDir=csvDir, csvFile=csvFile, storageFormat=storageFormat, memoryMap=memoryMap)
 		self.csvDir = csvDir
-		self.csvFile = csvFile
 		self.regionId = regionId
-		self.loadCsv = loadCsv
+		self.driverPool = driverPool if driverPool is not None else getDefaultPool()
+		self.htmlSource = htmlSource
+		self.snapshotPath = snapshotPath
+		self.offerFile = offerFile
+		self.skipUnchanged = skipUnchanged
+		self.tableXPath = "(//li[contains(@class, 'lb-tabs-content-item lb-active')]//div[@data-region='%s']//table)[1]" % regionId
 		self.pageLink = 'https://aws.amazon.com/ec2/pricing/on-demand/'
-		self.stepCount = 11
+		self.stepCount = 12
+
+		if offerFile is None:
+			self.sourceInfo = dict({'pageLink': self.pageLink, 'regionId': regionId}, **self.getHtmlSourceInfo())
+		else:
+			self.sourceInfo = {'offerFile': offerFile, 'regionId': regionId}
 
 		self.df = None
 
+		self.loadCsv = self.useCache(loadCsv, maxStaleness)
 		if not self.loadCsv:
 			self.parseOnDemandPrices()
 		else:
@@ -49,18 +74,75 @@ class OnDemand(BaseParser):
 
 	def parseOnDemandPrices(self):
 		"""
-		Parse the on-demand prices using the webpage.
+		Parse the on-demand prices using the webpage, or the offer file if one was given.
 
 		:return: A dataframe of the current defined on-demand prices.
 		"""
-		startTime = time.time()
-		# Create web page driver
-		options = Options()
-		options.headless = True
-		options.add_argument("--window-size=1920,1200")
+		with getTracer().span('parse', source=self.sourceName):
+			if self.offerFile is not None:
+				# Stream the prices from the offer file
+				self.df = self.readOfferFile()
+			else:
+				if self.htmlSource is not None:
+					# Parse a saved snapshot of the page
+					tables = self.readHtmlSourceTables()
+				else:
+					# Scrape the tables using a pooled web page driver
+					with self.driverPool.session() as driver:
+						tables = self.scrapeOnDemandTables(driver)
+				if tables is None:
+					# The page is unchanged, the cached data was loaded instead
+					return self.df
+
+				# Convert to dataframe
+				self.df = self.readOnDemandTables(tables)
+
+			# Write data to disc
+			self.writeToDisk()
+
+		return self.df
+
+
+	def readOfferFile(self):
+		"""
+		Read the on-demand prices of the region from the offer file.
 
-		driver = webdriver.Chrome(options=options)
-		driver.get(self.pageLink)
+		:return: A dataframe of the on-demand prices, with the same columns as the webpage where the offer file has them.
+		"""
+		rows = readOfferPrices(self.offerFile, self.regionId, self.offerFilters)
+		print('Read %i on-demand prices from offer file %s' % (len(rows), self.offerFile))
+
+		df = pd.DataFrame(rows, columns=['InstanceType', 'vCPU', 'ECU', 'Memory', 'Instance Storage',
+		                                 'Network Performance', 'Price', 'Sku'])
+		df = df.rename(columns={'Price': 'Linux/UNIX Usage'})
+		df['vCPU'] = pd.to_numeric(df['vCPU'])
+
+		# The filters leave one sku per instance type, any left over are reported and the lowest sku kept so the
+		# choice does not depend on the order of the offer file
+		df = df.sort_values(['InstanceType', 'Sku'], kind='stable')
+		duplicated = df['InstanceType'][df['InstanceType'].duplicated()].unique()
+		if len(duplicated) > 0:
+			print('The offer file lists %i instance types under more than one sku, keeping the lowest sku: %s' %
+			      (len(duplicated), ', '.join(duplicated[:10])))
+		df = df.drop_duplicates(subset='InstanceType').drop(columns='Sku').set_index(['InstanceType'])
+
+		return df
+
+
+	def scrapeOnDemandTables(self, driver):
+		"""
+		Load the webpage and scrape the on-demand tables.
+
+		:param driver: The selenium web driver to use.
+		:return: The extracted tables, see tableExtraction.extractTables, or None if the table is unchanged and the
+		         cached data was loaded instead.
+		"""
+		from selenium.webdriver.common.by import By
+		from selenium.webdriver.support.ui import WebDriverWait
+		from selenium.webdriver.support import expected_conditions as EC
+
+		with getTracer().span('pageLoad', source=self.sourceName):
+			driver.get(self.pageLink)
 
 		# Click Linux Button
 		typeButton = WebDriverWait(driver, 5).until(
@@ -69,7 +151,7 @@ class OnDemand(BaseParser):
 		self.printStep(1, "Found OS Selection Button")
 
 		# Get section with only one of these buttons
-		singleSection = driver.find_element_by_xpath(".//li[contains(@class, 'lb-tabs-content-item lb-active')]")
+		singleSection = driver.find_element(By.XPATH, ".//li[contains(@class, 'lb-tabs-content-item lb-active')]")
 		self.printStep(2, "Found Selection Selector")
 
 		# Select Region
@@ -77,7 +159,7 @@ class OnDemand(BaseParser):
 		WebDriverWait(singleSection, 10).until(
 			EC.presence_of_element_located((By.XPATH, ".//ul[contains(@class, 'button lb-dropdown-label')]"))).click()
 		# Click region
-		singleSection.find_element_by_xpath(".//li[@data-region='ap-southeast-2']").click()
+		singleSection.find_element(By.XPATH, ".//li[@data-region='%s']" % self.regionId).click()
 		self.printStep(3, "Selected Region Dropdown")
 
 		# Get Tables
@@ -85,47 +167,49 @@ class OnDemand(BaseParser):
 			EC.presence_of_element_located((By.XPATH, ".//div[@data-region='%s']" % self.regionId)))
 		table = WebDriverWait(dataRegion, 10).until(EC.presence_of_element_located((By.XPATH, ".//table")))
 		self.printStep(4, "Found section Tables")
+		if self.snapshotPath is not None:
+			self.saveSnapshot(driver)
 
-		# Parse Data From Tables
-		data = []
-		headers = [item.text for item in table.find_element_by_xpath(".//thead").find_elements_by_xpath(".//th")]
-		headers[0] = 'InstanceType'
-		stepCount = 4
-		subTables = table.find_elements_by_xpath(".//tbody")
-
-		for subTable in subTables:
-			rows = subTable.find_elements_by_xpath(".//tr")
-			for row in rows[1:]:
-				# Parse columns
-				cols = row.find_elements_by_xpath(".//td")
-				nodeType = cols[0].text
-				vCPU = int(cols[1].text)
-				ecu = cols[2].text
-				memory = cols[3].text
-				storage = cols[4].text
-				perHour = float(cols[5].text.replace("$", "").replace(" per Hour", ""))
-
-				# Store data
-				rowData = [nodeType, vCPU, ecu, memory, storage, perHour]
-				data.append(rowData)
+		# Skip extracting the table if it is unchanged since the cached data was parsed
+		with getTracer().span('fingerprint', source=self.sourceName):
+			tableHash = getTablesHash(driver, table)
+		if self.useCachedIfUnchanged({'tableHash': tableHash}):
+			return None
 
-			stepCount += 1
-			self.printStep(stepCount, "Parsed Table %i" % (stepCount - 4))
+		# Pull the whole table in one call
+		with getTracer().span('extractTables', source=self.sourceName):
+			tables = extractTables(driver, table)
+		self.printStep(5, "Extracted section Tables")
 
-		# Convert to dataframe
-		self.df = pd.DataFrame(data, columns=headers)
-		self.df = self.df.set_index(['InstanceType'])
-		self.df['Linux/UNIX Usage'] = self.df['Linux/UNIX Usage'].astype(float)
+		return tables
 
-		# Write data to disc
-		filename = os.path.join(self.csvDir, self.csvFile)
-		self.df.to_csv(filename)
-		print('Wrote ', filename)
 
-		endTime = time.time()
-		print('Elapsed %.2fs' % (endTime - startTime))
+	def readOnDemandTables(self, tables):
+		"""
+		Read the on-demand prices from the extracted tables.
 
-		return self.df
+		:param tables: The extracted tables, see tableExtraction.extractTables.
+		:return: A dataframe of the on-demand prices.
+		"""
+		table = tables[0]
+		headers = [cell.strip() for row in table['thead'] for cell in row['th']]
+		headers[0] = 'InstanceType'
 
+		data = []
+		stepCount = 5
+		for subTable in table['tbodies']:
+			with getTracer().span('table', source=self.sourceName, table=stepCount - 4) as span:
+				for row in subTable[1:]:
+					# Store data
+					data.append([cell.strip() for cell in row['td'][:len(headers)]])
+				span.count(rows=len(subTable) - 1)
+
+			stepCount += 1
+			self.printStep(stepCount, "Parsed Table %i" % (stepCount - 5))
 
+		df = pd.DataFrame(data, columns=headers)
+		df[headers[1]] = pd.to_numeric(df[headers[1]])
+		df['Linux/UNIX Usage'] = parsePriceColumn(df['Linux/UNIX Usage'])
+		df = df.set_index(['InstanceType'])
 
+		return df
@@ -0,0 +1,134 @@
+import numpy as np
+import pandas as pd
+
+
+
+
+class PriceQueryEngine:
+	"""
+	Answers "cheapest instance that fits" queries over a combined price dataframe.
+
+	Derived metrics are computed once, and every numeric column gets a sorted index, so each constraint becomes a
+	binary search. A query starts from its most selective constraint, filters the remaining candidates with
+	vectorized masks, and partially sorts the survivors by the objective to return the top k.
+	"""
+	def __init__(self, df):
+		"""
+		:param df: A combined price dataframe, e.g. from AllPrices.getDataframe().
+		"""
+		self.df = self.addDerivedMetrics(df)
+
+		# Sorted index per numeric column, NaN values are sorted to the end and excluded
+		self.values = {}
+		self.sortedOrder = {}
+		self.sortedValues = {}
+		self.validCount = {}
+		for column in self.df.columns:
+			if not pd.api.types.is_numeric_dtype(self.df[column]):
+				continue
+			values = self.df[column].to_numpy(dtype=np.float64)
+			order = np.argsort(values, kind='stable')
+			self.values[column] = values
+			self.sortedOrder[column] = order
+			self.sortedValues[column] = values[order]
+			self.validCount[column] = int(np.count_nonzero(~np.isnan(values)))
+
+
+	@staticmethod
+	def addDerivedMetrics(df):
+		"""
+		Add price per vCPU hour, price per GiB hour and spot savings columns.
+
+		:param df: A combined price dataframe.
+		:return: A copy of the dataframe with the derived metric columns.
+		"""
+		df = df.copy()
+		vCPU = df['vCPU'].where(df['vCPU'] > 0)
+		mem = df['Mem (GiB)'].where(df['Mem (GiB)'] > 0)
+		df['On-Demand $/vCPU-hr'] = df['On-Demand'] / vCPU
+		df['Spot $/vCPU-hr'] = df['SpotPrice'] / vCPU
+		df['On-Demand $/GiB-hr'] = df['On-Demand'] / mem
+		df['Spot $/GiB-hr'] = df['SpotPrice'] / mem
+		df['SpotSavings%'] = 100.0 - df['SpotProp%']
+
+		return df
+
+
+	def getRange(self, column, minimum=None, maximum=None):
+		"""
+		Find the rows with minimum <= value <= maximum using a binary search of the sorted column.
+
+		:param column: The column name.
+		:param minimum: The inclusive lower bound, or None for no lower bound.
+		:param maximum: The inclusive upper bound, or None for no upper bound.
+		:return: The start and end of the matching slice of the column's sorted order.
+		"""
+		if column not in self.sortedValues:
+			raise KeyError('Column %r is not a numeric column of the price dataframe.' % column)
+
+		sortedValues = self.sortedValues[column][:self.validCount[column]]
+		start = 0 if minimum is None else int(np.searchsorted(sortedValues, minimum, side='left'))
+		end = len(sortedValues) if maximum is None else int(np.searchsorted(sortedValues, maximum, side='right'))
+
+		return start, max(start, end)
+
+
+	def query(self, minimums=None, maximums=None, gpu=None, objective='SpotPrice', k=10, ascending=True):
+		"""
+		Find the best k instances meeting every constraint.
+
+		:param minimums: A dict of column to inclusive minimum, e.g. {'vCPU': 16, 'Mem (GiB)': 64}.
+		:param maximums: A dict of column to inclusive maximum, e.g. {'SpotPrice': 1.0}.
+		:param gpu: True to only return instances with GPUs, False for instances without, None for either.
+		:param objective: The column to rank by, e.g. 'SpotPrice' or 'Spot $/vCPU-hr'.
+		:param k: The number of instances to return, at least 1.
+		:param ascending: True to return the lowest objective values first.
+		:return: A dataframe of at most k instances, ordered by the objective.
+		"""
+		if k < 1:
+			raise ValueError('k must be at least 1, got %r.' % k)
+		if objective not in self.values:
+			raise KeyError('Column %r is not a numeric column of the price dataframe.' % objective)
+
+		ranges = {}
+		for column in set(minimums or {}) | set(maximums or {}):
+			ranges[column] = self.getRange(column, (minimums or {}).get(column), (maximums or {}).get(column))
+		if gpu is True:
+			ranges['GPUs'] = self.getRange('GPUs', max(1, (minimums or {}).get('GPUs', 1)), (maximums or {}).get('GPUs'))
+
+		# Start from the most selective constraint
+		if len(ranges) > 0:
+			column = min(ranges, key=lambda c: ranges[c][1] - ranges[c][0])
+			start, end = ranges.pop(column)
+			candidates = self.sortedOrder[column][start:end]
+		else:
+			candidates = np.arange(self.df.shape[0])
+
+		# Filter by the remaining constraints
+		for column in ranges:
+			values = self.values[column][candidates]
+			mask = ~np.isnan(values)
+			if minimums is not None and column in minimums:
+				mask &= values >= minimums[column]
+			if maximums is not None and column in maximums:
+				mask &= values <= maximums[column]
+			if column == 'GPUs' and gpu is True:
+				mask &= values >= 1
+			candidates = candidates[mask]
+		if gpu is False:
+			gpus = self.values['GPUs'][candidates]
+			candidates = candidates[np.isnan(gpus) | (gpus == 0)]
+
+		# Rank the candidates by the objective, only fully sorting the top k
+		scores = self.values[objective][candidates]
+		valid = ~np.isnan(scores)
+		candidates = candidates[valid]
+		scores = scores[valid] if ascending else -scores[valid]
+		k = min(k, len(candidates))
+		if 0 < k < len(candidates):
+			top = np.argpartition(scores, k - 1)[:k]
+			candidates = candidates[top]
+			scores = scores[top]
+		candidates = candidates[np.argsort(scores, kind='stable')]
+
+		return self.df.iloc[candidates]
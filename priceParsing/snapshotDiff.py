@@ -0,0 +1,140 @@
+import json
+import math
+import time
+import numpy as np
+import pandas as pd
+
+
+
+
+class SnapshotDiff:
+	"""
+	The instance types added and removed, and the prices that moved, between two snapshots of a combined dataframe.
+
+	Rows are matched on their full index, so an instance type moving to another group shows as removed and added.
+	Matched rows are first compared by a hash of their prices, and only the rows whose hash changed are compared
+	column by column.
+	"""
+	def __init__(self, previous, current, priceColumns, threshold=1.0):
+		"""
+		:param previous: The previous snapshot.
+		:param current: The current snapshot.
+		:param priceColumns: The columns to report changes of, e.g. ['SpotPrice', 'On-Demand'].
+		:param threshold: The smallest change to report, as a percentage of the previous price.
+		"""
+		self.threshold = threshold
+		self.rows = current.shape[0]
+
+		previousKeys = getKeyIndex(previous.index)
+		currentKeys = getKeyIndex(current.index)
+		positions = previousKeys.get_indexer(currentKeys)
+		matched = positions >= 0
+		self.added = list(currentKeys[~matched])
+		self.removed = list(previousKeys[currentKeys.get_indexer(previousKeys) < 0])
+
+		# Aligned price arrays of the rows in both snapshots
+		columns = [column for column in priceColumns if column in previous.columns and column in current.columns]
+		previousValues = previous[columns].to_numpy(dtype=float)[positions[matched]]
+		currentValues = current[columns].to_numpy(dtype=float)[matched]
+		previousHashes = pd.util.hash_pandas_object(pd.DataFrame(previousValues), index=False).to_numpy()
+		currentHashes = pd.util.hash_pandas_object(pd.DataFrame(currentValues), index=False).to_numpy()
+		hashChanged = np.flatnonzero(previousHashes != currentHashes)
+
+		old = previousValues[hashChanged]
+		new = currentValues[hashChanged]
+		with np.errstate(divide='ignore', invalid='ignore'):
+			changePercent = 100.0 * (new - old) / np.abs(old)
+		# A price appearing or disappearing is always a change, NaN percentages never pass the threshold
+		isChange = (np.isnan(old) != np.isnan(new)) | (np.abs(changePercent) >= threshold)
+		rows, columnPositions = np.nonzero(isChange)
+
+		self.changes = pd.DataFrame({'key': list(currentKeys[matched][hashChanged[rows]]),
+		                             'column': np.asarray(columns, dtype=object)[columnPositions],
+		                             'old': old[rows, columnPositions],
+		                             'new': new[rows, columnPositions],
+		                             'change%': changePercent[rows, columnPositions]})
+
+
+	def isEmpty(self):
+		"""
+		Check if nothing was added, removed or changed.
+
+		:return: True if the snapshots match.
+		"""
+		return len(self.added) == 0 and len(self.removed) == 0 and self.changes.shape[0] == 0
+
+
+	def toRecord(self, createdAt=None):
+		"""
+		Convert the diff to one json serialisable changelog record.
+
+		:param createdAt: The unix time of the current snapshot, or None for now.
+		:return: A dict of the diff.
+		"""
+		return {'createdAt': time.time() if createdAt is None else createdAt,
+		        'rows': self.rows,
+		        'threshold': self.threshold,
+		        'added': [toJsonKey(key) for key in self.added],
+		        'removed': [toJsonKey(key) for key in self.removed],
+		        'changes': [{'key': toJsonKey(key), 'column': column, 'old': toJsonNumber(old),
+		                     'new': toJsonNumber(new), 'change%': toJsonNumber(changePercent)}
+		                    for key, column, old, new, changePercent in self.changes.itertuples(index=False)]}
+
+
+	def appendTo(self, filename):
+		"""
+		Append the diff to a json lines changelog, skipping empty diffs.
+
+		:param filename: The changelog file.
+		"""
+		if self.isEmpty():
+			return
+		with open(filename, 'a') as f:
+			f.write(json.dumps(self.toRecord(), separators=(',', ':')) + '\n')
+
+
+
+
+def getKeyIndex(index):
+	"""
+	Get the row keys of a snapshot as plain object levels, so snapshots read from disk match categorical ones.
+
+	:param index: The snapshot's index.
+	:return: A MultiIndex of the keys.
+	"""
+	return pd.MultiIndex.from_arrays([np.asarray(index.get_level_values(i), dtype=object) for i in range(index.nlevels)],
+	                                 names=index.names)
+
+
+def toJsonKey(key):
+	"""
+	Convert a dataframe index key to a json list, as json has no NaN.
+
+	:param key: The index key, a tuple of the index level values.
+	:return: A list of the level values, with NaN values as None.
+	"""
+	return [None if isinstance(value, float) and math.isnan(value) else value for value in key]
+
+
+def toJsonNumber(value):
+	"""
+	Convert a price or change to a json number.
+
+	:param value: The numeric value.
+	:return: The value as a float, or None if it is NaN or infinite.
+	"""
+	return float(value) if math.isfinite(value) else None
+
+
+def readChangelog(filename, since=None):
+	"""
+	Read a snapshot changelog.
+
+	:param filename: The changelog file.
+	:param since: Only return records created after this unix time, or None for every record.
+	:return: A list of changelog records, oldest first.
+	"""
+	with open(filename, 'r') as f:
+		records = [json.loads(line) for line in f if line.strip()]
+
+	return [record for record in records if since is None or record['createdAt'] > since]
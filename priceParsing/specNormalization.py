@@ -0,0 +1,154 @@
+import re
+import numpy as np
+import pandas as pd
+
+
+
+
+# An optional 'N x' count followed by a size and unit, e.g. '2 x 900 NVMe SSD', '1 x 1.9 TB', '4x 100 Gigabit'
+COUNT_SIZE_PATTERN = re.compile(r'(?:(?P<count>\d+)\s*x\s*)?(?P<size>\d[\d,]*(?:\.\d+)?)\s*(?P<unit>TB|GB|GiB|Gigabit|Gbps|Megabit|Mbps)?',
+                                re.IGNORECASE)
+STORAGE_MEDIUM_PATTERN = re.compile(r'(?P<medium>NVMe SSD|SSD|HDD|EBS)', re.IGNORECASE)
+# The unit some headers give their values in, e.g. 'Instance Storage (TB)' or 'EBS Bandwidth (Gbps)'
+HEADER_UNIT_PATTERN = re.compile(r'\((?P<unit>TB|GB|GiB|Gbps|Mbps)\)', re.IGNORECASE)
+BURST_PATTERN = r'(?i)up\s+to'
+
+# The kept medium names, keyed by their lower case match
+STORAGE_MEDIUMS = {'nvme ssd': 'NVMe SSD', 'ssd': 'SSD', 'hdd': 'HDD', 'ebs': 'EBS'}
+# GB per GiB, as storage is normalised to decimal GB
+GB_PER_GIB = 2 ** 30 / 1e9
+
+
+
+
+def extractCountSize(series):
+	"""
+	Extract the first 'N x size unit' quantity from each string, as count * size.
+
+	:param series: A series of strings.
+	:return: A float series of the total quantities, and a series of the matched units in lower case.
+	"""
+	parts = series.astype(str).str.extract(COUNT_SIZE_PATTERN)
+	count = pd.to_numeric(parts['count'], errors='coerce').fillna(1.0)
+	size = pd.to_numeric(parts['size'].str.replace(',', '', regex=False), errors='coerce')
+
+	return count * size, parts['unit'].str.lower()
+
+
+def getHeaderUnit(header):
+	"""
+	Get the unit a column header gives its values in, e.g. 'tb' for 'Instance Storage (TB)'.
+
+	:param header: The column header.
+	:return: The unit in lower case, or None if the header has no unit.
+	"""
+	match = HEADER_UNIT_PATTERN.search(str(header))
+
+	return None if match is None else match.group('unit').lower()
+
+
+def normalizeStorage(series, headerUnit=None):
+	"""
+	Convert instance storage strings such as '2 x 900 NVMe SSD' or 'EBS-Only' to total decimal GB and the storage
+	medium. TB and GiB sizes are converted, sizes without a unit are read in their header's unit, or GB.
+
+	:param series: A series of storage strings.
+	:param headerUnit: A series of the unit of each value's column header in lower case, see getHeaderUnit, or None.
+	:return: A float series of the total instance storage in GB, and a series of the storage medium.
+	"""
+	total, unit = extractCountSize(series)
+	if headerUnit is not None:
+		unit = unit.fillna(headerUnit)
+	total = total.where(unit != 'tb', total * 1000.0)
+	total = total.where(unit != 'gib', total * GB_PER_GIB)
+
+	medium = series.astype(str).str.extract(STORAGE_MEDIUM_PATTERN)['medium'].str.lower().map(STORAGE_MEDIUMS)
+	# EBS only instances have no instance storage
+	total = total.where(medium != 'EBS', 0.0)
+
+	return total, medium
+
+
+def normalizeBandwidth(series, toBaseUnit, headerUnit=None):
+	"""
+	Convert bandwidth strings such as 'Up to 4,750', '25 Gigabit' or '10' to baseline and burst numbers.
+
+	Values given as 'Up to X' only have a burst bandwidth, other values are both the baseline and the burst.
+
+	:param series: A series of bandwidth strings.
+	:param toBaseUnit: A function of (values, units) converting the extracted values to the wanted unit.
+	:param headerUnit: A series of the unit of each value's column header in lower case, used for values without
+	                   a unit, or None.
+	:return: A float series of the baseline bandwidth, and a float series of the burst bandwidth.
+	"""
+	values, unit = extractCountSize(series)
+	if headerUnit is not None:
+		unit = unit.fillna(headerUnit)
+	burst = toBaseUnit(values, unit)
+	isBurstOnly = series.astype(str).str.contains(BURST_PATTERN, regex=True)
+	baseline = burst.where(~isBurstOnly, np.nan)
+
+	return baseline, burst
+
+
+def ebsToMbps(values, unit):
+	"""
+	Convert EBS bandwidth values to Mbps, reading values without a unit as Mbps.
+
+	:param values: A float series of values.
+	:param unit: A series of the matched units in lower case.
+	:return: A float series in Mbps.
+	"""
+	inGbps = unit.isin(['gbps', 'gigabit'])
+
+	return values.where(~inGbps, values * 1000.0)
+
+
+def networkToGbps(values, unit):
+	"""
+	Convert network bandwidth values to Gbps.
+
+	:param values: A float series of values.
+	:param unit: A series of the matched units in lower case.
+	:return: A float series in Gbps.
+	"""
+	inMbps = unit.isin(['mbps', 'megabit'])
+
+	return values.where(~inMbps, values / 1000.0)
+
+
+def toFloat(series):
+	"""
+	Convert numeric strings such as '1,024' or '96*' to floats.
+
+	:param series: A series of numeric strings.
+	:return: A float series, with NaN where no number could be read.
+	"""
+	return pd.to_numeric(series.astype(str).str.replace(r'[*,\s]', '', regex=True), errors='coerce')
+
+
+def normalizeNodeTypeSpecs(df):
+	"""
+	Add typed numeric versions of the node type spec columns, so they can be filtered and sorted numerically.
+
+	vCPU, Mem (GiB), GPUs and GPU Mem (GiB) are converted to floats in place, and the Storage, EBS Bandwidth and
+	Network strings gain 'Storage (GB)', 'Storage Medium', 'EBS Baseline (Mbps)', 'EBS Burst (Mbps)',
+	'Network Baseline (Gbps)' and 'Network Burst (Gbps)' columns. Values without a unit are read in the unit of
+	their header, kept by cleaning in the 'Storage Unit' and 'EBS Bandwidth Unit' columns when there are any.
+
+	:param df: The cleaned node types dataframe.
+	:return: The dataframe with typed spec columns.
+	"""
+	df = df.copy()
+	df['vCPU'] = toFloat(df['vCPU'])
+	df['Mem (GiB)'] = toFloat(df['Mem (GiB)'])
+	df['GPUs'] = toFloat(df['GPUs'])
+	df['GPU Mem (GiB)'], _ = extractCountSize(df['GPU Mem (GiB)'])
+
+	df['Storage (GB)'], df['Storage Medium'] = normalizeStorage(df['Storage'], df.get('Storage Unit'))
+	df['EBS Baseline (Mbps)'], df['EBS Burst (Mbps)'] = normalizeBandwidth(df['EBS Bandwidth'], ebsToMbps,
+	                                                                       df.get('EBS Bandwidth Unit'))
+	network = df['Network'].where(df['Network'].notna(), df['Network Performance'])
+	df['Network Baseline (Gbps)'], df['Network Burst (Gbps)'] = normalizeBandwidth(network, networkToGbps)
+
+	return df
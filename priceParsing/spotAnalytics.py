@@ -0,0 +1,131 @@
+import numpy as np
+import pandas as pd
+
+
+
+NANOSECONDS_PER_DAY = pd.Timedelta(days=1).value
+
+
+
+
+def computeSpotStatistics(history, onDemand=None, thresholds=(50,), window=None, rollingWindow='7D', endTime=None,
+                          productDescription='Linux/UNIX'):
+	"""
+	Compute how stable the spot price of each instance type was over its history, grouped by availability zone too
+	when the history has an AvailabilityZone column.
+
+	Each record holds its price until the next record of the same instance type, or until endTime for the newest, so
+	the means and the time above each threshold are weighted by how long each price was held. The work is done with
+	NumPy over the sorted history, so millions of records take seconds.
+
+	:param history: A spot price history dataframe indexed by InstanceType, with Timestamp and SpotPrice columns,
+	                e.g. from SpotPriceHistory.getHistory.
+	:param onDemand: A series of on-demand prices indexed by InstanceType, needed for the threshold columns.
+	:param thresholds: Percentages of the on-demand price, adding a SpotAbove<X>% column for each with the percentage
+	                   of time the spot price was above it.
+	:param window: Only use the history within this long before endTime, e.g. '30D', or None for all of it.
+	:param rollingWindow: The trailing window of SpotRollingMean, e.g. '7D'.
+	:param endTime: The time the statistics are taken at, or None for now.
+	:param productDescription: Only use records of this product description, if the history has the column.
+	:return: A dataframe of statistics indexed by InstanceType, or (AvailabilityZone, InstanceType).
+	"""
+	if productDescription is not None and 'ProductDescription' in history.columns:
+		history = history[history['ProductDescription'] == productDescription]
+
+	# Number each group and sort the records by group then time
+	keyNames = (['AvailabilityZone'] if 'AvailabilityZone' in history.columns else []) + ['InstanceType']
+	keyArrays = [history[name].to_numpy() for name in keyNames[:-1]] + [history.index.to_numpy()]
+	codes, groups = pd.MultiIndex.from_arrays(keyArrays, names=keyNames).factorize()
+	groups = groups.set_names(keyNames)
+	groupCount = len(groups)
+	times = pd.to_datetime(history['Timestamp'], utc=True).dt.tz_convert(None)
+	times = times.to_numpy(dtype='datetime64[ns]').view(np.int64)
+	prices = history['SpotPrice'].to_numpy(dtype=float)
+	order = np.lexsort((times, codes))
+	codes, times, prices = codes[order], times[order], prices[order]
+
+	endTime = toNanoseconds(pd.Timestamp.now(tz='UTC') if endTime is None else endTime)
+	windowStart = times.min(initial=endTime) if window is None else endTime - pd.Timedelta(window).value
+	rollingStart = max(windowStart, endTime - pd.Timedelta(rollingWindow).value)
+
+	# Each price is held until the next record of its group
+	sameAsPrevious = np.zeros(len(codes), dtype=bool)
+	sameAsPrevious[1:] = codes[1:] == codes[:-1]
+	stops = np.full(len(times), endTime, dtype=np.int64)
+	stops[:-1] = np.where(sameAsPrevious[1:], np.minimum(times[1:], endTime), endTime)
+
+	means, durations, held = getWeightedMeans(codes, groupCount, prices, times, stops, windowStart, endTime)
+	rollingMeans = getWeightedMeans(codes, groupCount, prices, times, stops, rollingStart, endTime)[0]
+
+	stats = pd.DataFrame({'SpotPrice': prices[held], 'Timestamp': times[held]}).groupby(codes[held]).agg(
+		SpotMin=('SpotPrice', 'min'), SpotMax=('SpotPrice', 'max'), SpotStd=('SpotPrice', 'std'),
+		FirstTime=('Timestamp', 'min')).reindex(range(groupCount))
+
+	# Price changes within the window, per day of history in the window
+	changed = np.zeros(len(codes), dtype=bool)
+	changed[1:] = sameAsPrevious[1:] & (prices[1:] != prices[:-1])
+	changed &= (times >= windowStart) & (times <= endTime)
+	changes = np.bincount(codes[changed], minlength=groupCount)
+	days = (endTime - np.maximum(stats['FirstTime'].to_numpy(), windowStart)) / NANOSECONDS_PER_DAY
+
+	with np.errstate(divide='ignore', invalid='ignore'):
+		df = pd.DataFrame({'SpotMean': means,
+		                   'SpotRollingMean': rollingMeans,
+		                   'SpotMin': stats['SpotMin'].to_numpy(),
+		                   'SpotMax': stats['SpotMax'].to_numpy(),
+		                   'SpotStd': stats['SpotStd'].to_numpy(),
+		                   'SpotChanges/Day': np.where(days > 0, changes / days, np.nan)},
+		                  index=groups if len(keyNames) > 1 else groups.get_level_values(0))
+
+		if onDemand is not None:
+			totalTime = np.bincount(codes, weights=durations, minlength=groupCount)
+			groupOnDemand = onDemand.reindex(groups.get_level_values(-1)).to_numpy(dtype=float)
+			for threshold in thresholds:
+				above = prices > groupOnDemand[codes] * threshold / 100.0
+				timeAbove = np.bincount(codes, weights=durations * above, minlength=groupCount)
+				df['SpotAbove%g%%' % threshold] = np.where((totalTime > 0) & ~np.isnan(groupOnDemand),
+				                                           100.0 * timeAbove / totalTime, np.nan)
+
+	return df
+
+
+def getWeightedMeans(codes, groupCount, prices, times, stops, windowStart, endTime):
+	"""
+	Compute the time weighted mean price of each group within a window, falling back to the plain mean of the
+	records in the window when no time passed in it, e.g. when the only record is at endTime.
+
+	:param codes: The group number of each record, sorted.
+	:param groupCount: The number of groups.
+	:param prices: The price of each record.
+	:param times: The time of each record in nanoseconds.
+	:param stops: The time each record's price was held until in nanoseconds.
+	:param windowStart: The window start in nanoseconds.
+	:param endTime: The window end in nanoseconds.
+	:return: The mean of each group, the time each record was held within the window, and a mask of the records
+	         held within the window.
+	"""
+	durations = np.clip(stops - np.maximum(times, windowStart), 0, None).astype(float)
+	held = (times <= endTime) & (stops >= windowStart)
+	totalTime = np.bincount(codes, weights=durations, minlength=groupCount)
+	weightedSum = np.bincount(codes, weights=prices * durations, minlength=groupCount)
+	count = np.bincount(codes[held], minlength=groupCount)
+	priceSum = np.bincount(codes[held], weights=prices[held], minlength=groupCount)
+
+	with np.errstate(divide='ignore', invalid='ignore'):
+		means = np.where(totalTime > 0, weightedSum / totalTime, priceSum / count)
+
+	return means, durations, held
+
+
+def toNanoseconds(timestamp):
+	"""
+	Convert a timestamp to nanoseconds since the epoch, treating naive timestamps as UTC.
+
+	:param timestamp: A timestamp, datetime or string.
+	:return: The nanoseconds since the epoch.
+	"""
+	timestamp = pd.Timestamp(timestamp)
+	if timestamp.tzinfo is None:
+		timestamp = timestamp.tz_localize('UTC')
+
+	return timestamp.value
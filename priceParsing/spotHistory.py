@@ -0,0 +1,196 @@
+import os
+import json
+import pandas as pd
+
+from priceParsing.storage import getStorage
+
+
+
+
+class SpotPriceHistory:
+	"""
+	An append only, deduplicated store of spot price history, partitioned by availability zone and day.
+
+	Alongside the day partitions each availability zone keeps the newest price per instance type, and the store
+	remembers the newest timestamp synced per availability zone so later syncs only need to request the delta.
+	"""
+	keyColumns = ['InstanceType', 'ProductDescription', 'Timestamp']
+
+	def __init__(self, historyDir=os.path.join('csvFiles', 'spot-history'), storageFormat='csv'):
+		"""
+		:param historyDir: The directory holding the history store.
+		:param storageFormat: The on-disk format of the partitions, one of 'csv', 'parquet', 'feather' or 'arrow'.
+		"""
+		self.historyDir = historyDir
+		self.storage = getStorage(storageFormat)
+		self.stateFile = os.path.join(historyDir, 'sync-state.json')
+
+
+	def getPartitionDir(self, availabilityZone):
+		"""
+		Get the directory holding an availability zone's partitions.
+
+		:param availabilityZone: The availability zone, e.g. 'ap-southeast-2a'.
+		:return: The partition directory.
+		"""
+		return os.path.join(self.historyDir, 'az=%s' % availabilityZone)
+
+
+	def readState(self):
+		"""
+		Read the sync state.
+
+		:return: A dict of availability zone to its sync state.
+		"""
+		if not os.path.exists(self.stateFile):
+			return {}
+		with open(self.stateFile, 'r') as f:
+			return json.load(f)
+
+
+	def writeState(self, state):
+		"""
+		Write the sync state.
+
+		:param state: A dict of availability zone to its sync state.
+		"""
+		with open(self.stateFile, 'w') as f:
+			json.dump(state, f, indent=1)
+
+
+	def getLastTimestamp(self, availabilityZone):
+		"""
+		Get the newest timestamp stored for an availability zone.
+
+		:param availabilityZone: The availability zone, e.g. 'ap-southeast-2a'.
+		:return: The newest timestamp, or None if the zone has never been synced.
+		"""
+		lastTimestamp = self.readState().get(availabilityZone, {}).get('lastTimestamp')
+
+		return None if lastTimestamp is None else pd.Timestamp(lastTimestamp)
+
+
+	def readFrame(self, filename):
+		"""
+		Read a stored history frame, restoring the timestamp dtype for text formats.
+
+		:param filename: The file to read.
+		:return: The history dataframe indexed by InstanceType.
+		"""
+		df = self.storage.read(filename)
+		df['Timestamp'] = pd.to_datetime(df['Timestamp'], utc=True)
+
+		return df
+
+
+	def setLastTimestamp(self, availabilityZone, timestamp):
+		"""
+		Record how far an availability zone has been synced, if it is newer than the recorded sync.
+
+		:param availabilityZone: The availability zone, e.g. 'ap-southeast-2a'.
+		:param timestamp: The newest timestamp stored for the zone.
+		"""
+		lastTimestamp = self.getLastTimestamp(availabilityZone)
+		if lastTimestamp is None or timestamp > lastTimestamp:
+			state = self.readState()
+			state[availabilityZone] = {'lastTimestamp': timestamp.isoformat()}
+			self.writeState(state)
+
+
+	def append(self, availabilityZone, records, updateState=True):
+		"""
+		Append price records to the store, dropping any already stored.
+
+		:param availabilityZone: The availability zone the records are for, e.g. 'ap-southeast-2a'.
+		:param records: A list of spot price history records from describe_spot_price_history.
+		:param updateState: True to record the newest appended timestamp as synced. A sync appending in chunks sets
+		                    this False and calls setLastTimestamp once every chunk is stored, as the api returns the
+		                    newest records first.
+		:return: The number of new rows stored.
+		"""
+		if len(records) == 0:
+			return 0
+
+		df = pd.DataFrame(records)
+		df['Timestamp'] = pd.to_datetime(df['Timestamp'], utc=True)
+		df['SpotPrice'] = df['SpotPrice'].astype(float)
+		df = df.set_index(['InstanceType'])
+
+		partitionDir = self.getPartitionDir(availabilityZone)
+		os.makedirs(partitionDir, exist_ok=True)
+
+		# Merge into the day partitions the records fall in
+		newRows = 0
+		for day, dfDay in df.groupby(df['Timestamp'].dt.strftime('%Y-%m-%d')):
+			filename = os.path.join(partitionDir, day + self.storage.extension)
+			if os.path.exists(filename):
+				dfExisting = self.readFrame(filename)
+				dfMerged = self.mergeFrames(dfExisting, dfDay)
+				newRows += dfMerged.shape[0] - dfExisting.shape[0]
+			else:
+				dfMerged = self.mergeFrames(dfDay)
+				newRows += dfMerged.shape[0]
+			self.storage.write(dfMerged, filename)
+
+		# Keep the newest price per instance type
+		latestFile = os.path.join(partitionDir, 'latest' + self.storage.extension)
+		frames = [df]
+		if os.path.exists(latestFile):
+			frames.insert(0, self.readFrame(latestFile))
+		dfLatest = pd.concat(frames).sort_values('Timestamp', kind='stable')
+		dfLatest = dfLatest[~dfLatest.index.duplicated(keep='last')].sort_index()
+		self.storage.write(dfLatest, latestFile)
+
+		# Record how far the zone has been synced
+		if updateState:
+			self.setLastTimestamp(availabilityZone, df['Timestamp'].max())
+
+		return newRows
+
+
+	def mergeFrames(self, *frames):
+		"""
+		Concatenate history frames, dropping duplicate records and sorting by time.
+
+		:param frames: The history dataframes indexed by InstanceType.
+		:return: The merged dataframe.
+		"""
+		df = pd.concat(frames).reset_index()
+		df = df.drop_duplicates(subset=self.keyColumns, keep='last').sort_values('Timestamp', kind='stable')
+
+		return df.set_index(['InstanceType'])
+
+
+	def getLatest(self, availabilityZone):
+		"""
+		Get the newest stored price per instance type.
+
+		:param availabilityZone: The availability zone, e.g. 'ap-southeast-2a'.
+		:return: A dataframe of the newest prices indexed by InstanceType.
+		"""
+		return self.readFrame(os.path.join(self.getPartitionDir(availabilityZone), 'latest' + self.storage.extension))
+
+
+	def getHistory(self, availabilityZone, startDay=None, endDay=None):
+		"""
+		Read the stored history of an availability zone.
+
+		:param availabilityZone: The availability zone, e.g. 'ap-southeast-2a'.
+		:param startDay: The first day to read as 'YYYY-MM-DD', or None for the earliest.
+		:param endDay: The last day to read as 'YYYY-MM-DD', or None for the latest.
+		:return: A dataframe of every stored price record in the range, indexed by InstanceType.
+		"""
+		partitionDir = self.getPartitionDir(availabilityZone)
+		frames = []
+		for filename in sorted(os.listdir(partitionDir)):
+			day, extension = os.path.splitext(filename)
+			if extension != self.storage.extension or day == 'latest':
+				continue
+			if (startDay is not None and day < startDay) or (endDay is not None and day > endDay):
+				continue
+			frames.append(self.readFrame(os.path.join(partitionDir, filename)))
+
+		if len(frames) == 0:
+			raise ValueError('No spot price history stored for %s.' % availabilityZone)
+
+		return pd.concat(frames)
@@ -1,9 +1,12 @@
 from priceParsing.baseParser import BaseParser
+from priceParsing.spotHistory import SpotPriceHistory
+from priceParsing.instrumentation import getTracer
 
 import os
-import time
-import boto3
+import csv
 import pandas as pd
+from datetime import datetime, timezone
+from functools import lru_cache
 
 
 
@@ -11,26 +14,46 @@ class SpotPrices(BaseParser):
 	"""
 	Parsers current spot prices, or reads existing spot prices from csv file.
 	"""
-	def __init__(self, apiKeyFilePath=None, csvDir='csvFiles', regionId='ap-southeast-2', subRegion='a', loadCsv=False):
+	sourceName = 'spotPrices'
+
+	def __init__(self, apiKeyFilePath=None, csvDir='csvFiles', regionId='ap-southeast-2', subRegion='a', loadCsv=False,
+	             paginate=True, snapshotOnly=False, storageFormat='csv', memoryMap=False, maxStaleness=None,
+	             incremental=False, historyDir=None, client=None):
 		"""
 		:param apiKeyFilePath: A path to the api key file.
 		:param csvDir: The directory to read/write csv to/from.
 		:param regionId: The region Id name, e.g. 'ap-southeast-2'.
 		:param subRegion: The sub region string, e.g. 'a', 'b', 'c'.
 		:param loadCsv: True if to load existing data from csv file.
+		:param paginate: True to follow NextToken through every page of the history, False for a single 600 row call.
+		:param snapshotOnly: True to only request the prices current right now (StartTime = EndTime = now).
+		:param storageFormat: The on-disk format, one of 'csv', 'parquet', 'feather' or 'arrow'.
+		:param memoryMap: True to memory map the data file when reading.
+		:param maxStaleness: If given, load from disk when the cached data is at most this many seconds old and came
+		                     from the same source, otherwise fetch it. Overrides loadCsv.
+		:param incremental: True to only request the history since the last sync, appending it to the history store.
+		:param historyDir: The directory of the history store, or None for a spot-history directory in csvDir.
+		:param client: An ec2 client to use instead of creating one from the api key file, e.g. a local stand-in.
 		"""
 		csvFile = 'aws-spot-prices-' + regionId + '-' + subRegion + '.csv'
-		super().__init__(csvDir=csvDir, csvFile=csvFile)
+		super().__init__(csvDir=csvDir, csvFile=csvFile, storageFormat=storageFormat, memoryMap=memoryMap)
 		self.apiKeyFilePath = apiKeyFilePath
 		self.csvDir = csvDir
-		self.csvFile = csvFile
 		self.regionId = regionId
 		self.subRegion = subRegion
-		self.loadCsv = loadCsv
 		self.apiKeyFilePath = apiKeyFilePath
+		self.paginate = paginate
+		self.snapshotOnly = snapshotOnly
+		self.incremental = incremental
+		self.client = client
+		self.history = SpotPriceHistory(historyDir=os.path.join(csvDir, 'spot-history') if historyDir is None else historyDir,
+		                                storageFormat=storageFormat)
+
+		self.sourceInfo = {'api': 'describe_spot_price_history', 'regionId': regionId, 'subRegion': subRegion}
 
 		self.df = None
 
+		self.loadCsv = self.useCache(loadCsv, maxStaleness)
 		if not self.loadCsv:
 			self.parseSpotPricesUsingAPI()
 		else:
@@ -43,48 +66,146 @@ class SpotPrices(BaseParser):
 
 		:return: A dataframe of the current spot prices.
 		"""
-		startTime = time.time()
-		# Read keys file
-		keys = pd.read_csv(self.apiKeyFilePath)
-		print('Read keys file.')
+		with getTracer().span('parse', source=self.sourceName):
+			client = self.client if self.client is not None else self.createClient()
+
+			if self.incremental:
+				# Sync the history store and take the newest price per instance type from it
+				self.df = self.syncHistory(client)
+			else:
+				# Stream the spot price history, keeping only the newest price per instance type
+				latest = {}
+				for price in self.iterSpotPriceHistory(client):
+					current = latest.get(price['InstanceType'])
+					if current is None or price['Timestamp'] > current['Timestamp']:
+						latest[price['InstanceType']] = price
+
+				# Create dataframe
+				self.df = pd.DataFrame(list(latest.values()))
+				self.df = self.df.set_index(['InstanceType'])
+				self.df['SpotPrice'] = self.df['SpotPrice'].astype(float)
+			print('Read %i spot prices using api.' % self.df.shape[0])
+
+			# Write data to disc
+			self.writeToDisk()
+
+		return self.df
+
+
+	def createClient(self):
+		"""
+		Create an ec2 client authenticated with the api key file.
+
+		:return: The boto3 ec2 client.
+		"""
+		import boto3
+
+		accessKeyId, secretAccessKey = readApiKeys(self.apiKeyFilePath)
 
 		# Authenticate Client
-		client = boto3.client('ec2', region_name=self.regionId,
-							  aws_access_key_id=keys['Access key ID'].values[0],
-							  aws_secret_access_key=keys['Secret access key'].values[0])
-
-		# Get the spot price history
-		prices = client.describe_spot_price_history(MaxResults=600,
-													ProductDescriptions=['Linux/UNIX'],
-													AvailabilityZone=self.regionId + self.subRegion)
-
-		# Filter older updates
-		instanceType = []
-		keepData = []
-		for price in prices['SpotPriceHistory']:
-			newType = price['InstanceType']
-			if newType not in instanceType:
-				instanceType.append(newType)
-				keepData.append(price)
-
-		# Create dataframe
-		self.df = pd.DataFrame(keepData)
-		self.df = self.df.set_index(['InstanceType'])
-		self.df['SpotPrice'] = self.df['SpotPrice'].astype(float)
-		print('Read %i spot prices using api.' % self.df.shape[0])
-
-		# Write data to disc
-		filename = os.path.join(self.csvDir, self.csvFile)
-		self.df.to_csv(filename)
-		print('Wrote', filename)
-
-		endTime = time.time()
-		print('Elapsed %.2fs' %  (endTime - startTime))
+		return boto3.client('ec2', region_name=self.regionId, aws_access_key_id=accessKeyId,
+		                    aws_secret_access_key=secretAccessKey)
 
-		return self.df
 
+	def syncHistory(self, client, chunkSize=10000):
+		"""
+		Request the spot price history since the last sync of this availability zone and append it to the history
+		store, in chunks so memory stays bounded on the first full sync.
+
+		:param client: An authenticated boto3 ec2 client.
+		:param chunkSize: The number of records to buffer before appending them to the store.
+		:return: A dataframe of the newest price per instance type.
+		"""
+		availabilityZone = self.regionId + self.subRegion
+		lastTimestamp = self.history.getLastTimestamp(availabilityZone)
+		print('Syncing spot price history for %s since %s.' % (availabilityZone, 'the start' if lastTimestamp is None else lastTimestamp))
+
+		# The api returns the newest records first, so the synced timestamp is only recorded once the whole delta is
+		# stored, otherwise a sync failing part way would skip the older records on the next run
+		newRows = 0
+		newestTimestamp = None
+		records = []
+		for price in self.iterSpotPriceHistory(client, startTime=lastTimestamp):
+			records.append(price)
+			timestamp = pd.to_datetime(price['Timestamp'], utc=True)
+			if newestTimestamp is None or timestamp > newestTimestamp:
+				newestTimestamp = timestamp
+			if len(records) >= chunkSize:
+				newRows += self.appendHistory(availabilityZone, records)
+				records = []
+		newRows += self.appendHistory(availabilityZone, records)
+		if newestTimestamp is not None:
+			self.history.setLastTimestamp(availabilityZone, newestTimestamp)
+		print('Appended %i new spot price history rows.' % newRows)
+
+		return self.history.getLatest(availabilityZone)
+
+
+	def appendHistory(self, availabilityZone, records):
+		"""
+		Append a chunk of history records to the history store.
 
+		:param availabilityZone: The availability zone of the records.
+		:param records: A list of spot price history records.
+		:return: The number of new rows stored.
+		"""
+		with getTracer().span('historyAppend', source=self.sourceName) as span:
+			newRows = self.history.append(availabilityZone, records, updateState=False)
+			span.count(rows=newRows)
 
+		return newRows
 
 
+	def iterSpotPriceHistory(self, client, startTime=None, endTime=None):
+		"""
+		Walk the spot price history page by page, yielding one price record at a time.
+
+		:param client: An authenticated boto3 ec2 client.
+		:param startTime: The earliest time to request prices from, or None for the api default.
+		:param endTime: The latest time to request prices up to, or None for the api default.
+		:return: A generator of spot price history records.
+		"""
+		request = {'ProductDescriptions': ['Linux/UNIX'],
+		           'AvailabilityZone': self.regionId + self.subRegion,
+		           'MaxResults': 1000 if self.paginate else 600}
+		if self.snapshotOnly:
+			now = datetime.now(timezone.utc)
+			startTime = now if startTime is None else startTime
+			endTime = now if endTime is None else endTime
+		if startTime is not None:
+			request['StartTime'] = startTime
+		if endTime is not None:
+			request['EndTime'] = endTime
+
+		pageCount = 0
+		while True:
+			with getTracer().span('apiPage', source=self.sourceName, page=pageCount) as span:
+				page = client.describe_spot_price_history(**request)
+				span.count(rows=len(page['SpotPriceHistory']))
+			pageCount += 1
+			for price in page['SpotPriceHistory']:
+				yield price
+
+			nextToken = page.get('NextToken')
+			if not self.paginate or not nextToken:
+				break
+			request['NextToken'] = nextToken
+
+		print('Read %i page(s) of spot price history.' % pageCount)
+
+
+
+
+@lru_cache(maxsize=None)
+def readApiKeys(apiKeyFilePath):
+	"""
+	Read the keys from an AWS api key csv file. Each file is only read once per process.
+
+	:param apiKeyFilePath: A path to the api key file.
+	:return: The access key id and secret access key.
+	"""
+	with open(apiKeyFilePath, 'r', encoding='utf-8-sig', newline='') as f:
+		keys = next(csv.DictReader(f))
+	print('Read keys file.')
 
+	return keys['Access key ID'], keys['Secret access key']
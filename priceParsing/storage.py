@@ -0,0 +1,123 @@
+import pandas as pd
+
+
+
+
+class CsvStorage:
+	"""
+	Reads and writes dataframes as csv text. Dtypes are re-inferred on every read.
+	"""
+	extension = '.csv'
+
+	def __init__(self, memoryMap=False):
+		"""
+		:param memoryMap: True to memory map the file when reading.
+		"""
+		self.memoryMap = memoryMap
+
+
+	def write(self, df, filename):
+		"""
+		Write a dataframe to disk.
+
+		:param df: The dataframe to write.
+		:param filename: The file to write to.
+		"""
+		df.to_csv(filename)
+
+
+	def read(self, filename, indexLevels=1):
+		"""
+		Read a dataframe from disk.
+
+		:param filename: The file to read from.
+		:param indexLevels: The number of leading columns that make up the index.
+		:return: The dataframe.
+		"""
+		return pd.read_csv(filename, index_col=list(range(indexLevels)), memory_map=self.memoryMap)
+
+
+
+class ParquetStorage(CsvStorage):
+	"""
+	Reads and writes dataframes as compressed columnar parquet, keeping dtypes and the index. Requires pyarrow.
+	"""
+	extension = '.parquet'
+
+	def write(self, df, filename):
+		"""
+		Write a dataframe to disk.
+
+		:param df: The dataframe to write.
+		:param filename: The file to write to.
+		"""
+		df.to_parquet(filename, engine='pyarrow')
+
+
+	def read(self, filename, indexLevels=1):
+		"""
+		Read a dataframe from disk. The index is restored from the file metadata.
+
+		:param filename: The file to read from.
+		:param indexLevels: Unused, the index is stored in the file.
+		:return: The dataframe.
+		"""
+		return pd.read_parquet(filename, engine='pyarrow', memory_map=self.memoryMap)
+
+
+
+class FeatherStorage(CsvStorage):
+	"""
+	Reads and writes dataframes as uncompressed Arrow IPC (feather v2) files, keeping dtypes and the index.
+	Reads can be memory mapped for near zero copy loading. Requires pyarrow.
+	"""
+	extension = '.arrow'
+
+	def write(self, df, filename):
+		"""
+		Write a dataframe to disk.
+
+		:param df: The dataframe to write.
+		:param filename: The file to write to.
+		"""
+		import pyarrow as pa
+		from pyarrow import feather
+
+		feather.write_feather(pa.Table.from_pandas(df), filename, compression='uncompressed')
+
+
+	def read(self, filename, indexLevels=1):
+		"""
+		Read a dataframe from disk. The index is restored from the file metadata.
+
+		:param filename: The file to read from.
+		:param indexLevels: Unused, the index is stored in the file.
+		:return: The dataframe.
+		"""
+		from pyarrow import feather
+
+		return feather.read_table(filename, memory_map=self.memoryMap).to_pandas()
+
+
+
+
+STORAGE_FORMATS = {
+	'csv': CsvStorage,
+	'parquet': ParquetStorage,
+	'feather': FeatherStorage,
+	'arrow': FeatherStorage,
+}
+
+
+def getStorage(storageFormat='csv', memoryMap=False):
+	"""
+	Get the storage backend for a format name.
+
+	:param storageFormat: One of 'csv', 'parquet', 'feather' or 'arrow'.
+	:param memoryMap: True to memory map files when reading.
+	:return: The storage backend.
+	"""
+	if storageFormat not in STORAGE_FORMATS:
+		raise ValueError('Unknown storage format %r, expected one of %s.' % (storageFormat, ', '.join(STORAGE_FORMATS)))
+
+	return STORAGE_FORMATS[storageFormat](memoryMap=memoryMap)
@@ -0,0 +1,46 @@
+import os
+
+from priceParsing.storage import getStorage
+
+
+
+
+def getSummaryFilename(regionId, extension):
+	"""
+	Get the file name of a combined price summary.
+
+	:param regionId: The region Id name, or None for the MultiRegionPrices summary.
+	:param extension: The storage format's file extension, e.g. '.csv'.
+	:return: The file name.
+	"""
+	return 'combined-prices-summary-%s%s' % ('multi-region' if regionId is None else regionId, extension)
+
+
+def getChangelogFilename(regionId):
+	"""
+	Get the file name of the changelog written alongside a combined price summary.
+
+	:param regionId: The region Id name, or None for the MultiRegionPrices summary.
+	:return: The file name.
+	"""
+	return 'combined-prices-changes-%s.jsonl' % ('multi-region' if regionId is None else regionId)
+
+
+def loadCombinedSummary(csvDir='csvFiles', regionId='ap-southeast-2', storageFormat='csv', memoryMap=False):
+	"""
+	Load a previously written combined price summary. Only pandas and the storage backend are imported, so this is
+	the fast path for consumers that only read cached prices.
+
+	:param csvDir: The directory the summary was written to.
+	:param regionId: The region Id name, or None for the MultiRegionPrices summary.
+	:param storageFormat: The on-disk format, one of 'csv', 'parquet', 'feather' or 'arrow'.
+	:param memoryMap: True to memory map the file when reading.
+	:return: The combined dataframe, indexed by (GroupType, InstanceType), or (Region, AZ, InstanceType) for the
+	         multi-region summary.
+	"""
+	storage = getStorage(storageFormat, memoryMap=memoryMap)
+	filename = os.path.join(csvDir, getSummaryFilename(regionId, storage.extension))
+	df = storage.read(filename, indexLevels=2 if regionId is not None else 3)
+	print('Read %s from disk.' % filename)
+
+	return df
@@ -0,0 +1,204 @@
+import json
+import hashlib
+import pandas as pd
+
+from priceParsing.instrumentation import getTracer
+
+
+
+
+# Collects the raw innerText of every cell of every table at or below the root element in one round trip.
+# Each table is returned as {'thead': [row, ...], 'tbodies': [[row, ...], ...], 'rows': [row, ...]}, with each row as {'th': [...], 'td': [...]}.
+TABLE_EXTRACTION_SCRIPT = """
+var root = arguments[0] || document;
+function cellTexts(row, tag) {
+	return Array.prototype.map.call(row.querySelectorAll(tag), function (cell) {
+		return cell.innerText;
+	});
+}
+function rowsOf(element) {
+	return Array.prototype.map.call(element.querySelectorAll('tr'), function (row) {
+		return {th: cellTexts(row, 'th'), td: cellTexts(row, 'td')};
+	});
+}
+var tables = root.tagName === 'TABLE' ? [root] : root.querySelectorAll('table');
+return JSON.stringify(Array.prototype.map.call(tables, function (table) {
+	return {
+		thead: Array.prototype.concat.apply([], Array.prototype.map.call(table.querySelectorAll('thead'), rowsOf)),
+		tbodies: Array.prototype.map.call(table.querySelectorAll('tbody'), rowsOf),
+		rows: rowsOf(table)
+	};
+}));
+"""
+
+# Collects the text of the first row of every table on the page, used to recognise the page layout cheaply
+TABLE_HEADERS_SCRIPT = """
+return JSON.stringify(Array.prototype.map.call(document.querySelectorAll('table'), function (table) {
+	var row = table.querySelector('tr');
+	return row ? Array.prototype.map.call(row.querySelectorAll('th, td'), function (cell) {
+		return cell.innerText;
+	}) : [];
+}));
+"""
+
+# Collects the html of every table at or below the root element, used to fingerprint the tables without extracting them
+TABLE_HTML_SCRIPT = """
+var root = arguments[0] || document;
+var tables = root.tagName === 'TABLE' ? [root] : root.querySelectorAll('table');
+return Array.prototype.map.call(tables, function (table) {
+	return table.outerHTML;
+}).join('');
+"""
+
+# Matches everything around the number in a price string such as '$1,234.5 per Hour'
+PRICE_PATTERN = r'[$,]|\s*per Hour'
+
+
+
+
+def extractTables(driver, element=None):
+	"""
+	Extract the text of every table at or below an element with a single script execution.
+
+	:param driver: The selenium web driver.
+	:param element: The table, or an element containing tables, or None for the whole page.
+	:return: A list of tables as {'thead': rows, 'tbodies': [rows, ...], 'rows': rows}, each row as {'th': [...], 'td': [...]}.
+	"""
+	result = driver.execute_script(TABLE_EXTRACTION_SCRIPT, element)
+	getTracer().count(bytes=len(result))
+
+	return json.loads(result)
+
+
+def extractTableHeaders(driver):
+	"""
+	Extract the text of the first row of every table on the page with a single script execution.
+
+	:param driver: The selenium web driver.
+	:return: A list of header cell texts per table, in page order.
+	"""
+	result = driver.execute_script(TABLE_HEADERS_SCRIPT)
+	getTracer().count(bytes=len(result))
+
+	return json.loads(result)
+
+
+def getTablesHash(driver, element=None):
+	"""
+	Fingerprint the tables at or below an element by hashing their html, without extracting them.
+
+	:param driver: The selenium web driver.
+	:param element: The table, or an element containing tables, or None for the whole page.
+	:return: A hex digest of the tables' html.
+	"""
+	html = driver.execute_script(TABLE_HTML_SCRIPT, element)
+	getTracer().count(bytes=len(html))
+
+	return hashlib.sha1(html.encode('utf-8')).hexdigest()
+
+
+def getHtmlTablesHash(html, xpath='//table'):
+	"""
+	Fingerprint the tables matching an xpath in static html by hashing their html, without extracting them.
+
+	:param html: The page html.
+	:param xpath: The xpath selecting the tables.
+	:return: A hex digest of the tables' html.
+	"""
+	from lxml import html as lxmlHtml
+
+	digest = hashlib.sha1()
+	for table in lxmlHtml.fromstring(html).xpath(xpath):
+		digest.update(lxmlHtml.tostring(table))
+
+	return digest.hexdigest()
+
+
+def parsePriceColumn(series):
+	"""
+	Convert price strings like '$0.0116 per Hour' to floats in one vectorized pass.
+
+	:param series: A series of price strings.
+	:return: A float series, with NaN where no price could be read.
+	"""
+	return pd.to_numeric(series.astype(str).str.replace(PRICE_PATTERN, '', regex=True).str.strip(), errors='coerce')
+
+
+def readHtmlSource(source):
+	"""
+	Read a saved page, either from a local file or from a url such as a local http server.
+
+	:param source: A file path or an http(s) url.
+	:return: The page html.
+	"""
+	if source.startswith('http://') or source.startswith('https://'):
+		import urllib.request
+
+		with urllib.request.urlopen(source) as response:
+			return response.read().decode(response.headers.get_content_charset() or 'utf-8')
+
+	with open(source, 'r', encoding='utf-8') as f:
+		return f.read()
+
+
+def readHtmlSourceIfChanged(source, validators=None):
+	"""
+	Read a saved page, asking the server to skip sending it if it is unchanged since it was last read.
+
+	Urls are requested with If-None-Match and If-Modified-Since built from the validators of the last response, so
+	an unchanged page costs one small 304 response. Files are always read.
+
+	:param source: A file path or an http(s) url.
+	:param validators: A dict with the 'etag' and 'lastModified' of the last response, or None for an unconditional read.
+	:return: The page html, or None if the server reported it unchanged, and the validators of the response.
+	"""
+	if not (source.startswith('http://') or source.startswith('https://')):
+		return readHtmlSource(source), {}
+	import urllib.error
+	import urllib.request
+
+	validators = {} if validators is None else validators
+	headers = {}
+	if validators.get('etag') is not None:
+		headers['If-None-Match'] = validators['etag']
+	if validators.get('lastModified') is not None:
+		headers['If-Modified-Since'] = validators['lastModified']
+
+	try:
+		with urllib.request.urlopen(urllib.request.Request(source, headers=headers)) as response:
+			html = response.read().decode(response.headers.get_content_charset() or 'utf-8')
+			return html, {'etag': response.headers.get('ETag'), 'lastModified': response.headers.get('Last-Modified')}
+	except urllib.error.HTTPError as e:
+		if e.code != 304:
+			raise
+		return None, {key: validators.get(key) for key in ['etag', 'lastModified']}
+
+
+def extractTablesFromHtml(html, xpath='//table'):
+	"""
+	Extract the text of the tables matching an xpath from static html, without a browser.
+
+	The output matches extractTables, so saved snapshots of a rendered page parse the same as the live page.
+
+	:param html: The page html.
+	:param xpath: The xpath selecting the tables to extract.
+	:return: A list of tables as {'thead': rows, 'tbodies': [rows, ...], 'rows': rows}, each row as {'th': [...], 'td': [...]}.
+	"""
+	from lxml import html as lxmlHtml
+
+	def rowsOf(element):
+		return [{'th': [cell.text_content() for cell in row.xpath('.//th')],
+		         'td': [cell.text_content() for cell in row.xpath('.//td')]} for row in element.xpath('.//tr')]
+
+	getTracer().count(bytes=len(html))
+	tables = []
+	for table in lxmlHtml.fromstring(html).xpath(xpath):
+		thead = [row for head in table.xpath('.//thead') for row in rowsOf(head)]
+		tbodies = [rowsOf(body) for body in table.xpath('.//tbody')]
+		rows = rowsOf(table)
+		# Browsers add the tbody when rendering, raw html may not have one
+		if len(tbodies) == 0:
+			tbodies = [rows[len(thead):]]
+		tables.append({'thead': thead, 'tbodies': tbodies, 'rows': rows})
+
+	return tables
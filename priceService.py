@@ -0,0 +1,286 @@
+import sys
+import json
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs, unquote
+
+from parseAndCombinePrices import AllPrices
+from priceParsing.instrumentation import getTracer, PrometheusSink
+from priceParsing.priceQuery import PriceQueryEngine
+
+
+
+class PriceSnapshot:
+	"""
+	An immutable combined price dataframe and its query index, as served to readers.
+	"""
+	def __init__(self, df, version):
+		"""
+		:param df: The combined price dataframe.
+		:param version: An increasing version number of the snapshot.
+		"""
+		self.df = df
+		self.version = version
+		self.createdAt = time.time()
+		self.queryEngine = PriceQueryEngine(df)
+
+
+
+class PriceService:
+	"""
+	Keep the combined prices in memory, refresh each source in the background on its own schedule, and serve
+	lookups and queries over a small local http/json api.
+
+	Refreshes build a complete new snapshot off to the side and then swap it in with a single reference
+	assignment, so readers never wait on a refresh and never see a half updated dataframe.
+	"""
+	def __init__(self, allPrices, refreshIntervals=None, host='127.0.0.1', port=8080):
+		"""
+		:param allPrices: The AllPrices used to collect and combine the sources. Only the refresh thread uses it.
+		:param refreshIntervals: A dict of source name to its refresh interval in seconds, or None for
+		                         AllPrices.defaultMaxStaleness. Also used as the max staleness of the cached data
+		                         loaded on start, unless allPrices was given its own maxStaleness.
+		:param host: The address to serve the api on.
+		:param port: The port to serve the api on.
+		"""
+		self.allPrices = allPrices
+		self.refreshIntervals = dict(AllPrices.defaultMaxStaleness if refreshIntervals is None else refreshIntervals)
+		self.host = host
+		self.port = port
+
+		self.snapshot = None
+		self.lastRefresh = {}
+		self.errors = {}
+		self.refreshLock = threading.Lock()
+		self.stopEvent = threading.Event()
+		self.server = None
+		self.threads = []
+
+
+	def start(self):
+		"""
+		Load the initial snapshot, reusing cached sources that are still fresh, then start the refresh and api threads.
+		"""
+		if not self.allPrices.maxStaleness:
+			self.allPrices.maxStaleness = dict(self.refreshIntervals)
+		with self.refreshLock:
+			self.publish(self.allPrices.parseAllPrices())
+		# Schedule from when each source was actually fetched, as fresh sources were loaded from disk
+		for name in self.refreshIntervals:
+			metadata = getattr(self.allPrices, name).readCacheMetadata()
+			self.lastRefresh[name] = time.time() if metadata is None else metadata['fetchedAt']
+
+		self.server = ThreadingHTTPServer((self.host, self.port), makeRequestHandler(self))
+		self.threads = [threading.Thread(target=self.runScheduler, name='price-refresh', daemon=True),
+		                threading.Thread(target=self.server.serve_forever, name='price-api', daemon=True)]
+		for thread in self.threads:
+			thread.start()
+		print('Serving prices on http://%s:%i' % (self.host, self.port))
+
+
+	def stop(self):
+		"""
+		Stop the refresh and api threads.
+		"""
+		self.stopEvent.set()
+		if self.server is not None:
+			self.server.shutdown()
+			self.server.server_close()
+		for thread in self.threads:
+			thread.join()
+
+
+	def publish(self, df):
+		"""
+		Swap in a new snapshot built from a combined dataframe.
+
+		:param df: The new combined price dataframe.
+		"""
+		version = 1 if self.snapshot is None else self.snapshot.version + 1
+		self.snapshot = PriceSnapshot(df, version)
+
+
+	def refreshSource(self, name):
+		"""
+		Re-fetch one source and publish a new snapshot. The current snapshot keeps being served if it fails.
+
+		:param name: The source name, e.g. 'spotPrices'.
+		"""
+		print('Refreshing %s.' % name)
+		try:
+			with self.refreshLock, getTracer().span('refresh', source=name):
+				self.publish(self.allPrices.refreshSources([name]))
+			self.errors.pop(name, None)
+		except Exception as e:
+			self.errors[name] = repr(e)
+			print('Failed to refresh %s: %r' % (name, e))
+		self.lastRefresh[name] = time.time()
+
+
+	def runScheduler(self):
+		"""
+		Refresh each source when its interval has passed, until stopped.
+		"""
+		while not self.stopEvent.is_set():
+			for name in self.getDueSources(time.time()):
+				if not self.stopEvent.is_set():
+					self.refreshSource(name)
+			self.stopEvent.wait(max(1.0, min(self.getNextDue().values()) - time.time()))
+
+
+	def getNextDue(self):
+		"""
+		Get when each source is next due for a refresh.
+
+		:return: A dict of source name to the unix time its interval has passed since its last refresh.
+		"""
+		return {name: self.lastRefresh.get(name, 0) + interval for name, interval in self.refreshIntervals.items()}
+
+
+	def getDueSources(self, now):
+		"""
+		Get the sources due for a refresh.
+
+		:param now: The current unix time.
+		:return: A list of the names of the sources whose interval has passed.
+		"""
+		return [name for name, due in self.getNextDue().items() if due <= now]
+
+
+	def getStatus(self):
+		"""
+		Get the status of the service.
+
+		:return: A dict of the snapshot version and age, last refresh time per source and refresh errors.
+		"""
+		snapshot = self.snapshot
+		return {'version': snapshot.version,
+		        'snapshotAge': time.time() - snapshot.createdAt,
+		        'rows': int(snapshot.df.shape[0]),
+		        'lastRefresh': dict(self.lastRefresh),
+		        'errors': dict(self.errors)}
+
+
+	def getPrices(self, instanceType=None, group=None, limit=None):
+		"""
+		Look up rows of the current snapshot.
+
+		:param instanceType: Only return this instance type, or None for all.
+		:param group: Only return this group type, or None for all.
+		:param limit: The maximum number of rows to return, or None for all.
+		:return: A dataframe of the matching rows.
+		"""
+		df = self.snapshot.df
+		if instanceType is not None:
+			df = df[df.index.get_level_values(-1) == instanceType]
+		if group is not None:
+			df = df[df.index.get_level_values(0) == group]
+		if limit is not None:
+			df = df.head(limit)
+
+		return df
+
+
+	def query(self, **kwargs):
+		"""
+		Run a constraint and objective query against the current snapshot, see PriceQueryEngine.query.
+
+		:return: A dataframe of at most k instances, ordered by the objective.
+		"""
+		return self.snapshot.queryEngine.query(**kwargs)
+
+
+
+
+def parseQueryArguments(params):
+	"""
+	Convert url query parameters to PriceService.query arguments. Constraints are given as min.<column>=<value>
+	and max.<column>=<value>, e.g. /query?min.vCPU=16&min.Mem%20(GiB)=64&gpu=false&objective=SpotPrice&k=5
+
+	:param params: The parsed query string, from parse_qs.
+	:return: A dict of query arguments.
+	"""
+	minimums = {key[4:]: float(values[-1]) for key, values in params.items() if key.startswith('min.')}
+	maximums = {key[4:]: float(values[-1]) for key, values in params.items() if key.startswith('max.')}
+	arguments = {'minimums': minimums, 'maximums': maximums}
+	if 'gpu' in params:
+		arguments['gpu'] = params['gpu'][-1].lower() in ('1', 'true', 'yes')
+	if 'objective' in params:
+		arguments['objective'] = params['objective'][-1]
+	if 'k' in params:
+		arguments['k'] = int(params['k'][-1])
+	if 'ascending' in params:
+		arguments['ascending'] = params['ascending'][-1].lower() in ('1', 'true', 'yes')
+
+	return arguments
+
+
+def makeRequestHandler(service):
+	"""
+	Make a request handler class serving a price service.
+
+	:param service: The price service.
+	:return: The request handler class.
+	"""
+	class PriceRequestHandler(BaseHTTPRequestHandler):
+		def do_GET(self):
+			url = urlparse(self.path)
+			params = parse_qs(url.query)
+			parts = [unquote(part) for part in url.path.split('/') if part != '']
+			try:
+				if parts == ['health']:
+					self.sendJson(200, json.dumps(service.getStatus()))
+				elif len(parts) in (1, 2) and parts[0] == 'prices':
+					limit = int(params['limit'][-1]) if 'limit' in params else None
+					group = params['group'][-1] if 'group' in params else None
+					df = service.getPrices(instanceType=parts[1] if len(parts) == 2 else None, group=group, limit=limit)
+					self.sendJson(200, df.reset_index().to_json(orient='records'))
+				elif parts == ['query']:
+					df = service.query(**parseQueryArguments(params))
+					self.sendJson(200, df.reset_index().to_json(orient='records'))
+				elif parts == ['metrics']:
+					sinks = [sink for sink in getTracer().sinks if isinstance(sink, PrometheusSink)]
+					self.sendBody(200, ''.join(sink.render() for sink in sinks), 'text/plain; version=0.0.4')
+				else:
+					self.sendJson(404, json.dumps({'error': 'Unknown path %s' % url.path}))
+			except (KeyError, ValueError) as e:
+				self.sendJson(400, json.dumps({'error': repr(e)}))
+
+		def sendJson(self, status, body):
+			self.sendBody(status, body, 'application/json')
+
+		def sendBody(self, status, body, contentType):
+			data = body.encode('utf-8')
+			self.send_response(status)
+			self.send_header('Content-Type', contentType)
+			self.send_header('Content-Length', str(len(data)))
+			self.end_headers()
+			self.wfile.write(data)
+
+		def log_message(self, format, *args):
+			pass
+
+	return PriceRequestHandler
+
+
+
+
+if __name__ == '__main__':
+	# Region settings
+	regionId = 'ap-southeast-2'
+	subRegion = 'a'
+
+	# Set key path and port
+	apiKeyFilePath = sys.argv[1]
+	port = int(sys.argv[2]) if len(sys.argv) > 2 else 8080
+
+	# Serve until interrupted
+	allPrices = AllPrices(apiKeyFilePath=apiKeyFilePath, csvDir='csvFiles', regionId=regionId, subRegion=subRegion)
+	service = PriceService(allPrices, port=port)
+	service.start()
+	try:
+		while True:
+			time.sleep(60)
+	except KeyboardInterrupt:
+		service.stop()
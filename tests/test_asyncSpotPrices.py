@@ -0,0 +1,84 @@
+import threading
+
+import pandas as pd
+import pytest
+
+from priceParsing.asyncSpotPrices import AsyncSpotPrices
+
+
+
+
+class ThrottlingError(Exception):
+	"""
+	A stand-in for a botocore ClientError with a throttling error code.
+	"""
+	def __init__(self):
+		super().__init__('Rate exceeded')
+		self.response = {'Error': {'Code': 'Throttling'}}
+
+
+
+class ThrottlingClient:
+	"""
+	A stand-in ec2 client serving each zone's spot price history two records a page, throttling its first request.
+	"""
+	def __init__(self, history):
+		self.history = history
+		self.requests = []
+		self.lock = threading.Lock()
+
+
+	def describe_spot_price_history(self, **request):
+		with self.lock:
+			self.requests.append(request)
+			if len(self.requests) == 1:
+				raise ThrottlingError()
+
+		records = self.history[request['AvailabilityZone']]
+		start = int(request.get('NextToken', 0))
+		page = {'SpotPriceHistory': records[start:start + 2]}
+		if start + 2 < len(records):
+			page['NextToken'] = str(start + 2)
+
+		return page
+
+
+
+
+def makeRecord(instanceType, price, hours, availabilityZone):
+	return {'InstanceType': instanceType, 'ProductDescription': 'Linux/UNIX', 'SpotPrice': str(price),
+	        'Timestamp': pd.Timestamp('2024-03-10', tz='UTC') - pd.Timedelta(hours=hours),
+	        'AvailabilityZone': availabilityZone}
+
+
+def testCollectRetriesThrottledRequestsAndKeepsTheNewestPrices(tmp_path):
+	history = {'ap-southeast-2a': [makeRecord('m5.large', 0.03, 5, 'ap-southeast-2a'),
+	                               makeRecord('m5.large', 0.04, 1, 'ap-southeast-2a'),
+	                               makeRecord('c5.large', 0.02, 3, 'ap-southeast-2a'),
+	                               makeRecord('m5.large', 0.05, 9, 'ap-southeast-2a')],
+	           'ap-southeast-2b': [makeRecord('m5.large', 0.06, 2, 'ap-southeast-2b')]}
+	client = ThrottlingClient(history)
+
+	spotPrices = AsyncSpotPrices({'ap-southeast-2': ['a', 'b']}, csvDir=str(tmp_path), baseDelay=0.001,
+	                             clientFactory=lambda regionId: client)
+
+	assert spotPrices.retryCount == 1
+	# The throttled request is retried, and the first zone walks its two pages
+	assert len(client.requests) == 4
+	assert all('StartTime' in request and request['StartTime'] == request['EndTime'] for request in client.requests)
+	assert spotPrices.df['SpotPrice'].to_dict() == {('ap-southeast-2', 'ap-southeast-2a', 'm5.large'): 0.04,
+	                                                ('ap-southeast-2', 'ap-southeast-2a', 'c5.large'): 0.02,
+	                                                ('ap-southeast-2', 'ap-southeast-2b', 'm5.large'): 0.06}
+
+
+def testCollectGivesUpAfterMaxRetries(tmp_path):
+	class AlwaysThrottled(ThrottlingClient):
+		def describe_spot_price_history(self, **request):
+			self.requests.append(request)
+			raise ThrottlingError()
+
+	client = AlwaysThrottled({})
+	with pytest.raises(ThrottlingError):
+		AsyncSpotPrices({'ap-southeast-2': ['a']}, csvDir=str(tmp_path), maxRetries=2, baseDelay=0.001,
+		                clientFactory=lambda regionId: client)
+	assert len(client.requests) == 3
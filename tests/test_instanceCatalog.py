@@ -0,0 +1,30 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from priceParsing.instanceCatalog import InstanceCatalog
+
+
+
+
+def testGatherKeepsLabelsAndFillsMissingRows():
+	catalog = InstanceCatalog(aliases={'old.large': 'New.large'})
+	spot = pd.DataFrame({'SpotPrice': [0.1, 0.2]}, index=['m5.large', 'R5.Large '])
+	nodeTypes = pd.DataFrame({'vCPU': [2, 2, 4], 'Storage Medium': pd.Categorical(['EBS', 'SSD', 'SSD'])},
+	                         index=['M5.large*', 'old.large', 'm5.xlarge'])
+
+	spotMapping = catalog.mapFrame(spot)
+	nodeTypesMapping = catalog.mapFrame(nodeTypes)
+	rowIds = np.unique(np.concatenate([spotMapping.ids, nodeTypesMapping.ids]))
+	assert list(catalog.getLabels(rowIds)) == ['m5.large', 'R5.Large ', 'New.large', 'm5.xlarge']
+
+	with warnings.catch_warnings():
+		warnings.simplefilter('error')
+		spotColumns = catalog.gather(spot, spotMapping, rowIds)
+		nodeTypesColumns = catalog.gather(nodeTypes, nodeTypesMapping, rowIds)
+
+	np.testing.assert_array_equal(np.asarray(spotColumns['SpotPrice'], dtype=float), [0.1, 0.2, np.nan, np.nan])
+	np.testing.assert_array_equal(np.asarray(nodeTypesColumns['vCPU'], dtype=float), [2, np.nan, 2, 4])
+	assert isinstance(nodeTypesColumns['Storage Medium'].dtype, pd.CategoricalDtype)
+	assert list(pd.Series(nodeTypesColumns['Storage Medium']).isna()) == [False, True, False, False]
@@ -0,0 +1,80 @@
+import os
+import json
+
+import pytest
+
+from priceParsing.nodeTypes import NodeTypes
+
+
+
+
+def makeTable(headers, rows):
+	return '<table><tr>%s</tr>%s</table>' % (''.join('<th>%s</th>' % header for header in headers),
+	                                         ''.join('<tr>%s</tr>' % ''.join('<td>%s</td>' % value for value in row)
+	                                                 for row in rows))
+
+
+def writeArchive(tmp_path):
+	html = makeTable(['Instance Size', 'vCPU', 'Mem (GiB)', 'Instance Storage (GB)', 'EBS Bandwidth (Mbps)'],
+	                 [['m5d.large', 2, 8, '1 x 75 NVMe SSD', 'Up to 4,750'], ['m5.large', 2, 8, 'EBS-Only', '4,750']])
+	html += makeTable(['Instance', 'vCPUs', 'Memory (GiB)', 'Instance Storage (TB)', 'EBS Bandwidth (Gbps)'],
+	                  [['i3en.24xlarge', 96, 768, '8 x 7.5 NVMe SSD', '19'], ['d3.xlarge', 4, 32, '3 x 2 HDD', 'Up to 2.8']])
+	html += makeTable(['Model', 'vCPU*', 'Mem(GiB)', 'Instance Storage (GiB)', 'EBS Bandwidth'],
+	                  [['c5d.large', 2, 4, '1 x 50 NVMe SSD', '9,500']])
+	htmlSource = tmp_path / 'instance-types.html'
+	htmlSource.write_text('<html><body>%s</body></html>' % html)
+
+	return str(htmlSource)
+
+
+@pytest.fixture
+def nodeTypes(tmp_path):
+	return NodeTypes(csvDir=str(tmp_path), htmlSource=writeArchive(tmp_path))
+
+
+def testStorageIsReadInTheHeaderUnit(nodeTypes):
+	storage = nodeTypes.df['Storage (GB)'].round(3).to_dict()
+	assert storage == {'m5d.large': 75.0, 'm5.large': 0.0, 'i3en.24xlarge': 60000.0, 'd3.xlarge': 6000.0,
+	                   'c5d.large': 53.687}
+	# The scraped strings are kept as they were shown
+	assert nodeTypes.df.loc['i3en.24xlarge', 'Storage'] == '8 x 7.5 NVMe SSD'
+	assert nodeTypes.df.loc['i3en.24xlarge', 'Storage Unit'] == 'tb'
+
+
+def testEbsBandwidthIsReadInTheHeaderUnit(nodeTypes):
+	assert nodeTypes.df['EBS Burst (Mbps)'].to_dict() == {'m5d.large': 4750.0, 'm5.large': 4750.0,
+	                                                      'i3en.24xlarge': 19000.0, 'd3.xlarge': 2800.0,
+	                                                      'c5d.large': 9500.0}
+	assert nodeTypes.df['EBS Baseline (Mbps)'].isna().to_dict() == {'m5d.large': True, 'm5.large': False,
+	                                                                'i3en.24xlarge': False, 'd3.xlarge': True,
+	                                                                'c5d.large': False}
+
+
+def testArchiveParsesKeepTheArchiveTimeAndSource(tmp_path):
+	htmlSource = writeArchive(tmp_path)
+	archivedAt = 1700000000.0
+	os.utime(htmlSource, (archivedAt, archivedAt))
+
+	nodeTypes = NodeTypes(csvDir=str(tmp_path), htmlSource=htmlSource)
+	with open(nodeTypes.getMetadataFilename()) as f:
+		metadata = json.load(f)
+	assert metadata['fetchedAt'] == archivedAt
+	assert metadata['source'] == {'pageLink': nodeTypes.pageLink, 'htmlSource': os.path.abspath(htmlSource),
+	                              'htmlSourceMtime': archivedAt}
+
+	# Parsing the unchanged archive again keeps the cached data without resetting when it was fetched
+	reparsed = NodeTypes(csvDir=str(tmp_path), htmlSource=htmlSource)
+	assert reparsed.readCacheMetadata()['fetchedAt'] == archivedAt
+	assert list(reparsed.df.index) == list(nodeTypes.df.index)
+
+	# The archive is as old as its file, and is not mistaken for the live page
+	assert nodeTypes.isCacheFresh(maxStaleness=10 ** 10)
+	assert not nodeTypes.isCacheFresh(maxStaleness=3600)
+	nodeTypes.sourceInfo = {'pageLink': nodeTypes.pageLink}
+	assert not nodeTypes.isCacheFresh(maxStaleness=10 ** 10)
+
+	# A newer archive is a different source, so it is parsed again
+	os.utime(htmlSource, (archivedAt + 60, archivedAt + 60))
+	updated = NodeTypes(csvDir=str(tmp_path), htmlSource=htmlSource, maxStaleness=10 ** 10)
+	assert not updated.loadCsv
+	assert updated.readCacheMetadata()['fetchedAt'] == archivedAt + 60
@@ -0,0 +1,75 @@
+import os
+import json
+
+from priceParsing.offerFile import COMPUTE_INSTANCE_FAMILIES, OFFER_COLUMNS, readOfferPrices
+from priceParsing.onDemand import OnDemand
+
+
+TRIMMED_OFFER_FILE = os.path.join(os.path.dirname(__file__), '..', 'benchmarks', 'data', 'ec2-offer-trimmed.json')
+
+
+
+
+def makeProduct(sku, instanceType, productFamily='Compute Instance', **attributes):
+	product = {'sku': sku,
+	           'productFamily': productFamily,
+	           'attributes': {'instanceType': instanceType, 'vcpu': '2', 'memory': '8 GiB', 'storage': 'EBS only',
+	                          'networkPerformance': 'Up to 10 Gigabit', 'regionCode': 'ap-southeast-2'}}
+	product['attributes'].update(dict(OnDemand.offerFilters, **attributes))
+
+	return product
+
+
+def makeTerm(sku, price):
+	return {sku + '.JRTCKXETXF': {'sku': sku, 'priceDimensions': {
+		sku + '.JRTCKXETXF.6YS6EN2CT7': {'unit': 'Hrs', 'pricePerUnit': {'USD': str(price)}}}}}
+
+
+def testOfferFileKeepsMetalAndTheWebpageSku(tmp_path):
+	products = [makeProduct('B', 'm5.large', licenseModel='Bring your own license'),
+	            makeProduct('C', 'm5.large', operation='RunInstances:0004'),
+	            makeProduct('D', 'm5.large', capacitystatus='UnusedCapacityReservation'),
+	            makeProduct('E', 'm5.large'),
+	            makeProduct('F', 'm5.metal', productFamily='Compute Instance (bare metal)'),
+	            makeProduct('G', 'm5.metal', productFamily='Dedicated Host')]
+	prices = {'B': 0.05, 'C': 0.5, 'D': 0.06, 'E': 0.12, 'F': 5.4, 'G': 6.0}
+	offerFile = tmp_path / 'ec2-offer.json'
+	with open(offerFile, 'w') as f:
+		json.dump({'products': {product['sku']: product for product in products},
+		           'terms': {'OnDemand': {sku: makeTerm(sku, price) for sku, price in prices.items()}}}, f)
+
+	onDemand = OnDemand(csvDir=str(tmp_path), offerFile=str(offerFile))
+	assert onDemand.df['Linux/UNIX Usage'].to_dict() == {'m5.large': 0.12, 'm5.metal': 5.4}
+
+
+def loadOfferPrices(offerFile, regionId, attributeFilters):
+	"""
+	Read the same rows as readOfferPrices by loading the whole offer file into memory.
+	"""
+	with open(offerFile, 'r') as f:
+		offer = json.load(f)
+
+	rows = []
+	for sku, product in offer['products'].items():
+		attributes = product['attributes']
+		if product['productFamily'] not in COMPUTE_INSTANCE_FAMILIES or attributes.get('regionCode') != regionId:
+			continue
+		if any(attributes.get(key) != value for key, value in attributeFilters.items()):
+			continue
+		for term in offer['terms']['OnDemand'].get(sku, {}).values():
+			for dimension in term['priceDimensions'].values():
+				if dimension['unit'] == 'Hrs' and 'USD' in dimension['pricePerUnit']:
+					row = {column: attributes.get(key) for key, column in OFFER_COLUMNS.items()}
+					row['Price'] = float(dimension['pricePerUnit']['USD'])
+					row['Sku'] = sku
+					rows.append(row)
+
+	return rows
+
+
+def testStreamedOfferFileMatchesJsonLoad():
+	streamed = readOfferPrices(TRIMMED_OFFER_FILE, 'ap-southeast-2', OnDemand.offerFilters)
+	loaded = loadOfferPrices(TRIMMED_OFFER_FILE, 'ap-southeast-2', OnDemand.offerFilters)
+
+	assert sorted(streamed, key=lambda row: row['Sku']) == sorted(loaded, key=lambda row: row['Sku'])
+	assert sorted(row['InstanceType'] for row in streamed) == ['c5.xlarge', 'i3.large', 'm5.large', 't3.micro']
@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from priceParsing.priceQuery import PriceQueryEngine
+
+
+
+
+def makeCombinedFrame(rows=300, seed=0):
+	rng = np.random.default_rng(seed)
+	vCPU = rng.choice([1, 2, 4, 8, 16, 32, 64, 96], rows).astype(float)
+	onDemand = vCPU * rng.uniform(0.03, 0.09, rows)
+	spot = onDemand * rng.uniform(0.2, 0.7, rows)
+	spot[rng.random(rows) < 0.1] = np.nan
+	gpus = np.where(rng.random(rows) < 0.2, rng.choice([1, 4, 8], rows), np.nan)
+	index = pd.MultiIndex.from_arrays([rng.choice(['General', 'Compute', 'Accelerated'], rows),
+	                                   ['type%i.size' % i for i in range(rows)]], names=['GroupType', 'index'])
+
+	return pd.DataFrame({'SpotPrice': spot, 'On-Demand': onDemand, 'SpotProp%': 100.0 * spot / onDemand,
+	                     'vCPU': vCPU, 'Mem (GiB)': vCPU * rng.choice([2.0, 4.0, 8.0], rows), 'GPUs': gpus},
+	                    index=index)
+
+
+def queryWithPandas(df, minimums=None, maximums=None, gpu=None, objective='SpotPrice', k=10, ascending=True):
+	df = PriceQueryEngine.addDerivedMetrics(df)
+	mask = pd.Series(True, index=df.index)
+	for column, minimum in (minimums or {}).items():
+		mask &= df[column] >= minimum
+	for column, maximum in (maximums or {}).items():
+		mask &= df[column] <= maximum
+	if gpu is True:
+		mask &= df['GPUs'] >= 1
+	elif gpu is False:
+		mask &= df['GPUs'].isna() | (df['GPUs'] == 0)
+	df = df[mask & df[objective].notna()]
+
+	return df.sort_values(objective, ascending=ascending, kind='stable').head(k)
+
+
+@pytest.fixture(scope='module')
+def combined():
+	return makeCombinedFrame()
+
+
+@pytest.mark.parametrize('arguments', [
+	{},
+	{'minimums': {'vCPU': 16, 'Mem (GiB)': 64}},
+	{'minimums': {'vCPU': 4}, 'maximums': {'vCPU': 16, 'SpotPrice': 0.5}},
+	{'gpu': True, 'objective': 'Spot $/vCPU-hr'},
+	{'gpu': False, 'minimums': {'Mem (GiB)': 32}, 'objective': 'On-Demand $/GiB-hr'},
+	{'objective': 'SpotSavings%', 'ascending': False, 'k': 25},
+	{'minimums': {'vCPU': 1000}},
+])
+def testQueryMatchesPandas(combined, arguments):
+	result = PriceQueryEngine(combined).query(**arguments)
+	expected = queryWithPandas(combined, **arguments)
+
+	assert list(result.index) == list(expected.index)
+
+
+def testKLargerThanTheCandidatesReturnsThemAll(combined):
+	engine = PriceQueryEngine(combined)
+	expected = queryWithPandas(combined, gpu=True, k=len(combined))
+
+	assert list(engine.query(gpu=True, k=len(combined) * 10).index) == list(expected.index)
+	assert engine.query(k=1).shape[0] == 1
+
+
+@pytest.mark.parametrize('k', [0, -3])
+def testKBelowOneIsRejected(combined, k):
+	with pytest.raises(ValueError):
+		PriceQueryEngine(combined).query(k=k)
+
+
+def testUnknownColumnsAreRejected(combined):
+	engine = PriceQueryEngine(combined)
+	with pytest.raises(KeyError):
+		engine.query(minimums={'Cores': 4})
+	with pytest.raises(KeyError):
+		engine.query(objective='Cores')
@@ -0,0 +1,151 @@
+import json
+import urllib.error
+import urllib.request
+from urllib.parse import parse_qs
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from priceService import PriceService, parseQueryArguments
+
+
+
+
+def makeCombinedFrame():
+	index = pd.MultiIndex.from_tuples([('General', 'm5.large'), ('General', 'm5.4xlarge'), ('Compute', 'c5.large'),
+	                                   ('Accelerated', 'g4dn.xlarge')], names=['GroupType', 'index'])
+	return pd.DataFrame({'SpotPrice': [0.04, 0.3, 0.035, 0.2], 'On-Demand': [0.12, 0.96, 0.111, 0.684],
+	                     'SpotProp%': [33.3, 31.2, 31.5, 29.2], 'vCPU': [2.0, 16.0, 2.0, 4.0],
+	                     'Mem (GiB)': [8.0, 64.0, 4.0, 16.0], 'GPUs': [np.nan, np.nan, np.nan, 1.0]}, index=index)
+
+
+class StubSource:
+	def __init__(self, fetchedAt):
+		self.fetchedAt = fetchedAt
+
+
+	def readCacheMetadata(self):
+		return None if self.fetchedAt is None else {'fetchedAt': self.fetchedAt}
+
+
+class StubAllPrices:
+	"""
+	A stand-in AllPrices serving a fixed combined dataframe and recording the sources it was asked to refresh.
+	"""
+	def __init__(self, maxStaleness=None, fetchedAt=None):
+		self.maxStaleness = {} if maxStaleness is None else maxStaleness
+		self.refreshed = []
+		for name in ['spotPrices', 'onDemandPrices']:
+			setattr(self, name, StubSource(None if fetchedAt is None else fetchedAt.get(name)))
+
+
+	def parseAllPrices(self):
+		return makeCombinedFrame()
+
+
+	def refreshSources(self, names):
+		self.refreshed.append(list(names))
+		return makeCombinedFrame()
+
+
+
+
+@pytest.fixture
+def service():
+	service = PriceService(StubAllPrices(), refreshIntervals={'spotPrices': 3600, 'onDemandPrices': 7200}, port=0)
+	service.start()
+	service.port = service.server.server_address[1]
+	yield service
+	service.stop()
+
+
+def getJson(service, path):
+	try:
+		with urllib.request.urlopen('http://%s:%i%s' % (service.host, service.port, path)) as response:
+			return response.status, json.loads(response.read())
+	except urllib.error.HTTPError as e:
+		return e.code, json.loads(e.read())
+
+
+def testParseQueryArguments():
+	params = parse_qs('min.vCPU=16&min.Mem%20(GiB)=64&max.SpotPrice=1.5&gpu=false&objective=On-Demand&k=5&ascending=no')
+	assert parseQueryArguments(params) == {'minimums': {'vCPU': 16.0, 'Mem (GiB)': 64.0},
+	                                       'maximums': {'SpotPrice': 1.5}, 'gpu': False, 'objective': 'On-Demand',
+	                                       'k': 5, 'ascending': False}
+	assert parseQueryArguments(parse_qs('gpu=true')) == {'minimums': {}, 'maximums': {}, 'gpu': True}
+	with pytest.raises(ValueError):
+		parseQueryArguments(parse_qs('k=five'))
+
+
+def testPricesHandler(service):
+	status, rows = getJson(service, '/prices')
+	assert status == 200
+	assert [row['index'] for row in rows] == ['m5.large', 'm5.4xlarge', 'c5.large', 'g4dn.xlarge']
+
+	status, rows = getJson(service, '/prices/c5.large')
+	assert [(row['GroupType'], row['index'], row['SpotPrice']) for row in rows] == [('Compute', 'c5.large', 0.035)]
+
+	status, rows = getJson(service, '/prices?group=General&limit=1')
+	assert [row['index'] for row in rows] == ['m5.large']
+
+
+def testQueryHandler(service):
+	status, rows = getJson(service, '/query?min.vCPU=2&gpu=false&objective=SpotPrice&k=2')
+	assert status == 200
+	assert [row['index'] for row in rows] == ['c5.large', 'm5.large']
+
+	status, rows = getJson(service, '/query?gpu=true')
+	assert [row['index'] for row in rows] == ['g4dn.xlarge']
+
+	# Bad queries are reported as client errors
+	for path in ['/query?k=0', '/query?min.Cores=4', '/query?k=five']:
+		status, body = getJson(service, path)
+		assert status == 400
+		assert 'error' in body
+
+
+def testHealthHandler(service):
+	status, health = getJson(service, '/health')
+	assert status == 200
+	assert health['version'] == 1
+	assert health['rows'] == 4
+	assert health['errors'] == {}
+	assert sorted(health['lastRefresh']) == ['onDemandPrices', 'spotPrices']
+
+	assert getJson(service, '/unknown')[0] == 404
+
+
+def testStartKeepsTheGivenMaxStaleness():
+	maxStaleness = {'spotPrices': 60}
+	service = PriceService(StubAllPrices(maxStaleness=maxStaleness), refreshIntervals={'spotPrices': 3600}, port=0)
+	service.start()
+	service.stop()
+	assert service.allPrices.maxStaleness == {'spotPrices': 60}
+
+	service = PriceService(StubAllPrices(), refreshIntervals={'spotPrices': 3600}, port=0)
+	service.start()
+	service.stop()
+	assert service.allPrices.maxStaleness == {'spotPrices': 3600}
+
+
+def testSourcesAreDueOnTheirOwnIntervals():
+	allPrices = StubAllPrices(fetchedAt={'spotPrices': 1000.0})
+	service = PriceService(allPrices, refreshIntervals={'spotPrices': 900, 'onDemandPrices': 7200}, port=0)
+
+	# Sources without cache metadata are scheduled from now, the scheduler thread is stopped before it runs
+	service.stopEvent.set()
+	service.start()
+	service.stop()
+	assert service.lastRefresh['spotPrices'] == 1000.0
+	now = service.lastRefresh['onDemandPrices']
+	assert service.getNextDue() == {'spotPrices': 1900.0, 'onDemandPrices': now + 7200}
+
+	assert service.getDueSources(1899.0) == []
+	assert service.getDueSources(1900.0) == ['spotPrices']
+	assert service.getDueSources(now + 7200) == ['spotPrices', 'onDemandPrices']
+
+	service.refreshSource('spotPrices')
+	assert allPrices.refreshed == [['spotPrices']]
+	assert service.snapshot.version == 2
+	assert service.getDueSources(now + 900) == []
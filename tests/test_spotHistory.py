@@ -0,0 +1,102 @@
+import pandas as pd
+import pytest
+
+from parseAndCombinePrices import AllPrices
+from priceParsing.spotHistory import SpotPriceHistory
+from priceParsing.spotPrices import SpotPrices
+
+
+
+
+class PagedClient:
+	"""
+	A stand-in ec2 client serving spot price history newest first, a page at a time, optionally failing on one page.
+	"""
+	def __init__(self, records, pageSize, failOnPage=None):
+		self.records = records
+		self.pageSize = pageSize
+		self.failOnPage = failOnPage
+		self.requests = []
+
+
+	def describe_spot_price_history(self, **request):
+		self.requests.append(request)
+		records = [r for r in self.records if 'StartTime' not in request or r['Timestamp'] >= request['StartTime']]
+		page = int(request.get('NextToken', 0))
+		if page == self.failOnPage:
+			raise ConnectionError('Connection reset on page %i.' % page)
+
+		start = page * self.pageSize
+		response = {'SpotPriceHistory': records[start:start + self.pageSize]}
+		if start + self.pageSize < len(records):
+			response['NextToken'] = str(page + 1)
+
+		return response
+
+
+
+
+def makeRecords(count):
+	end = pd.Timestamp('2024-03-10', tz='UTC')
+	return [{'InstanceType': 'm5.size%i' % (i % 7),
+	         'ProductDescription': 'Linux/UNIX',
+	         'SpotPrice': '%.4f' % (0.1 + i / 1000.0),
+	         'Timestamp': (end - pd.Timedelta(hours=i)).to_pydatetime(),
+	         'AvailabilityZone': 'ap-southeast-2a'}
+	        for i in range(count)]
+
+
+class ChunkedSpotPrices(SpotPrices):
+	"""
+	Spot prices synced in small chunks, so a sync stores some chunks before a later page fails.
+	"""
+	def syncHistory(self, client, chunkSize=20):
+		return super().syncHistory(client, chunkSize=chunkSize)
+
+
+
+
+def syncSpotPrices(tmp_path, client):
+	return ChunkedSpotPrices(csvDir=str(tmp_path), regionId='ap-southeast-2', subRegion='a', snapshotOnly=False,
+	                         incremental=True, client=client)
+
+
+def testFailedSyncResumesFromTheStart(tmp_path):
+	records = makeRecords(50)
+	newestTimestamp = pd.Timestamp(records[0]['Timestamp'])
+
+	# The first sync stores the newest chunk then fails, which must not mark the zone as synced
+	with pytest.raises(ConnectionError):
+		syncSpotPrices(tmp_path, PagedClient(records, pageSize=10, failOnPage=2))
+	history = SpotPriceHistory(historyDir=str(tmp_path / 'spot-history'))
+	assert history.getHistory('ap-southeast-2a').shape[0] == 20
+	assert history.getLastTimestamp('ap-southeast-2a') is None
+
+	# Resuming requests the whole delta again and stores the older records too
+	client = PagedClient(records, pageSize=10)
+	spotPrices = syncSpotPrices(tmp_path, client)
+	assert 'StartTime' not in client.requests[0]
+	assert spotPrices.history.getHistory('ap-southeast-2a').shape[0] == len(records)
+	assert spotPrices.history.getLastTimestamp('ap-southeast-2a') == newestTimestamp
+	assert spotPrices.df.shape[0] == 7
+
+
+def testSyncRequestsOnlyTheDelta(tmp_path):
+	records = makeRecords(50)
+	syncSpotPrices(tmp_path, PagedClient(records[10:], pageSize=10))
+
+	client = PagedClient(records, pageSize=10)
+	spotPrices = syncSpotPrices(tmp_path, client)
+	assert client.requests[0]['StartTime'] == pd.Timestamp(records[10]['Timestamp'])
+	assert spotPrices.history.getHistory('ap-southeast-2a').shape[0] == len(records)
+	assert spotPrices.history.getLastTimestamp('ap-southeast-2a') == pd.Timestamp(records[0]['Timestamp'])
+
+
+def testSpotStatisticsSyncTheHistoryStore(tmp_path, monkeypatch):
+	records = makeRecords(50)
+	monkeypatch.setattr(SpotPrices, 'createClient', lambda self: PagedClient(records, pageSize=10))
+
+	allPrices = AllPrices(csvDir=str(tmp_path), regionId='ap-southeast-2', subRegion='a', spotStatistics=True)
+	header, collector = allPrices.getCollectors(spotPrices=True)['spotPrices']
+	collector()
+	assert allPrices.spotHistory.getHistory('ap-southeast-2a').shape[0] == len(records)
@@ -0,0 +1,87 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from parseAndCombinePrices import AllPrices
+
+
+
+
+INSTANCE_TYPES = ['m5.large', 'm5.xlarge', 'c5.large', 'p3.2xlarge']
+
+
+def makeSources(spotPrices, count=len(INSTANCE_TYPES)):
+	"""
+	Build stand-in parsed sources, each holding the dataframe a parser would, for the first count instance types.
+	"""
+	index = pd.Index(INSTANCE_TYPES, name='InstanceType')
+	nodeTypes = pd.DataFrame({'vCPU': [2.0, 4.0, 2.0, 8.0], 'Mem (GiB)': [8.0, 16.0, 4.0, 61.0],
+	                          'Storage': ['EBS-Only', 'EBS-Only', '1 x 50 NVMe SSD', 'EBS-Only'],
+	                          'Storage (GB)': [0.0, 0.0, 50.0, 0.0], 'Storage Medium': ['EBS', 'EBS', 'NVMe SSD', 'EBS'],
+	                          'GPUs': [np.nan, np.nan, np.nan, 1.0], 'GPU Mem (GiB)': [np.nan, np.nan, np.nan, 16.0],
+	                          'EBS Bandwidth': ['Up to 4,750'] * 4, 'EBS Baseline (Mbps)': [np.nan] * 4,
+	                          'EBS Burst (Mbps)': [4750.0] * 4, 'Network Baseline (Gbps)': [np.nan] * 4,
+	                          'Network Burst (Gbps)': [10.0] * 4}, index=index)
+
+	sources = {'spotPrices': pd.DataFrame({'SpotPrice': spotPrices}, index=index[:len(spotPrices)]),
+	        'definedDurationPrices': pd.DataFrame({'GroupType': ['General', 'General', 'Compute', 'Accelerated'],
+	                                               '1-Hour Reserved': [0.05, 0.1, 0.04, 1.5],
+	                                               '6-Hour Reserved': [0.06, 0.12, 0.05, 1.8]}, index=index),
+	        'onDemandPrices': pd.DataFrame({'Linux/UNIX Usage': [0.12, 0.24, 0.11, 3.06]}, index=index),
+	        'nodeTypes': nodeTypes}
+	return {name: df if name == 'spotPrices' else df.iloc[:count] for name, df in sources.items()}
+
+
+def makeAllPrices(csvDir, sources, compact):
+	csvDir.mkdir(exist_ok=True)
+	allPrices = AllPrices(csvDir=str(csvDir), compact=compact)
+	for name, df in sources.items():
+		setattr(allPrices, name, SimpleNamespace(df=df))
+	if compact:
+		allPrices.compactSources()
+
+	return allPrices
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def testUpdateMatchesAFullCombine(tmp_path, compact):
+	allPrices = makeAllPrices(tmp_path / 'updated', makeSources([0.03, 0.07, 0.02, 0.9]), compact)
+	allPrices.generateDataFrame()
+
+	# Spot prices move, and one instance type is no longer listed
+	sources = makeSources([0.04, 0.05, 0.02])
+	allPrices.spotPrices = SimpleNamespace(df=sources['spotPrices'])
+	if compact:
+		allPrices.compactSources(['spotPrices'])
+	updated = allPrices.updateDataFrame(['spotPrices'])
+
+	combined = makeAllPrices(tmp_path / 'combined', sources, compact).combineDataFrames()
+	pd.testing.assert_frame_equal(updated, combined)
+	assert [change['column'] for change in allPrices.lastDiff.toRecord()['changes']] == ['SpotPrice'] * 3
+
+
+def testUpdateWithNewInstanceTypesRebuilds(tmp_path, capsys):
+	allPrices = makeAllPrices(tmp_path / 'updated', makeSources([0.03, 0.07, 0.02], count=3), compact=False)
+	allPrices.generateDataFrame()
+
+	# Spot prices list an instance type no other source does yet
+	sources = makeSources([0.03, 0.07, 0.02, 0.9], count=3)
+	allPrices.spotPrices = SimpleNamespace(df=sources['spotPrices'])
+	updated = allPrices.updateDataFrame(['spotPrices'])
+
+	assert 'rebuilding the combined dataframe' in capsys.readouterr().out
+	assert updated.shape[0] == 4
+	combined = makeAllPrices(tmp_path / 'combined', sources, compact=False).combineDataFrames()
+	pd.testing.assert_frame_equal(updated, combined)
+
+
+def testUnchangedUpdateKeepsTheSnapshot(tmp_path):
+	allPrices = makeAllPrices(tmp_path, makeSources([0.03, 0.07, 0.02, 0.9]), compact=False)
+	df = allPrices.generateDataFrame()
+	lastDiff = allPrices.lastDiff
+
+	allPrices.spotPrices = SimpleNamespace(df=makeSources([0.03, 0.07, 0.02, 0.9])['spotPrices'])
+	assert allPrices.updateDataFrame(['spotPrices']) is df
+	assert allPrices.lastDiff is lastDiff